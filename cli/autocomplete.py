@@ -0,0 +1,154 @@
+'''
+as-you-type title suggestions.
+
+Every title is filed under each of its word starts ("the matrix" under
+"the matrix" and "matrix") in one sorted array of keys, so the titles
+completing a prefix are one contiguous range found with two bisects.
+Titles are numbered best first (popularity, then shorter, then
+alphabetical), which makes the best completions the smallest numbers in
+the range. A range of at most SCAN_LIMIT keys is scanned per keystroke;
+the larger ones, the short prefixes typed first, keep their top N
+precomputed, so every keystroke costs two bisects plus a bounded amount
+of work whatever the number of titles.
+
+The built structure is cached as json next to the index and rebuilt when
+the movies file changes.
+'''
+import heapq
+import json
+import os
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Iterable
+from document_source import MOVIES_PATH, iter_documents
+from helpers import simplify
+
+AUTOCOMPLETE_PATH = Path("cache/autocomplete.json")
+#documents may carry a popularity score, titles without one rank by length
+POPULARITY_KEY = "popularity"
+DEFAULT_TOP_N = 10
+#ranges up to this many keys are scanned per keystroke, larger ones keep a precomputed top N
+SCAN_LIMIT = 64
+KEYSTROKE_BUDGET_MS = 1.0
+#sorts after every character a key can contain
+LAST_CHAR = "\U0010ffff"
+
+
+def normalise(text: str) -> str:
+    ''' lowercase words without punctuation, single spaced; a trailing space is kept so "the " doesn't match "theory" '''
+    normalised = " ".join(simplify(text).split())
+    if normalised and text[-1:].isspace():
+        normalised += " "
+    return normalised
+
+
+def word_starts(text: str) -> list[int]:
+    return [0] + [i + 1 for i, char in enumerate(text) if char == " "]
+
+
+class TitleAutocomplete:
+
+    def __init__(self, titles: list[str], keys: list[str], key_titles: list[int],
+                 tops: dict[str, list[int]] | None = None, top_n: int = DEFAULT_TOP_N):
+        #titles best first, a smaller title number is a better completion
+        self.titles = titles
+        #sorted, key_titles[i] is the title numbered keys[i] belongs to
+        self.keys = keys
+        self.key_titles = key_titles
+        self.top_n = top_n
+        self.tops = tops if tops is not None else self.__precompute()
+
+    @classmethod
+    def build(cls, movies: Iterable[dict], top_n: int = DEFAULT_TOP_N,
+              popularity: str = POPULARITY_KEY) -> "TitleAutocomplete":
+        #one entry per normalised title, the most popular spelling wins
+        best = {}
+        for movie in movies:
+            key = normalise(movie["title"])
+            score = movie.get(popularity) or 0
+            if key and (key not in best or score > best[key][0]):
+                best[key] = (score, movie["title"])
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], len(item[0]), item[0]))
+        entries = sorted((key[start:], number) for number, (key, _) in enumerate(ranked) for start in word_starts(key))
+        return cls([title for _, (_, title) in ranked], [key for key, _ in entries],
+                   [number for _, number in entries], top_n=top_n)
+
+    def __best(self, start: int, end: int, limit: int) -> list[int]:
+        return heapq.nsmallest(limit, set(self.key_titles[start:end]))
+
+    def __precompute(self) -> dict[str, list[int]]:
+        ''' top N of every prefix matching more than SCAN_LIMIT keys '''
+        tops = {}
+        stack = [("", 0, len(self.keys))]
+        while stack:
+            prefix, start, end = stack.pop()
+            if end - start <= SCAN_LIMIT:
+                continue
+            tops[prefix] = self.__best(start, end, self.top_n)
+            depth = len(prefix)
+            #a key equal to the prefix sorts first, the others split by their next character
+            while start < end and len(self.keys[start]) == depth:
+                start += 1
+            while start < end:
+                child = prefix + self.keys[start][depth]
+                child_end = bisect_left(self.keys, child + LAST_CHAR, start, end)
+                stack.append((child, start, child_end))
+                start = child_end
+        return tops
+
+    def complete(self, prefix: str, limit: int | None = None) -> list[str]:
+        ''' up to limit (at most top_n) titles with a word starting with prefix, best first '''
+        limit = self.top_n if limit is None else min(limit, self.top_n)
+        key = normalise(prefix)
+        start = bisect_left(self.keys, key)
+        end = bisect_left(self.keys, key + LAST_CHAR, start)
+        numbers = self.tops[key][:limit] if end - start > SCAN_LIMIT else self.__best(start, end, limit)
+        return [self.titles[number] for number in numbers]
+
+    def save(self, path: Path, version: str):
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "top_n": self.top_n, "titles": self.titles, "keys": self.keys,
+                       "key_titles": self.key_titles, "tops": self.tops}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path, version: str) -> "TitleAutocomplete | None":
+        ''' the saved structure, None if there is none or it was built from another version of the movies '''
+        if not path.exists():
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved["version"] != version:
+            return None
+        return cls(saved["titles"], saved["keys"], saved["key_titles"], saved["tops"], saved["top_n"])
+
+
+def load_autocomplete(movies_path: Path = MOVIES_PATH, path: Path = AUTOCOMPLETE_PATH,
+                      top_n: int = DEFAULT_TOP_N) -> TitleAutocomplete:
+    ''' the cached autocomplete of the movies file, built first if the file changed '''
+    from result_cache import file_version
+
+    version = file_version(movies_path)
+    completer = TitleAutocomplete.load(path, version)
+    if completer is None or completer.top_n != top_n:
+        completer = TitleAutocomplete.build(iter_documents(movies_path), top_n)
+        completer.save(path, version)
+    return completer
+
+
+def autocomplete(prefix: str, limit: int = DEFAULT_TOP_N, completer: TitleAutocomplete | None = None) -> list[str]:
+    ''' titles completing prefix, keep the completer around when calling once per keystroke '''
+    return (completer or load_autocomplete()).complete(prefix, limit)
+
+
+def keystroke_latencies(completer: TitleAutocomplete, text: str, limit: int = DEFAULT_TOP_N) -> list[tuple[str, float, list[str]]]:
+    ''' (prefix, milliseconds, completions) for text typed one character at a time '''
+    latencies = []
+    for end in range(1, len(text) + 1):
+        start = time.perf_counter()
+        completions = completer.complete(text[:end], limit)
+        latencies.append((text[:end], (time.perf_counter() - start) * 1000, completions))
+    return latencies
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import argparse
+from pathlib import Path
+from document_source import iter_documents
+import numpy as np
+from lib.benchmarks import bm25_benchmark, build_benchmark, parallel_build_benchmark, embedding_build_benchmark, tokenise_benchmark
+from lib.benchmarks import ann_benchmark, quantization_benchmark, synthetic_embeddings
+from lib.benchmarks import SyntheticSemantic, autocomplete_benchmark, batching_benchmark, boolean_benchmark, startup_benchmark
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks CLI")
+    subparsers = parser.add_subparsers(dest="command", help="Available benchmarks")
+
+    bm25_parser = subparsers.add_parser("bm25", help="BM25 query latency as the corpus grows")
+    bm25_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000, 50000], help="corpus sizes")
+    bm25_parser.add_argument("--queries", type=int, default=20, help="number of queries per size")
+
+    build_parser = subparsers.add_parser("build", help="Index build time and resident memory")
+    build_parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000], help="corpus sizes")
+    build_parser.add_argument("--doc-len", type=int, default=20, help="average words per description")
+
+    parallel_parser = subparsers.add_parser("parallel_build", help="Sharded index build time per worker count")
+    parallel_parser.add_argument("--docs", type=int, default=100000, help="number of synthetic documents")
+    parallel_parser.add_argument("--workers", type=int, nargs="+", default=[0, 2, 4], help="worker counts")
+
+    tokenise_parser = subparsers.add_parser("tokenise", help="Tokenisation speed, old functions vs the shared Tokenizer")
+    tokenise_parser.add_argument("--docs", type=int, default=2000, help="number of synthetic documents")
+
+    boolean_parser = subparsers.add_parser("boolean", help="AND query latency over common terms, galloping cursors vs set intersection")
+    boolean_parser.add_argument("--docs", type=int, default=100000, help="number of synthetic documents")
+    boolean_parser.add_argument("--queries", type=int, default=20, help="number of queries")
+
+    autocomplete_parser = subparsers.add_parser("autocomplete", help="per keystroke title autocomplete latency, prefix array vs full scan")
+    autocomplete_parser.add_argument("--docs", type=int, default=100000, help="number of synthetic titles")
+    autocomplete_parser.add_argument("--typed", type=int, default=200, help="titles typed one character at a time")
+
+    embed_parser = subparsers.add_parser("embed_build", help="Embedding build throughput in documents per second")
+    embed_parser.add_argument("--docs", type=int, default=2000, help="number of synthetic documents")
+    embed_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 128], help="encode batch sizes")
+    embed_parser.add_argument("--workers", type=int, nargs="+", default=[0], help="CPU encoding process counts")
+
+    ann_parser = subparsers.add_parser("ann", help="recall@k vs queries per second of the ANN indexes")
+    ann_parser.add_argument("--embeddings", type=str, default=None, help=".npy matrix to index, e.g. cache/embeddings.npy (default: synthetic)")
+    ann_parser.add_argument("--docs", type=int, default=5000, help="number of synthetic vectors")
+    ann_parser.add_argument("-k", type=int, default=10, help="results per query")
+    ann_parser.add_argument("--nprobes", type=int, nargs="+", default=[1, 4, 16], help="ivf lists scanned per query")
+    ann_parser.add_argument("--efs", type=int, nargs="+", default=[16, 50, 200], help="hnsw candidate list sizes")
+
+    quant_parser = subparsers.add_parser("quantization", help="memory and recall@k of each embedding storage precision")
+    quant_parser.add_argument("--embeddings", type=str, default=None, help=".npy matrix, e.g. cache/embeddings.npy (default: synthetic)")
+    quant_parser.add_argument("--docs", type=int, default=5000, help="number of synthetic vectors")
+    quant_parser.add_argument("-k", type=int, default=10, help="results per query")
+    quant_parser.add_argument("--reranks", type=int, nargs="+", default=[0, 4], help="candidates per result re-scored exactly")
+    quant_parser.add_argument("--subspaces", type=int, default=48, help="pq subspaces, must divide the dimension")
+
+    batching_parser = subparsers.add_parser("batching", help="semantic QPS under concurrent load, per query vs micro-batched")
+    batching_parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="concurrent callers")
+    batching_parser.add_argument("--queries", type=int, default=256, help="queries per run")
+    batching_parser.add_argument("--max-batch", type=int, default=32, help="most queries per batch")
+    batching_parser.add_argument("--synthetic", type=int, default=0, help="use N synthetic documents instead of the model and data/movies.json")
+
+    startup_parser = subparsers.add_parser("startup", help="wall time and import costs of fresh chunk and tf processes")
+    startup_parser.add_argument("--repeat", type=int, default=5, help="runs per command, the best is reported")
+    startup_parser.add_argument("--top", type=int, default=5, help="slowest top level imports listed per command")
+
+    args = parser.parse_args()
+
+    match args.command:
+        case "bm25":
+            bm25_benchmark(args.sizes, args.queries)
+        case "build":
+            build_benchmark(args.sizes, args.doc_len)
+        case "parallel_build":
+            parallel_build_benchmark(args.docs, args.workers)
+        case "tokenise":
+            tokenise_benchmark(args.docs)
+        case "boolean":
+            boolean_benchmark(args.docs, args.queries)
+        case "autocomplete":
+            autocomplete_benchmark(args.docs, args.typed)
+        case "embed_build":
+            embedding_build_benchmark(args.docs, args.batch_sizes, args.workers)
+        case "ann":
+            embeddings = np.load(Path(args.embeddings)) if args.embeddings else synthetic_embeddings(args.docs)
+            ann_benchmark(embeddings, args.k, nprobes=args.nprobes, efs=args.efs)
+        case "quantization":
+            embeddings = np.load(Path(args.embeddings)) if args.embeddings else synthetic_embeddings(args.docs)
+            quantization_benchmark(embeddings, args.k, reranks=args.reranks, subspaces=args.subspaces)
+        case "batching":
+            if args.synthetic:
+                searcher = SyntheticSemantic(args.synthetic)
+            else:
+                from lib.semantic_search import SemanticSearch
+                searcher = SemanticSearch()
+                searcher.load_or_create_embeddings(iter_documents())
+            batching_benchmark(searcher, args.clients, args.queries, args.max_batch)
+        case "startup":
+            startup_benchmark(repeat=args.repeat, top=args.top)
+        case _:
+            parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
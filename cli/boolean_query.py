@@ -0,0 +1,290 @@
+'''
+boolean queries over the keyword index:
+
+    space AND (bear OR bears) AND NOT honey
+    space (bear OR bears) -honey        the same query, AND is implied
+
+AND, OR and NOT are operators only in capitals, words go through the same
+tokeniser as the documents (a stop word matches everything and drops out,
+a word splitting into several tokens needs all of them).
+
+Every node of a parsed query becomes a cursor over doc ids in increasing
+order with one operation, seek(target): move to the first doc id >= target.
+Seeking a posting list gallops (1, 2, 4, ... entries ahead, then a binary
+search inside the last step), and AND leapfrogs its children rarest first,
+so a conjunction costs about the rarest list times the log of the gaps
+instead of the sum of every list. NOT under AND is only probed with the
+candidates; a NOT on its own walks the complement of its child over every
+doc id. Matches are generated lazily, a caller stopping after five never
+evaluates the rest of the query.
+'''
+import re
+from bisect import bisect_left
+from typing import Iterator, Sequence
+from helpers import tokenise
+
+#past the largest doc id, uint32 in the index file
+END = 1 << 32
+#a dash is its own token only in front of a word or (, spider-man stays one word
+QUERY_TOKEN = re.compile(r"\(|\)|-(?=[^\s)])|[^\s()]+")
+
+
+def gallop(doc_ids: Sequence[int], target: int, lo: int = 0) -> int:
+    ''' first i >= lo with doc_ids[i] >= target, probing lo + 1, 2, 4, ... before bisecting '''
+    n = len(doc_ids)
+    if lo >= n or doc_ids[lo] >= target:
+        return lo
+    #doc_ids[lo] < target from here on
+    step = 1
+    hi = lo + 1
+    while hi < n and doc_ids[hi] < target:
+        lo = hi
+        step *= 2
+        hi = lo + step
+    return bisect_left(doc_ids, target, lo + 1, min(hi, n))
+
+
+class Term:
+
+    def __init__(self, token: str):
+        self.token = token
+
+    def __repr__(self):
+        return f"Term({self.token!r})"
+
+
+class And:
+
+    def __init__(self, children: list):
+        self.children = children
+
+    def __repr__(self):
+        return f"And({self.children!r})"
+
+
+class Or:
+
+    def __init__(self, children: list):
+        self.children = children
+
+    def __repr__(self):
+        return f"Or({self.children!r})"
+
+
+class Not:
+
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f"Not({self.child!r})"
+
+
+def _combine(node_type, children: list):
+    children = [child for child in children if child is not None]
+    if not children:
+        return None
+    return children[0] if len(children) == 1 else node_type(children)
+
+
+class _Parser:
+    '''
+    recursive descent, loosest first:
+
+        query := and (OR and)*
+        and   := unary (AND? unary)*
+        unary := NOT unary | - unary | ( query ) | word
+    '''
+
+    def __init__(self, query: str):
+        self.tokens = QUERY_TOKEN.findall(query)
+        self.pos = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            return None
+        node = self.query()
+        if self.peek() is not None:
+            raise ValueError(f"unexpected {self.peek()!r} in the query")
+        return node
+
+    def query(self):
+        children = [self.conjunction()]
+        while self.peek() == "OR":
+            self.take()
+            children.append(self.conjunction())
+        return _combine(Or, children)
+
+    def conjunction(self):
+        children = [self.unary()]
+        while self.peek() not in (None, "OR", ")"):
+            if self.peek() == "AND":
+                self.take()
+            children.append(self.unary())
+        return _combine(And, children)
+
+    def unary(self):
+        token = self.peek()
+        if token is None or token in (")", "AND", "OR"):
+            raise ValueError(f"expected a word, NOT or ( but got {token or 'the end of the query'!r}")
+        self.take()
+        if token in ("NOT", "-"):
+            child = self.unary()
+            return Not(child) if child is not None else None
+        if token == "(":
+            node = self.query()
+            if self.peek() != ")":
+                raise ValueError("missing ) in the query")
+            self.take()
+            return node
+        return _combine(And, [Term(t) for t in dict.fromkeys(tokenise(token))])
+
+
+def parse_query(query: str):
+    ''' the query tree, None when every word is a stop word '''
+    return _Parser(query).parse()
+
+
+class PostingCursor:
+
+    def __init__(self, doc_ids: Sequence[int]):
+        self.doc_ids = doc_ids
+        self.n = len(doc_ids)
+        self.i = 0
+        self.doc = doc_ids[0] if self.n else END
+
+    def seek(self, target: int) -> int:
+        if self.doc >= target:
+            return self.doc
+        #dense lists mostly need the next entry, try it before galloping
+        i = self.i + 1
+        if i < self.n and self.doc_ids[i] < target:
+            i = gallop(self.doc_ids, target, i)
+        self.i = i
+        self.doc = self.doc_ids[i] if i < self.n else END
+        return self.doc
+
+
+class AndCursor:
+    ''' documents in every child of `required` and in none of `excluded` '''
+
+    def __init__(self, required: list, excluded: list):
+        #required is sorted rarest first, the lead proposes candidates the others have to confirm
+        self.lead = required[0]
+        self.others = required[1:]
+        self.excluded = excluded
+        self.doc = -1
+
+    def seek(self, target: int) -> int:
+        if self.doc >= target:
+            return self.doc
+        lead, others = self.lead, self.others
+        while True:
+            doc = lead.seek(target)
+            if doc == END:
+                break
+            for cursor in others:
+                found = cursor.seek(doc)
+                if found != doc:
+                    target = found
+                    break
+            else:
+                if self.excluded and any(cursor.seek(doc) == doc for cursor in self.excluded):
+                    target = doc + 1
+                    continue
+                break
+        self.doc = doc
+        return doc
+
+
+class OrCursor:
+
+    def __init__(self, children: list):
+        self.children = children
+        self.doc = -1
+
+    def seek(self, target: int) -> int:
+        if self.doc < target:
+            self.doc = min(cursor.seek(target) for cursor in self.children)
+        return self.doc
+
+
+class NotCursor:
+    ''' every doc id the child doesn't match '''
+
+    def __init__(self, child, doc_ids: Sequence[int]):
+        self.child = child
+        self.all_docs = PostingCursor(doc_ids)
+        self.doc = -1
+
+    def seek(self, target: int) -> int:
+        if self.doc >= target:
+            return self.doc
+        doc = self.all_docs.seek(target)
+        while doc != END and self.child.seek(doc) == doc:
+            doc = self.all_docs.seek(doc + 1)
+        self.doc = doc
+        return doc
+
+
+class _Planner:
+    ''' turns a query tree into cursors over one index '''
+
+    def __init__(self, inv_idx):
+        self.inv_idx = inv_idx
+        self.__doc_ids = None
+
+    def doc_ids(self) -> Sequence[int]:
+        if self.__doc_ids is None:
+            self.__doc_ids = self.inv_idx.sorted_doc_ids()
+        return self.__doc_ids
+
+    def cost(self, node) -> int:
+        ''' estimated matches, AND puts its rarest child in the lead '''
+        match node:
+            case Term():
+                return len(self.inv_idx.docmap.get(node.token, ()))
+            case And():
+                return min((self.cost(child) for child in node.children if not isinstance(child, Not)),
+                           default=len(self.inv_idx.index))
+            case Or():
+                return sum(self.cost(child) for child in node.children)
+            case Not():
+                return len(self.inv_idx.index)
+
+    def cursor(self, node):
+        match node:
+            case Term():
+                postings = self.inv_idx.docmap.get(node.token)
+                return PostingCursor(postings.doc_ids if postings else ())
+            case And():
+                required = [child for child in node.children if not isinstance(child, Not)]
+                excluded = [self.cursor(child.child) for child in node.children if isinstance(child, Not)]
+                if not required:
+                    return NotCursor(OrCursor(excluded), self.doc_ids())
+                required.sort(key=self.cost)
+                return AndCursor([self.cursor(child) for child in required], excluded)
+            case Or():
+                return OrCursor([self.cursor(child) for child in node.children])
+            case Not():
+                return NotCursor(self.cursor(node.child), self.doc_ids())
+
+
+def boolean_search(inv_idx, query: str) -> Iterator[int]:
+    ''' matching doc ids in increasing order, computed as they are consumed '''
+    node = parse_query(query)
+    if node is None:
+        return
+    cursor = _Planner(inv_idx).cursor(node)
+    doc = cursor.seek(0)
+    while doc != END:
+        yield doc
+        doc = cursor.seek(doc + 1)
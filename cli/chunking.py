@@ -0,0 +1,147 @@
+'''
+chunk level indexing. Long descriptions are split into overlapping chunks,
+every chunk is indexed (BM25 here, embeddings in lib.chunked_search) as a
+document of its own, and at query time the chunk scores are folded back
+into one score per parent document.
+
+A chunk record is shaped like a movie so the existing builds take it as is:
+
+    {"id": chunk id (dense, from 0), "parent_id": movie id,
+     "start": offset, "end": offset,   characters of the parent description
+     "title": parent title, "description": description[start:end]}
+
+The title is repeated in every chunk, a chunk about the plot should still
+match a query naming the film.
+'''
+import heapq
+import re
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from keyword_search_utils import InvertedIndex
+from document_source import MOVIES_PATH, iter_documents
+
+CHUNK_INDEX_PATH = Path("cache/chunk_index.bin")
+CHUNK_METHODS = ["words", "sentences"]
+AGGREGATIONS = ["max", "sum"]
+#about 120 words stay under the 256 word pieces all-MiniLM-L6-v2 reads
+DEFAULT_CHUNK_SIZE = 120
+DEFAULT_OVERLAP = 20
+#chunk hits fetched per parent result, several chunks of one movie may rank together
+DEPTH_PER_RESULT = 10
+
+WORD = re.compile(r"\S+")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def windows(n: int, size: int, overlap: int) -> Iterator[tuple[int, int]]:
+    ''' [start, end) item ranges of `size` with `overlap` items shared between neighbours, covering all n '''
+    if size <= 0:
+        raise ValueError("chunk size must be positive")
+    if not 0 <= overlap < size:
+        raise ValueError("overlap must be at least 0 and smaller than the chunk size")
+    start = 0
+    while start < n:
+        yield start, min(start + size, n)
+        if start + size >= n:
+            return
+        start += size - overlap
+
+
+def word_spans(text: str, chunk_size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP) -> list[tuple[int, int]]:
+    ''' character spans of chunks of `chunk_size` words '''
+    words = [match.span() for match in WORD.finditer(text)]
+    return [(words[first][0], words[last - 1][1]) for first, last in windows(len(words), chunk_size, overlap)]
+
+
+def sentence_spans(text: str, max_chunk_size: int = 4, overlap: int = 0) -> list[tuple[int, int]]:
+    ''' character spans of chunks of `max_chunk_size` sentences '''
+    sentences, start = [], 0
+    for match in SENTENCE_END.finditer(text):
+        sentences.append((start, match.start()))
+        start = match.end()
+    if text[start:].strip():
+        sentences.append((start, len(text.rstrip())))
+    return [(sentences[first][0], sentences[last - 1][1]) for first, last in windows(len(sentences), max_chunk_size, overlap)]
+
+
+def chunk_spans(text: str, method: str = "words", size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP) -> list[tuple[int, int]]:
+    if method == "words":
+        return word_spans(text, size, overlap)
+    if method == "sentences":
+        return sentence_spans(text, size, overlap)
+    raise ValueError(f"unknown chunk method {method}, expected one of {', '.join(CHUNK_METHODS)}")
+
+
+def iter_chunks(documents: Iterable[dict], method: str = "words", size: int = DEFAULT_CHUNK_SIZE,
+                overlap: int = DEFAULT_OVERLAP) -> Iterator[dict]:
+    ''' chunk records of a document stream, a document with an empty description still gets one chunk '''
+    chunk_id = 0
+    for doc in documents:
+        description = doc["description"]
+        for start, end in chunk_spans(description, method, size, overlap) or [(0, 0)]:
+            yield {"id": chunk_id, "parent_id": doc["id"], "start": start, "end": end,
+                   "title": doc["title"], "description": description[start:end]}
+            chunk_id += 1
+
+
+def aggregate_chunks(hits: Iterable[tuple[int, float]], parent_of: Callable[[int], int], limit: int,
+                     method: str = "max") -> list[tuple[int, float]]:
+    '''
+    (parent id, score) best first from (chunk id, score) hits. max scores a
+    document by its best passage, sum rewards documents matching in many.
+    '''
+    if method not in AGGREGATIONS:
+        raise ValueError(f"unknown aggregation {method}, expected one of {', '.join(AGGREGATIONS)}")
+    scores: dict[int, float] = {}
+    for chunk_id, score in hits:
+        parent = parent_of(chunk_id)
+        if method == "max":
+            scores[parent] = max(scores.get(parent, score), score)
+        else:
+            scores[parent] = scores.get(parent, 0.0) + score
+    return heapq.nsmallest(limit, scores.items(), key=lambda x: (-x[1], x[0]))
+
+
+class ChunkIndex:
+    ''' BM25 over chunks, answers with parent documents '''
+
+    def __init__(self, index_file_path: Path = CHUNK_INDEX_PATH):
+        self.inv_idx = InvertedIndex()
+        self.inv_idx.index_file_path = index_file_path
+
+    def build(self, documents: Iterable[dict], method: str = "words", size: int = DEFAULT_CHUNK_SIZE,
+              overlap: int = DEFAULT_OVERLAP, workers: int = 0):
+        chunks = iter_chunks(documents, method, size, overlap)
+        if workers > 1:
+            self.inv_idx.build_parallel(chunks, workers)
+        else:
+            self.inv_idx.build_from_movies(chunks)
+        self.inv_idx.save()
+
+    def load(self):
+        self.inv_idx.load()
+
+    def parent_of(self, chunk_id: int) -> int:
+        return self.inv_idx.index[chunk_id]["parent_id"]
+
+    def chunk_hits(self, query: str, limit: int = 5) -> list[tuple[int, float]]:
+        ''' (chunk id, BM25 score) hits, deep enough to fill `limit` parents in most cases '''
+        return self.inv_idx.bm25_search(query, limit * DEPTH_PER_RESULT)
+
+    def search(self, query: str, limit: int = 5, method: str = "max") -> list[tuple[int, float]]:
+        return aggregate_chunks(self.chunk_hits(query, limit), self.parent_of, limit, method)
+
+    def best_chunks(self, hits: list[tuple[int, float]]) -> dict[int, dict]:
+        ''' parent id -> its best scoring chunk record among the hits, to show where a document matched '''
+        best = {}
+        for chunk_id, _ in hits:
+            chunk = self.inv_idx.index[chunk_id]
+            best.setdefault(chunk["parent_id"], chunk)
+        return best
+
+
+def build_chunk_index(method: str = "words", size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP,
+                      workers: int = 0, movies_path: Path = MOVIES_PATH) -> ChunkIndex:
+    chunk_index = ChunkIndex()
+    chunk_index.build(iter_documents(movies_path), method, size, overlap, workers)
+    return chunk_index
@@ -0,0 +1,131 @@
+'''
+streaming document sources, so building an index never holds the raw file
+text and the whole parsed corpus at the same time.
+
+    data/movies.json    {"movies": [{...}, {...}, ...]}   or a bare [...]
+    data/movies.jsonl   one document object per line
+
+iter_json_array reads the array incrementally: the file is read in chunks
+and each element is decoded with JSONDecoder.raw_decode as soon as it is
+complete, so only one element (plus one chunk of text) is in memory.
+'''
+import json
+from pathlib import Path
+from typing import Iterator, TextIO
+
+MOVIES_PATH = Path("data/movies.json")
+JSONL_SUFFIXES = {".jsonl", ".ndjson"}
+WHITESPACE = " \t\n\r"
+
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    ''' a growing text buffer over a file, with raw_decode that pulls more text until a value is complete '''
+
+    def __init__(self, file: TextIO, path: Path, chunk_size: int):
+        self.file = file
+        self.path = path
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def __fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        #drop what was consumed so the buffer stays about one chunk long
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def error(self, message: str) -> ValueError:
+        return ValueError(f"{self.path}: {message}")
+
+    def peek(self) -> str:
+        ''' next non whitespace character without consuming it, "" at the end of the file '''
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.__fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise self.error(f"expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self.__fill():
+                    continue
+                raise self.error(str(e)) from e
+            #a number running into the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self.__fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_array(path: Path, key: str | None = "movies", chunk_size: int = 1 << 16) -> Iterator:
+    '''
+    elements of the array stored under `key` of the top level object, or of
+    a top level array, one at a time. Other keys of the object are decoded
+    and skipped.
+    '''
+    if not path.exists():
+        raise FileNotFoundError(f"file {path} doesn't exists")
+
+    with open(path, "r", encoding="utf-8") as f:
+        reader = _Reader(f, path, chunk_size)
+        if reader.peek() == "{":
+            reader.expect("{")
+            while True:
+                if reader.peek() == "}":
+                    raise reader.error(f"no {key!r} array")
+                name = reader.value()
+                reader.expect(":")
+                if name == key:
+                    break
+                reader.value()
+                if reader.peek() == ",":
+                    reader.expect(",")
+        reader.expect("[")
+        if reader.peek() == "]":
+            return
+        while True:
+            yield reader.value()
+            if reader.peek() == "]":
+                return
+            reader.expect(",")
+
+
+def iter_jsonl(path: Path) -> Iterator:
+    ''' one value per non blank line '''
+    if not path.exists():
+        raise FileNotFoundError(f"file {path} doesn't exists")
+
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{path}:{line_number}: {e}") from e
+
+
+def iter_documents(path: Path = MOVIES_PATH, key: str | None = "movies") -> Iterator[dict]:
+    ''' documents of a .json file (array under `key`) or a .jsonl / .ndjson file '''
+    if path.suffix in JSONL_SUFFIXES:
+        return iter_jsonl(path)
+    return iter_json_array(path, key)
@@ -1,41 +1,93 @@
-from keyword_search_utils import search_movies, InvertedIndex, BM25_B, BM25_K1
+from keyword_search_utils import search_movies, InvertedIndex, BM25_B, BM25_K1, PROXIMITY_WEIGHT
+from segmented_index import SegmentedIndex
+from document_source import iter_documents
+from chunking import ChunkIndex, DEFAULT_CHUNK_SIZE, DEFAULT_OVERLAP, aggregate_chunks, build_chunk_index, sentence_spans, word_spans
+from boolean_query import boolean_search
+from helpers import simplify, tokenise
+from itertools import islice
 from pathlib import Path
-from helpers import tokenise
 import re
 import string
 
 movies_file_path = Path("data/movies.json")
 
-def search_hanlder(query: str):
+def search_hanlder(query: str, limit: int = 5):
     print(f"Searching for: {query}")
 
     inv_idx = InvertedIndex()
     try:
         inv_idx.load()
+        #matches are generated lazily, only the first `limit` are ever evaluated
+        results = list(islice(boolean_search(inv_idx, query), limit))
     except Exception as e:
         print(e)
         exit(0)
-  
-    results = list()
-    for token in tokenise(query):
-        results.extend(inv_idx.get_documents(token))
-        if len(results)>5:
-            break
 
     for i, movie in enumerate(results):
-        if i==5:
-            return
         print(f"{i+1}. {inv_idx.index[movie]["title"]}")
 
-def build_handler():
+def build_handler(workers=0, positions=False, impacts=False):
 
-    inv_idx = InvertedIndex()
-    inv_idx.build(movies_file_path)
+    inv_idx = InvertedIndex(positions, impacts)
+    inv_idx.build(movies_file_path, workers)
     inv_idx.save()
 
     docs = inv_idx.get_documents("merida")
     print(f"First document for token 'merida' = {docs[0]}")
 
+def segment_add_handler(file):
+    seg_idx = SegmentedIndex()
+    try:
+        seg_idx.load()
+        movies = list(iter_documents(Path(file)))
+        #merges in the foreground, a background merge would die with the process
+        seg_idx.add_movies(movies)
+        print(f"Added {len(movies)} movies, {seg_idx.live_doc_count()} live in {len(seg_idx.segments)} segments")
+    except Exception as e:
+        print(e); exit(1)
+
+def segment_delete_handler(doc_ids):
+    seg_idx = SegmentedIndex()
+    try:
+        seg_idx.load()
+        seg_idx.delete(doc_ids)
+        print(f"Deleted {len(doc_ids)} ids, {seg_idx.live_doc_count()} live documents")
+    except Exception as e:
+        print(e); exit(1)
+
+def segment_merge_handler():
+    seg_idx = SegmentedIndex()
+    try:
+        seg_idx.load()
+        seg_idx.force_merge()
+        print(f"{seg_idx.live_doc_count()} live documents in {len(seg_idx.segments)} segments")
+    except Exception as e:
+        print(e); exit(1)
+
+def segment_search_handler(query, limit):
+    seg_idx = SegmentedIndex()
+    try:
+        seg_idx.load()
+        for i, (doc_id, score) in enumerate(seg_idx.bm25_search(query, limit)):
+            print(f"{i+1}. ({doc_id}) {seg_idx.get_document(doc_id)["title"]} - score {score:.2f}")
+    except Exception as e:
+        print(e); exit(1)
+
+def migrate_handler(impacts=False):
+    inv_idx = InvertedIndex(impacts=impacts)
+    try:
+        if impacts and inv_idx.index_file_path.exists():
+            #adds impact scores to the binary index without tokenising the movies again
+            inv_idx.load()
+            inv_idx.compute_impacts()
+            inv_idx.save()
+            print(f"Computed impact scores for k1={BM25_K1} b={BM25_B} in {inv_idx.index_file_path}")
+        else:
+            inv_idx.migrate()
+            print(f"Migrated {len(inv_idx.index)} documents to {inv_idx.index_file_path}")
+    except Exception as e:
+        print(e); exit(1)
+
 def tf_handler(doc_id, term):
     inv_idx = InvertedIndex()
 
@@ -80,20 +132,95 @@ def tf_idf_handler(doc_id, term):
         print(e); exit(1)
 
 
-def bm25_handler(query, limit):
+def bm25_handler(query, limit, maxscore=False, cache=False, proximity=False, impacts=False, fuzzy=False):
+    from result_cache import DEFAULT_DISK_PATH, ResultCache, file_version
+
+    inv_idx = InvertedIndex()
+    try:
+        #maxscore returns the same results, so it isn't part of the key
+        params = {"limit": limit, "k1": BM25_K1, "b": BM25_B}
+        if proximity:
+            params["proximity"] = PROXIMITY_WEIGHT
+        #impact scores are quantised, they may order near ties differently
+        if impacts:
+            params["impacts"] = True
+        if fuzzy:
+            params["fuzzy"] = True
+        result_cache = ResultCache(disk_path=DEFAULT_DISK_PATH) if cache else None
+        version = file_version(inv_idx.index_file_path)
+        top_docs = result_cache.get("keyword", query, version, **params) if cache else None
+        if top_docs is None:
+            inv_idx.load()
+            if proximity:
+                hits = inv_idx.proximity_search(query, limit)
+            else:
+                hits = inv_idx.bm25_search(query, limit, maxscore=maxscore, impacts=impacts, fuzzy=fuzzy)
+            top_docs = [[key, inv_idx.index[key]["title"], value] for key, value in hits]
+            if cache:
+                result_cache.put("keyword", query, version, top_docs, **params)
+        for i, (key, title, value) in enumerate(top_docs):
+            print(f"{i+1}. ({key}) {title} - score {value:.2f}")
+
+    except Exception as e:
+        print(e); exit(1)
+
+
+
+def terms_handler(word, prefix=False, distance=None, limit=10):
     inv_idx = InvertedIndex()
     try:
         inv_idx.load()
-        sorted_doc = inv_idx.bm25_search(query)
-        for i, (key, value) in enumerate(sorted_doc.items()):
-            print(f"{i+1}. ({key}) {inv_idx.index[key]["title"]} - score {value:.2f}")
-            if i>limit:
-                break
+        terms = inv_idx.term_dictionary()
+        if prefix:
+            #a partial word isn't stemmed, "runn" has to find "run" and "runner"
+            start, end = terms.prefix_range(simplify(word))
+            matches = sorted(((terms.terms[i], None) for i in range(start, end)),
+                             key=lambda match: -len(inv_idx.docmap[match[0]]))[:limit]
+        else:
+            token = tokenise(word)
+            matches = terms.fuzzy(token[0], distance)[:limit] if token else []
+        for term, term_distance in matches:
+            edits = f"distance {term_distance}, " if term_distance is not None else ""
+            print(f"{term} ({edits}{len(inv_idx.docmap[term])} documents)")
+    except Exception as e:
+        print(e); exit(1)
+
+
+def autocomplete_handler(prefix, limit, keystrokes=False):
+    from autocomplete import KEYSTROKE_BUDGET_MS, keystroke_latencies, load_autocomplete
+
+    try:
+        completer = load_autocomplete()
+        if keystrokes:
+            for typed, ms, completions in keystroke_latencies(completer, prefix, limit):
+                over = " over budget" if ms > KEYSTROKE_BUDGET_MS else ""
+                print(f"{typed!r:>24} {ms:8.3f} ms{over}  {', '.join(completions[:3])}")
+        for i, title in enumerate(completer.complete(prefix, limit)):
+            print(f"{i+1}. {title}")
+    except Exception as e:
+        print(e); exit(1)
 
+
+def phrase_search_handler(phrase, limit):
+    inv_idx = InvertedIndex()
+    try:
+        inv_idx.load()
+        for i, (key, value) in enumerate(inv_idx.phrase_search(phrase, limit)):
+            print(f"{i+1}. ({key}) {inv_idx.index[key]['title']} - score {value:.2f}")
     except Exception as e:
         print(e); exit(1)
 
 
+def server_search_handler(address, mode, query, limit, **options):
+    #the client lives with the server, which pulls in asyncio
+    from search_server import query_server
+
+    try:
+        for i, hit in enumerate(query_server(address, mode, query, limit, **options)):
+            print(f"{i+1}. ({hit["id"]}) {hit["title"]} - score {hit["score"]:.2f}")
+    except (OSError, RuntimeError) as e:
+        print(f"search server at {address}: {e}"); exit(1)
+
 
 def bm25idf_handler(term):
     inv_idx = InvertedIndex()
@@ -106,29 +233,43 @@ def bm25idf_handler(term):
 
 
 def chunk_handler(text, chunk_size: int = 200, overlap: int = 0):
-    words = text.split()
-    chunked_text = []
-    for i in range(0, len(words), chunk_size):
-        if i>overlap:
-            chunked_text.append(" ".join(words[i-overlap:i+chunk_size-overlap]))
-        else:
-            chunked_text.append(" ".join(words[:i+chunk_size]))
+    try:
+        chunked_text = [text[start:end] for start, end in word_spans(text, chunk_size, overlap)]
+    except ValueError as e:
+        print(e); exit(1)
     print(f"Chunking {len(text)} characters")
     for i, chunk in enumerate(chunked_text):
         print(f"{i+1}. {chunk}")
     return chunked_text
 
 def semantic_chunk_handler(text, max_chunk_size: int = 200, overlap: int = 0):
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    chunked_text = []
-    for i in range(0, len(sentences), max_chunk_size):
-        if i>overlap:
-            chunked_text.append(" ".join(sentences[i-overlap:i+max_chunk_size-overlap]))
-        else:
-            chunked_text.append(" ".join(sentences[:i+max_chunk_size]))
-    if i!=0 and i!=len(sentences):
-        chunked_text.append(" ".join(sentences[i:]))
+    try:
+        chunked_text = [text[start:end] for start, end in sentence_spans(text, max_chunk_size, overlap)]
+    except ValueError as e:
+        print(e); exit(1)
     print(f"Semantically chunking {len(text)} characters")
     for i, chunk in enumerate(chunked_text):
         print(f"{i+1}. {chunk}")
-    return chunked_text
\ No newline at end of file
+    return chunked_text
+
+
+def build_chunks_handler(method="words", size=DEFAULT_CHUNK_SIZE, overlap=DEFAULT_OVERLAP, workers=0):
+    try:
+        chunk_index = build_chunk_index(method, size, overlap, workers)
+        print(f"Indexed {len(chunk_index.inv_idx.index)} chunks to {chunk_index.inv_idx.index_file_path}")
+    except ValueError as e:
+        print(e); exit(1)
+
+
+def chunk_search_handler(query, limit, aggregation="max"):
+    chunk_index = ChunkIndex()
+    try:
+        chunk_index.load()
+        hits = chunk_index.chunk_hits(query, limit)
+        best = chunk_index.best_chunks(hits)
+        for i, (parent_id, score) in enumerate(aggregate_chunks(hits, chunk_index.parent_of, limit, aggregation)):
+            chunk = best[parent_id]
+            print(f"{i+1}. ({parent_id}) {chunk['title']} - score {score:.2f}")
+            print(f"   [{chunk['start']}:{chunk['end']}] {chunk['description'][:120]}")
+    except Exception as e:
+        print(e); exit(1)
@@ -1,10 +1,22 @@
+'''
+text and vector helpers shared by every command. Importing this module is
+cheap: numpy, nltk and the stop words file are loaded by the first call that
+needs them, so commands like `tf` or `chunk` never pay for what they don't use.
+'''
+from __future__ import annotations
 import string
-from nltk.stem import PorterStemmer
 from pathlib import Path
-import numpy as np 
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterable
+
+if TYPE_CHECKING:
+    import numpy as np
+
+STOP_WORDS_PATH = Path("data/stop_words.txt")
 
 def similarity(a: np.ndarray, b: np.ndarray) -> float:
     ''' returns the similarity between two vectors '''
+    import numpy as np
     if a.shape != b.shape:
         raise ValueError("Vectors must have the same shape")
 
@@ -14,6 +26,27 @@ def similarity(a: np.ndarray, b: np.ndarray) -> float:
         return 0.0
     return np.dot(a, b) / (norm_a * norm_b)
 
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    ''' L2 normalises vectors along the last axis, zero vectors stay zero '''
+    import numpy as np
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    '''
+    indices of the k highest scores along the last axis, best first.
+    argpartition is O(n), only the k winners get sorted.
+    '''
+    import numpy as np
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.intp)
+
+    top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(top, order, axis=-1)
+
 
 def get_stop_words(file: Path) -> list[str]:
     ''' you know what it does'''
@@ -26,26 +59,75 @@ def get_stop_words(file: Path) -> list[str]:
             stop_words.append(line.strip())
         return stop_words
 
-STOP_WORDS = get_stop_words(Path("data/stop_words.txt"))
+@lru_cache(maxsize=None)
+def load_stop_words() -> frozenset[str]:
+    ''' the stop words file, read once per process on first use '''
+    return frozenset(get_stop_words(STOP_WORDS_PATH))
+
+PUNCTUATIONS = '''!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~''' #string.punctuation #get all the punctuation makrs
+PUNCTUATION_TABLE = str.maketrans("", "", PUNCTUATIONS)
+
+class Tokenizer:
+    '''
+    simplify -> split -> drop stop words -> stem, with everything expensive
+    built once: stop words are a frozenset, one stemmer is shared and its
+    results are kept in a bounded LRU cache (vocabularies repeat a lot).
+    '''
+
+    def __init__(self, stop_words: Iterable[str] = (), stem_cache_size: int = 100_000):
+        #nltk takes a few hundred ms to import, only tokenising pays for it
+        from nltk.stem import PorterStemmer
+
+        self.stop_words = frozenset(stop_words)
+        self.stemmer = PorterStemmer()
+        self.stem = lru_cache(maxsize=stem_cache_size)(self.stemmer.stem)
+
+    def tokenise(self, s: str) -> list[str]:
+        stem = self.stem
+        stop_words = self.stop_words
+        return [stem(token) for token in simplify(s).split() if token not in stop_words]
+
+    def tokenise_positions(self, s: str) -> list[tuple[str, int]]:
+        ''' (token, word position) pairs; stop words are dropped but still count as positions '''
+        stem = self.stem
+        stop_words = self.stop_words
+        return [(stem(token), i) for i, token in enumerate(simplify(s).split()) if token not in stop_words]
+
+    def tokenise_many(self, texts: Iterable[str]) -> list[list[str]]:
+        return [self.tokenise(text) for text in texts]
+
+@lru_cache(maxsize=None)
+def get_tokenizer() -> Tokenizer:
+    ''' the shared Tokenizer, built on first use '''
+    return Tokenizer(load_stop_words())
+
+def __getattr__(name: str):
+    #STOP_WORDS and TOKENIZER used to be built at import, keep them as lazy attributes
+    if name == "STOP_WORDS":
+        return load_stop_words()
+    if name == "TOKENIZER":
+        return get_tokenizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def simplify(s: str):
     '''remove punctuations and make lowercase for a string'''
-    punctuations = '''!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~''' #string.punctuation #get all the punctuation makrs
-    trans_map = s.maketrans({p:"" for p in punctuations})
-
-    return s.translate(trans_map).lower().strip()
+    return s.translate(PUNCTUATION_TABLE).lower().strip()
 
 def stem(s: str)->str:
     ''' reduces words to their root forms'''
-    stemmer = PorterStemmer()
-    return stemmer.stem(s)
+    return get_tokenizer().stem(s)
 
 def tokenise(s: str) -> list[str]:
     ''' breaks the string into chuncks of test '''
-    simple_string = simplify(s)
-    tokens = simple_string.split()
-    tokens = [stem(token) for token in tokens if token not in STOP_WORDS]
-    return tokens
+    return get_tokenizer().tokenise(s)
+
+def tokenise_positions(s: str) -> list[tuple[str, int]]:
+    ''' tokenise, keeping where each token stood in the text '''
+    return get_tokenizer().tokenise_positions(s)
+
+def tokenise_many(texts: Iterable[str]) -> list[list[str]]:
+    ''' tokenise for a batch of strings '''
+    return get_tokenizer().tokenise_many(texts)
 
 def add(a: int, b: int) -> int:
     ''' adds to numbers of returns the sum'''
@@ -0,0 +1,437 @@
+'''
+binary on-disk format of the keyword index. The file is opened with mmap,
+so loading only parses a fixed size header; every lookup reads straight
+from the page cache and the pages are shared between processes that open
+the same index.
+
+layout (little endian, every section 8-byte aligned):
+
+    header          magic, version, counts, avg doc length, section offsets
+    doc_ids         uint32[n_docs]           sorted document ids
+    doc_lengths     uint32[max_doc_id + 1]   tokens per document, by doc id
+    doc_offsets     uint64[max_doc_id + 2]   document json in doc_blob, by doc id
+    doc_blob        utf-8 json per document
+    term_offsets    uint64[n_terms + 1]      term text in term_blob
+    term_blob       utf-8 terms in sorted (byte) order
+    posting_offsets uint64[n_terms + 1]      first posting of each term
+    postings        uint32[2 * n_postings]   (doc_id, tf) pairs, doc id order
+    upper_bounds    float64[n_terms]         best BM25 score of each term
+    position_offsets uint64[n_postings + 1]  positions of each posting in positions (optional)
+    positions       varint coded position gaps per (term, doc), posting order (optional)
+    impact_params   float64[3]               k1, b and scale the impacts were computed with (optional)
+    impacts         uint8[n_postings]        quantised BM25 score per posting, posting order (optional)
+
+doc_lengths and doc_offsets are indexed by the doc id itself, which keeps
+per-posting lookups O(1) as long as ids are reasonably dense (movie ids are).
+Postings are fixed width rather than varint coded so MaxScore can binary
+search them in place. Positions are only read for phrase and proximity
+checks, after the postings have been intersected, so they are stored
+compactly: word positions as LEB128 varint gaps, empty sections when the
+index was built without them. Impacts are a posting's whole BM25 score
+(idf included) divided by scale and rounded, so a query adds small
+integers and multiplies by scale once; they hold for one k1 and b only.
+Version 1 (no position sections) and 2 (no impact sections) files are
+still read.
+'''
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Iterator
+
+MAGIC = b"RAGINDEX"
+VERSION = 3
+SECTIONS_V1 = ["doc_ids", "doc_lengths", "doc_offsets", "doc_blob", "term_offsets",
+               "term_blob", "posting_offsets", "postings", "upper_bounds"]
+SECTIONS_V2 = SECTIONS_V1 + ["position_offsets", "positions"]
+SECTIONS = SECTIONS_V2 + ["impact_params", "impacts"]
+SECTIONS_BY_VERSION = {1: SECTIONS_V1, 2: SECTIONS_V2, 3: SECTIONS}
+HEADERS = {version: struct.Struct(f"<8sIIIId{len(sections)}Q") for version, sections in SECTIONS_BY_VERSION.items()}
+HEADER = HEADERS[VERSION]
+#impacts are stored in one byte
+IMPACT_LEVELS = 255
+
+if sys.byteorder != "little":
+    raise ImportError("index_format assumes a little endian machine")
+
+
+def encode_positions(positions: Sequence[int]) -> bytes:
+    ''' increasing positions as LEB128 varints of the gaps, small gaps take one byte '''
+    out = bytearray()
+    previous = 0
+    for position in positions:
+        gap = position - previous
+        previous = position
+        while gap >= 0x80:
+            out.append((gap & 0x7F) | 0x80)
+            gap >>= 7
+        out.append(gap)
+    return bytes(out)
+
+
+def decode_positions(data) -> list[int]:
+    positions = []
+    position = shift = gap = 0
+    for byte in bytes(data):
+        gap |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            position += gap
+            positions.append(position)
+            gap = shift = 0
+    return positions
+
+
+class PostingList:
+    '''
+    doc ids of a term in increasing order, with the term frequency of each
+    inline. A positional list also has the varint coded word positions of
+    posting i at position_blob[position_offsets[i]:position_offsets[i + 1]],
+    and an index with impact scores has the quantised score of posting i
+    in impacts[i].
+    '''
+
+    __slots__ = ("doc_ids", "tfs", "position_offsets", "position_blob", "impacts")
+
+    def __init__(self, doc_ids: Sequence[int], tfs: Sequence[int], position_offsets: Sequence[int] | None = None,
+                 position_blob=None, impacts: Sequence[int] | None = None):
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.position_offsets = position_offsets
+        self.position_blob = position_blob
+        self.impacts = impacts
+
+    @classmethod
+    def empty(cls, positional: bool = False) -> "PostingList":
+        ''' a list to append() to while building '''
+        if positional:
+            return cls(array("I"), array("I"), array("Q", [0]), bytearray())
+        return cls(array("I"), array("I"))
+
+    @property
+    def has_positions(self) -> bool:
+        return self.position_offsets is not None
+
+    def append(self, doc_id: int, tf: int, positions: bytes | None = None):
+        self.doc_ids.append(doc_id)
+        self.tfs.append(tf)
+        if self.position_offsets is not None:
+            self.position_blob += positions
+            self.position_offsets.append(len(self.position_blob))
+
+    def position_bytes(self, i: int) -> bytes:
+        ''' encoded positions of posting i, b"" for a list without positions '''
+        if self.position_offsets is None:
+            return b""
+        return bytes(self.position_blob[self.position_offsets[i]:self.position_offsets[i + 1]])
+
+    def positions(self, i: int) -> list[int]:
+        return decode_positions(self.position_bytes(i))
+
+    def positions_of(self, doc_id: int) -> list[int]:
+        ''' word positions of the term in doc_id, [] if the term isn't in it '''
+        i = bisect_left(self.doc_ids, doc_id)
+        if i < len(self.doc_ids) and self.doc_ids[i] == doc_id:
+            return self.positions(i)
+        return []
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.doc_ids)
+
+    def __getitem__(self, i):
+        return self.doc_ids[i]
+
+    def tf(self, doc_id: int) -> int:
+        i = bisect_left(self.doc_ids, doc_id)
+        if i < len(self.doc_ids) and self.doc_ids[i] == doc_id:
+            return self.tfs[i]
+        return 0
+
+    def __repr__(self):
+        return f"PostingList({list(zip(self.doc_ids, self.tfs))})"
+
+
+def _padded(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 8)
+
+
+def write_index(path: Path, documents: Mapping, postings: Mapping, doc_lengths: Mapping,
+                upper_bounds: Mapping, avg_doc_len: float, impact_params: tuple[float, float, float] | None = None):
+    '''
+    writes the index to a temp file and swaps it in, open readers keep the
+    old file. impact_params is (k1, b, scale) of the posting lists' impacts.
+    '''
+    doc_ids = sorted(documents)
+    if doc_ids and doc_ids[0] < 0:
+        raise ValueError("document ids must be non negative")
+    max_doc_id = doc_ids[-1] if doc_ids else 0
+
+    lengths = array("I", bytes(4 * (max_doc_id + 1)))
+    doc_offsets = array("Q", bytes(8 * (max_doc_id + 2)))
+    doc_blob = bytearray()
+    next_id = 0
+    for doc_id in doc_ids:
+        #ids without a document get an empty slice
+        for missing in range(next_id, doc_id + 1):
+            doc_offsets[missing] = len(doc_blob)
+        doc_blob += json.dumps(documents[doc_id]).encode("utf-8")
+        lengths[doc_id] = doc_lengths[doc_id]
+        next_id = doc_id + 1
+    for missing in range(next_id, max_doc_id + 2):
+        doc_offsets[missing] = len(doc_blob)
+
+    terms = sorted(postings, key=lambda term: term.encode("utf-8"))
+    term_offsets = array("Q", [0])
+    term_blob = bytearray()
+    posting_offsets = array("Q", [0])
+    pairs = array("I")
+    bounds = array("d")
+    #positions are written only if every posting list has them
+    positional = bool(terms) and all(postings[term].has_positions for term in terms)
+    position_offsets = array("Q", [0] if positional else [])
+    position_blob = bytearray()
+    with_impacts = impact_params is not None and all(postings[term].impacts is not None for term in terms)
+    impacts = array("B")
+    for term in terms:
+        term_blob += term.encode("utf-8")
+        term_offsets.append(len(term_blob))
+        posting_list = postings[term]
+        for doc_id, tf in zip(posting_list.doc_ids, posting_list.tfs):
+            pairs.append(doc_id)
+            pairs.append(tf)
+        posting_offsets.append(len(pairs) // 2)
+        bounds.append(upper_bounds[term] if term in upper_bounds else 0.0)
+        if positional:
+            start = posting_list.position_offsets[0]
+            position_blob += posting_list.position_blob[start:posting_list.position_offsets[-1]]
+            base = position_offsets[-1] - start
+            position_offsets.extend(base + offset for offset in posting_list.position_offsets[1:])
+        if with_impacts:
+            impacts.extend(posting_list.impacts)
+
+    sections = {
+        "doc_ids": array("I", doc_ids).tobytes(),
+        "doc_lengths": lengths.tobytes(),
+        "doc_offsets": doc_offsets.tobytes(),
+        "doc_blob": bytes(doc_blob),
+        "term_offsets": term_offsets.tobytes(),
+        "term_blob": bytes(term_blob),
+        "posting_offsets": posting_offsets.tobytes(),
+        "postings": pairs.tobytes(),
+        "upper_bounds": bounds.tobytes(),
+        "position_offsets": position_offsets.tobytes(),
+        "positions": bytes(position_blob),
+        "impact_params": array("d", impact_params if with_impacts else []).tobytes(),
+        "impacts": impacts.tobytes(),
+    }
+
+    offsets = []
+    position = HEADER.size + (-HEADER.size % 8)
+    for name in SECTIONS:
+        offsets.append(position)
+        position += len(_padded(sections[name]))
+
+    os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_padded(HEADER.pack(MAGIC, VERSION, len(doc_ids), len(terms), max_doc_id, avg_doc_len, *offsets)))
+        for name in SECTIONS:
+            f.write(_padded(sections[name]))
+    os.replace(tmp_path, path)
+
+
+class MappedIndex:
+    ''' read only view of an index file written by write_index '''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = struct.unpack_from("<8sI", self.mm, 0)
+        if magic != MAGIC or version not in HEADERS:
+            raise ValueError(f"{path} is not a version {VERSION} index file")
+        _, _, self.n_docs, self.n_terms, self.max_doc_id, self.avg_doc_len, *offsets = \
+            HEADERS[version].unpack_from(self.mm, 0)
+
+        ends = offsets[1:] + [len(self.mm)]
+        view = memoryview(self.mm)
+        raw = {name: view[start:end] for name, start, end in zip(SECTIONS_BY_VERSION[version], offsets, ends)}
+        self.doc_ids = raw["doc_ids"][:4 * self.n_docs].cast("I")
+        self.doc_lengths_array = raw["doc_lengths"][:4 * (self.max_doc_id + 1)].cast("I")
+        self.doc_offsets = raw["doc_offsets"][:8 * (self.max_doc_id + 2)].cast("Q")
+        self.doc_blob = raw["doc_blob"]
+        self.term_offsets = raw["term_offsets"][:8 * (self.n_terms + 1)].cast("Q")
+        self.term_blob = raw["term_blob"]
+        self.posting_offsets = raw["posting_offsets"][:8 * (self.n_terms + 1)].cast("Q")
+        self.pairs = raw["postings"][:8 * self.posting_offsets[-1]].cast("I")
+        self.bounds = raw["upper_bounds"][:8 * self.n_terms].cast("d")
+        self.position_offsets = None
+        self.positions = None
+        #version 1 files and indexes built without positions have no position_offsets entries
+        if "position_offsets" in raw and len(raw["position_offsets"]) >= 8:
+            n_postings = self.posting_offsets[-1]
+            self.position_offsets = raw["position_offsets"][:8 * (n_postings + 1)].cast("Q")
+            self.positions = raw["positions"][:self.position_offsets[-1]]
+        self.impact_params = None
+        self.impacts = None
+        if "impact_params" in raw and len(raw["impact_params"]) >= 24:
+            self.impact_params = tuple(raw["impact_params"][:24].cast("d"))
+            self.impacts = raw["impacts"][:self.posting_offsets[-1]]
+
+        self.documents = DocumentsView(self)
+        self.doc_lengths = DocLengthsView(self)
+        self.postings = PostingsView(self)
+        self.terms = TermsView(self)
+        self.upper_bounds = UpperBoundsView(self)
+
+    @property
+    def has_positions(self) -> bool:
+        return self.position_offsets is not None
+
+    def term(self, term_id: int) -> str:
+        return bytes(self.term_blob[self.term_offsets[term_id]:self.term_offsets[term_id + 1]]).decode("utf-8")
+
+    def find_term(self, term: str) -> int | None:
+        ''' binary search of the sorted term dictionary '''
+        key = term.encode("utf-8")
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(self.term_blob[self.term_offsets[mid]:self.term_offsets[mid + 1]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_terms and bytes(self.term_blob[self.term_offsets[lo]:self.term_offsets[lo + 1]]) == key:
+            return lo
+        return None
+
+    def posting_list(self, term_id: int) -> PostingList:
+        start, end = 2 * self.posting_offsets[term_id], 2 * self.posting_offsets[term_id + 1]
+        impacts = self.impacts[start // 2:end // 2] if self.impacts is not None else None
+        if self.position_offsets is None:
+            return PostingList(self.pairs[start:end:2], self.pairs[start + 1:end:2], impacts=impacts)
+        #offsets stay absolute, into the shared positions section
+        position_offsets = self.position_offsets[start // 2:end // 2 + 1]
+        return PostingList(self.pairs[start:end:2], self.pairs[start + 1:end:2], position_offsets, self.positions, impacts)
+
+    def close(self):
+        for name in ["doc_ids", "doc_lengths_array", "doc_offsets", "doc_blob", "term_offsets",
+                     "term_blob", "posting_offsets", "pairs", "bounds", "position_offsets", "positions", "impacts"]:
+            if getattr(self, name) is not None:
+                getattr(self, name).release()
+        self.mm.close()
+        self.file.close()
+
+
+class DocumentsView(Mapping):
+    ''' doc id -> movie dict, decoded on access '''
+
+    def __init__(self, mapped: MappedIndex):
+        self.mapped = mapped
+
+    def __getitem__(self, doc_id):
+        m = self.mapped
+        if not isinstance(doc_id, int) or not 0 <= doc_id <= m.max_doc_id:
+            raise KeyError(doc_id)
+        start, end = m.doc_offsets[doc_id], m.doc_offsets[doc_id + 1]
+        if start == end:
+            raise KeyError(doc_id)
+        return json.loads(bytes(m.doc_blob[start:end]))
+
+    def __contains__(self, doc_id):
+        m = self.mapped
+        return isinstance(doc_id, int) and 0 <= doc_id <= m.max_doc_id \
+            and m.doc_offsets[doc_id] != m.doc_offsets[doc_id + 1]
+
+    def __iter__(self):
+        return iter(self.mapped.doc_ids)
+
+    def __len__(self):
+        return self.mapped.n_docs
+
+
+class DocLengthsView(Mapping):
+    ''' doc id -> number of tokens. Scoring hits this once per posting, so unused ids inside the id range read as 0 '''
+
+    def __init__(self, mapped: MappedIndex):
+        self.mapped = mapped
+        self.lengths = mapped.doc_lengths_array
+
+    def __getitem__(self, doc_id):
+        if not isinstance(doc_id, int) or doc_id < 0:
+            raise KeyError(doc_id)
+        try:
+            return self.lengths[doc_id]
+        except (IndexError, TypeError):
+            raise KeyError(doc_id) from None
+
+    def __iter__(self):
+        return iter(self.mapped.doc_ids)
+
+    def __len__(self):
+        return self.mapped.n_docs
+
+
+class PostingsView(Mapping):
+    ''' term -> PostingList '''
+
+    def __init__(self, mapped: MappedIndex):
+        self.mapped = mapped
+
+    def __getitem__(self, term):
+        term_id = self.mapped.find_term(term)
+        if term_id is None:
+            raise KeyError(term)
+        return self.mapped.posting_list(term_id)
+
+    def __contains__(self, term):
+        return self.mapped.find_term(term) is not None
+
+    def __iter__(self):
+        return (self.mapped.term(term_id) for term_id in range(self.mapped.n_terms))
+
+    def __len__(self):
+        return self.mapped.n_terms
+
+
+class TermsView(Sequence):
+    ''' the sorted term dictionary, term id -> term, for binary searches '''
+
+    def __init__(self, mapped: MappedIndex):
+        self.mapped = mapped
+
+    def __getitem__(self, term_id):
+        if not 0 <= term_id < self.mapped.n_terms:
+            raise IndexError(term_id)
+        return self.mapped.term(term_id)
+
+    def __len__(self):
+        return self.mapped.n_terms
+
+
+class UpperBoundsView(dict):
+    ''' term -> BM25 upper bound read from the file, plus any bounds computed since '''
+
+    def __init__(self, mapped: MappedIndex):
+        super().__init__()
+        self.mapped = mapped
+
+    def __missing__(self, term):
+        term_id = self.mapped.find_term(term)
+        if term_id is None:
+            raise KeyError(term)
+        self[term] = self.mapped.bounds[term_id]
+        return self[term]
+
+    def __contains__(self, term):
+        return super().__contains__(term) or self.mapped.find_term(term) is not None
@@ -2,13 +2,15 @@
 
 import argparse
 from handlers import*
+from chunking import AGGREGATIONS, CHUNK_METHODS
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Keyword Search CLI")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
-    search_parser = subparsers.add_parser("search", help="Search movies using BM25")
-    search_parser.add_argument("query", type=str, help="Search query")
+    search_parser = subparsers.add_parser("search", help="Boolean search: AND (implied between words), OR, NOT or -word, parentheses")
+    search_parser.add_argument("query", type=str, help="Search query, e.g. 'space (bear OR bears) -honey'")
+    search_parser.add_argument("--limit", type=int, default=5, help="number of results")
 
     
     idf_parser = subparsers.add_parser("idf", help="get idf")
@@ -19,6 +21,20 @@ def main() -> None:
     bm25idf_parser.add_argument("term", type=str, help="idf query")
 
     build_parser = subparsers.add_parser("build", help="Loads And Saves Movies into Index")
+    build_parser.add_argument("--workers", type=int, default=0, help="Index shards in this many processes (0 = serial)")
+    build_parser.add_argument("--positions", action="store_true", help="Keep word positions for phrase and proximity queries")
+    build_parser.add_argument("--impacts", action="store_true", help="Precompute a quantised BM25 score per posting for the current k1 and b")
+    migrate_parser = subparsers.add_parser("migrate", help="Converts the old pickle cache into the binary index")
+    migrate_parser.add_argument("--impacts", action="store_true", help="Compute impact scores for the current k1 and b (into the existing binary index if there is one)")
+
+    segment_add_parser = subparsers.add_parser("segment_add", help="Adds (or replaces) movies from a json file into the segmented index")
+    segment_add_parser.add_argument("file", type=str, help="json file with a movies list")
+    segment_delete_parser = subparsers.add_parser("segment_delete", help="Deletes movies from the segmented index")
+    segment_delete_parser.add_argument("doc_ids", type=int, nargs="+", help="document ids")
+    segment_merge_parser = subparsers.add_parser("segment_merge", help="Merges every segment into one")
+    segment_search_parser = subparsers.add_parser("segment_search", help="BM25 search over the segmented index")
+    segment_search_parser.add_argument("query", type=str, help="Search query")
+    segment_search_parser.add_argument("--limit", type=int, default=5, help="number of results")
 
     tf_parser = subparsers.add_parser("tf", help="Takes a doc_id and term and outputs terms frequency.")
     tf_parser.add_argument("doc_id", type=int, help="document id")
@@ -37,14 +53,56 @@ def main() -> None:
     bm25search_parser = subparsers.add_parser("bm25search", help="Search movies using full BM25 scoring")
     bm25search_parser.add_argument("query", type=str, help="Search query")
     bm25search_parser.add_argument("--limit", type=int, default=5, help="Search query")
+    bm25search_parser.add_argument("--maxscore", action="store_true", help="Skip documents that can't reach the top results (MaxScore)")
+    bm25search_parser.add_argument("--server", type=str, default=None, help="ask a running search_server.py (http://host:port or unix:/path)")
+    bm25search_parser.add_argument("--cache", action="store_true", help="reuse results of earlier identical queries (cache/results.sqlite)")
+    bm25search_parser.add_argument("--proximity", action="store_true", help="Boost documents where the query terms appear close together (needs build --positions)")
+    bm25search_parser.add_argument("--fuzzy", action="store_true", help="Replace query words missing from the index with the closest indexed term")
+    bm25search_parser.add_argument("--impacts", action="store_true", help="Sum the precomputed impact scores (needs build --impacts or migrate --impacts)")
+
+    autocomplete_parser = subparsers.add_parser("autocomplete", help="Movie titles with a word starting with the prefix")
+    autocomplete_parser.add_argument("prefix", type=str, help="what has been typed so far")
+    autocomplete_parser.add_argument("--limit", type=int, default=5, help="number of titles")
+    autocomplete_parser.add_argument("--keystrokes", action="store_true", help="Type the prefix one character at a time and time every keystroke")
+
+    terms_parser = subparsers.add_parser("terms", help="Indexed terms close to a word, or starting with it")
+    terms_parser.add_argument("word", type=str, help="word to look up")
+    terms_parser.add_argument("--prefix", action="store_true", help="Terms starting with the word, most frequent first")
+    terms_parser.add_argument("--distance", type=int, default=None, help="Edits allowed (default: 0 up to 2 letters, 1 up to 5, else 2)")
+    terms_parser.add_argument("--limit", type=int, default=10, help="number of terms")
+
+    phrase_search_parser = subparsers.add_parser("phrase_search", help="Movies containing the exact phrase, ranked by BM25 (needs build --positions)")
+    phrase_search_parser.add_argument("phrase", type=str, help="phrase")
+    phrase_search_parser.add_argument("--limit", type=int, default=5, help="number of results")
+
+    build_chunks_parser = subparsers.add_parser("build_chunks", help="BM25 index over overlapping chunks of each description")
+    build_chunks_parser.add_argument("--method", type=str, choices=CHUNK_METHODS, default="words", help="chunk by words or by sentences")
+    build_chunks_parser.add_argument("--size", type=int, default=DEFAULT_CHUNK_SIZE, help="words (or sentences) per chunk")
+    build_chunks_parser.add_argument("--overlap", type=int, default=DEFAULT_OVERLAP, help="words (or sentences) shared by neighbouring chunks")
+    build_chunks_parser.add_argument("--workers", type=int, default=0, help="Index shards in this many processes (0 = serial)")
+
+    chunk_search_parser = subparsers.add_parser("chunk_search", help="BM25 over chunks, scores folded back into movies")
+    chunk_search_parser.add_argument("query", type=str, help="Search query")
+    chunk_search_parser.add_argument("--limit", type=int, default=5, help="number of results")
+    chunk_search_parser.add_argument("--aggregate", type=str, choices=AGGREGATIONS, default="max", help="a movie's best chunk score or the sum over its chunks")
 
     args = parser.parse_args()
 
     match args.command:
         case "search":
-            search_hanlder(args.query)
+            search_hanlder(args.query, args.limit)
         case "build":
-            build_handler()
+            build_handler(args.workers, args.positions, args.impacts)
+        case "migrate":
+            migrate_handler(args.impacts)
+        case "segment_add":
+            segment_add_handler(args.file)
+        case "segment_delete":
+            segment_delete_handler(args.doc_ids)
+        case "segment_merge":
+            segment_merge_handler()
+        case "segment_search":
+            segment_search_handler(args.query, args.limit)
         case "tf":
             tf_handler(args.doc_id, args.term)
         case "bm25tf":
@@ -56,7 +114,23 @@ def main() -> None:
         case "tfidf":
             tf_idf_handler(args.doc_id, args.term)
         case "bm25search":
-            bm25_handler(args.query, args.limit)
+            if args.server:
+                if args.cache:
+                    parser.error("--cache doesn't apply with --server, the server keeps its own result cache")
+                options = {name: True for name in ["maxscore", "impacts", "proximity", "fuzzy"] if getattr(args, name)}
+                server_search_handler(args.server, "keyword", args.query, args.limit, **options)
+            else:
+                bm25_handler(args.query, args.limit, args.maxscore, args.cache, args.proximity, args.impacts, args.fuzzy)
+        case "autocomplete":
+            autocomplete_handler(args.prefix, args.limit, args.keystrokes)
+        case "terms":
+            terms_handler(args.word, args.prefix, args.distance, args.limit)
+        case "phrase_search":
+            phrase_search_handler(args.phrase, args.limit)
+        case "build_chunks":
+            build_chunks_handler(args.method, args.size, args.overlap, args.workers)
+        case "chunk_search":
+            chunk_search_handler(args.query, args.limit, args.aggregate)
         case "varify":
             varify_model()
         case _:
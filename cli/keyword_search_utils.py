@@ -2,43 +2,129 @@ import json
 from pathlib import Path
 from helpers import *
 import pickle
-from tqdm import tqdm
 import math
-from collections import Counter
-import os
+from collections import Counter, defaultdict, deque
+from typing import Iterable, Iterator, Sequence, Sized
+from itertools import accumulate, batched
+from array import array
+import heapq
+from index_format import IMPACT_LEVELS, MappedIndex, PostingList, encode_positions, write_index
+from document_source import iter_documents
+from boolean_query import gallop
+from term_dictionary import DeleteIndex, TermDictionary
 
 BM25_K1 = 1.5
 BM25_B = 0.75 
+#proximity_search re-ranks this many BM25 results per requested one
+PROXIMITY_DEPTH = 10
+PROXIMITY_WEIGHT = 1.0
+#documents per shard of a parallel build whose length isn't known upfront
+STREAM_SHARD_SIZE = 2000
+
+def bm25_idf(n_docs: int, df: int) -> float:
+    return math.log((n_docs - df + 0.5) / (df + 0.5) + 1)
+
+def quantise_impact(score: float, scale: float) -> int:
+    #every posting scores above 0, it keeps at least the lowest level
+    return max(1, round(score / scale))
+
+def live_postings(postings: PostingList, dead: set[int]) -> Iterator[tuple[int, int, bytes]]:
+    ''' (doc_id, tf, encoded positions) of a posting list, skipping deleted documents '''
+    for i, (doc_id, tf) in enumerate(zip(postings.doc_ids, postings.tfs)):
+        if doc_id not in dead:
+            yield doc_id, tf, postings.position_bytes(i)
+
+def intersect_postings(lists: list[PostingList]) -> Iterator[tuple[int, list[int]]]:
+    '''
+    (doc_id, row of the doc in each list) for documents in every list. Walks
+    the first list, which should be the shortest, and gallops the others
+    from where their last match was, so the cost follows the rarest term.
+    '''
+    if not lists:
+        return
+    cursors = [0] * len(lists)
+    for row, doc_id in enumerate(lists[0].doc_ids):
+        rows = [row]
+        for i in range(1, len(lists)):
+            doc_ids = lists[i].doc_ids
+            cursors[i] = gallop(doc_ids, doc_id, cursors[i])
+            if cursors[i] == len(doc_ids):
+                return
+            if doc_ids[cursors[i]] != doc_id:
+                break
+            rows.append(cursors[i])
+        else:
+            yield doc_id, rows
+
+def min_distance(first: list[int], second: list[int], gap: int) -> int:
+    ''' smallest |s - f - gap| over positions f of first and s of second, both sorted '''
+    best = None
+    i = j = 0
+    while i < len(first) and j < len(second):
+        difference = second[j] - first[i] - gap
+        if best is None or abs(difference) < best:
+            best = abs(difference)
+        if difference < 0:
+            j += 1
+        else:
+            i += 1
+    return best
 
 class InvertedIndex:
 
-    def __init__(self):
+    def __init__(self, positional: bool = False, impacts: bool = False):
         
         self.index = {}
         self.docmap = {}
         self.doc_length = {}
         self.avg_doc_len = 0
+        self.index_file_path = Path("cache/index.bin")
+        #pickle cache of older versions, only read by migrate()
         self.index_path = Path("cache/index.pkl")
         self.docma_path = Path("cache/docmap.pkl")
         self.doclen_path = Path("cache/doclen.pkl")
         self.term_frequencies_path = Path("cache/term_frequencies.pkl")
-        self.term_frequencies: dict[int, Counter] = {}
+        self.idf_cache: dict[str, float] = {}
+        self.term_upper_bounds: dict[str, float] = {}
+        self.mapped: MappedIndex | None = None
+        #posting lists only need a sort at the end if ids arrive out of order
+        self.last_added_doc_id = -1
+        self.postings_in_order = True
+        #keep word positions per (term, doc) for phrase and proximity queries
+        self.positional = positional
+        #keep a quantised BM25 score per posting, see compute_impacts
+        self.impacts = impacts
+        #(k1, b, scale) the impacts were computed with, None while there are none
+        self.impact_params: tuple[float, float, float] | None = None
+        self.terms: TermDictionary | None = None
 
     def __add_document(self, doc_id, text):
-        
-        tokenised_text = tokenise(text)
-        self.term_frequencies[doc_id] = Counter()
-        for token in tokenised_text:
-            if token not in self.docmap:
-                self.docmap[token] = []
-            if doc_id not in self.docmap[token]:
-                self.docmap[token].append(doc_id)
-            self.term_frequencies[doc_id][token] += 1
-
+        ''' single pass: each distinct token appends one (doc_id, tf) pair to its posting list '''
+        positions = None
+        if self.positional:
+            tokens = tokenise_positions(text)
+            tokenised_text = [token for token, _ in tokens]
+            positions = defaultdict(list)
+            for token, position in tokens:
+                positions[token].append(position)
+        else:
+            tokenised_text = tokenise(text)
+        for token, tf in Counter(tokenised_text).items():
+            postings = self.docmap.get(token)
+            if postings is None:
+                postings = self.docmap[token] = PostingList.empty(self.positional)
+            postings.append(doc_id, tf, encode_positions(positions[token]) if positions is not None else None)
+
+        if doc_id <= self.last_added_doc_id:
+            self.postings_in_order = False
+        self.last_added_doc_id = doc_id
         self.doc_length[doc_id] = len(tokenised_text)
     
     def get_avg_doc_length(self)->float:
 
+        if self.mapped is not None:
+            return self.mapped.avg_doc_len
+
         if len(self.index)==0:
             return 0 
 
@@ -48,14 +134,40 @@ class InvertedIndex:
         
         return s/len(self.doc_length)
 
+    def __refresh_stats(self):
+        ''' recompute corpus level statistics, call whenever the index changes '''
+        self.avg_doc_len = self.get_avg_doc_length()
+        self.idf_cache = {}
+        self.term_upper_bounds = {}
+        self.terms = None
+
+    def __sort_postings(self):
+        #MaxScore and segment merges walk posting lists in doc id order
+        if not self.postings_in_order:
+            for token, postings in self.docmap.items():
+                order = sorted(range(len(postings)), key=lambda i: postings.doc_ids[i])
+                ordered = PostingList.empty(postings.has_positions)
+                for i in order:
+                    ordered.append(postings.doc_ids[i], postings.tfs[i], postings.position_bytes(i))
+                self.docmap[token] = ordered
+            self.postings_in_order = True
+
+    def __finish_build(self):
+        self.__sort_postings()
+        self.__refresh_stats()
+        for token in self.docmap:
+            self.token_upper_bound(token)
+        if self.impacts:
+            self.compute_impacts()
+
     def get_idf(self, term):
         term = tokenise(term)
         if len(term)>1:
             raise Exception("there should be only one term")
 
-        if term not in self.docmap.keys():
-            return 0 
         term = term[0]
+        if term not in self.docmap:
+            return 0 
         total_doc_count = len(self.index)
         term_match_doc_count = len(self.docmap[term])
         idf = math.log((total_doc_count + 1) / (term_match_doc_count + 1))
@@ -67,132 +179,74 @@ class InvertedIndex:
         if len(term)>1:
             raise Exception("there should be only one term")
 
-        term = term[0]
-
-        N = len(self.index)
-        df = len(self.docmap[term])
-        IDF = math.log((N - df + 0.5) / (df + 0.5) + 1)
-
-        return IDF
-
-    def get_documents(self, term):
-
-        term = simplify(term)
-        if term not in self.docmap.keys():
-            return []
-        return sorted(self.docmap[term])
-
-    def get_tf(self, doc_id, term):
-        self.load()
-        term = tokenise(term)
-        if len(term)>1:
-            raise Exception("there should be only one term")
-
-        term = term[0]
-        value = self.term_frequencies[doc_id].get(term)
-        return value if value else 0
-
-    def get_bm25_tf(self, doc_id, term, b=BM25_B, k1=BM25_K1):
-        self.load()
-        tf = self.get_tf(doc_id, term)
-
-        doc_length = self.doc_lengths[doc_id]
-        avg_doc_len = self.get_avg_doc_length()
-
-        if avg_doc_len > 0:
-            length_norm = 1 - b + b * (doc_length / avg_doc_len)
-        else:
-            length_norm = 1.0
-
-        tf_component = (tf * (k1 + 1)) / (tf + k1 * length_norm)
-        return tf_component
-    
-
-    def get_bm25(self, doc_id, term):
-         return self.get_bm_25_idf(term) * self.get_bm25_tf(doc_id, term)
-
-    def bm25_search(self, query):
-
-        self.load() 
-        tokenized_query = tokenise(query)
-        scores = {}
-
-        for doc_id in self.index:
-            score = 0.0
-            for token in tokenized_query:
-                score += self.get_bm25(doc_id, token)
-            scores[doc_id] = score
-
-        sorted_scores = dict(sorted(scores.items(), key=lambda x: x[1], reverse=True))
-        return sorted_scores
-
-    def build(self, movie_data_path: Path):
-
-        json = load_json(movie_data_path)
-        movies = json["movies"]
-
-        for movie in ( bar := tqdm(movies)):
-            bar.set_description_str("Building Index")
-            text = f"{movie["title"]} {movie["description"]}"
-            self.__add_document(movie['id'], text)
-            self.index[movie['id']] = movie
+        return self.token_bm25_idf(term[0])
 
-    def save(self):
-        
-        #make cache dir if not exists
-        if not os.path.exists("cache"):
-            os.mkdir("cache")
-
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index,f)
-        with open(self.docma_path, "wb") as f:
-            pickle.dump(self.docmap,f)
-        with open(self.term_frequencies_path, "wb") as f:
-            pickle.dump(self.term_frequencies,f)
-        with open(self.doclen_path, "wb") as f:
-            pickle.dump(self.doc_length,f)
+    def token_bm25_idf(self, token: str)->float:
+        ''' BM25 idf of an already tokenised term, cached per term '''
+        if token in self.idf_cache:
+            return self.idf_cache[token]
 
-    def load(self):
-        if not(self.index_path.exists() \
-              and self.docma_path.exists() \
-              and self.doclen_path.exists() \
-              and self.term_frequencies_path.exists()):
-            raise FileExistsError("path to cache file wrong check!")
-        
-        with open(self.index_path, "rb") as file:
-            self.index = pickle.load(file)
-
-        with open(self.docma_path, "rb") as file:
-            self.docmap = pickle.load(file)
-
-        with open(self.doclen_path, "rb") as file:
-            self.doc_length = pickle.load(file)
-            self.avg_doc_len = self.get_avg_doc_length()
+        IDF = bm25_idf(len(self.index), len(self.docmap.get(token, [])))
 
-        with open(self.term_frequencies_path, "rb") as file:
-            self.term_frequencies = pickle.load(file)
+        self.idf_cache[token] = IDF
+        return IDF
 
     def get_documents(self, term):
 
         term = simplify(term)
         if term not in self.docmap.keys():
             return []
-        return sorted(self.docmap[term])
+        #posting lists are kept in doc id order
+        return list(self.docmap[term])
+
+    def sorted_doc_ids(self) -> Sequence[int]:
+        if self.mapped is not None:
+            return self.mapped.doc_ids
+        return sorted(self.index)
+
+    def term_dictionary(self) -> TermDictionary:
+        '''
+        the sorted terms for prefix and fuzzy lookups. The deletion index of a
+        loaded index is saved next to the index file and rebuilt when the
+        index file changes.
+        '''
+        if self.terms is None:
+            if self.mapped is None:
+                self.terms = TermDictionary(sorted(self.docmap))
+            else:
+                from result_cache import file_version
+
+                deletes_path = self.index_file_path.with_suffix(".deletes")
+                version = file_version(self.index_file_path)
+                deletes = DeleteIndex.load(deletes_path, version)
+                if deletes is None:
+                    deletes = DeleteIndex.build(self.mapped.terms)
+                    deletes.save(deletes_path, version)
+                self.terms = TermDictionary(self.mapped.terms, deletes)
+        return self.terms
+
+    def fuzzy_term(self, token: str, max_distance: int | None = None) -> str | None:
+        ''' the token if it is indexed, else the closest term (most documents on a tie), None if nothing is close '''
+        if token in self.docmap:
+            return token
+        matches = self.term_dictionary().fuzzy(token, max_distance)
+        if not matches:
+            return None
+        return min(matches, key=lambda match: (match[1], -len(self.docmap[match[0]]), match[0]))[0]
 
     def get_tf(self, doc_id, term):
         term = tokenise(term)
         if len(term)>1:
             raise Exception("there should be only one term")
 
-        term = term[0]
-        value = self.term_frequencies[doc_id].get(term)
-        return value if value else 0
+        postings = self.docmap.get(term[0])
+        return postings.tf(doc_id) if postings else 0
 
     def get_bm25_tf(self, doc_id, term, b=BM25_B, k1=BM25_K1):
         tf = self.get_tf(doc_id, term)
 
         doc_length = self.doc_length[doc_id] 
-        avg_doc_length = self.get_avg_doc_length()
+        avg_doc_length = self.avg_doc_len
 
         length_norm = 1 - b + b * (doc_length / avg_doc_length) if avg_doc_length>0 else 1
         tf_component = (tf * (k1 + 1)) / (tf + k1 * length_norm) 
@@ -202,79 +256,411 @@ class InvertedIndex:
     def get_bm25(self, doc_id, term):
          return self.get_bm_25_idf(term) * self.get_bm25_tf(doc_id, term)
 
-    def bm25_search(self, query):
-        
-        tokenized_query = tokenise(query)
-        scores = {}
+    def __posting_score(self, doc_id, tf, idf, k1=BM25_K1, b=BM25_B, avg_doc_length=None) -> float:
+        if avg_doc_length is None:
+            avg_doc_length = self.avg_doc_len
+        length_norm = 1 - b + b * (self.doc_length[doc_id] / avg_doc_length) if avg_doc_length>0 else 1
+        return idf * (tf * (k1 + 1)) / (tf + k1 * length_norm)
+
+    def token_upper_bound(self, token: str) -> float:
+        ''' highest BM25 score the token gives any single document, cached per term '''
+        if token in self.term_upper_bounds:
+            return self.term_upper_bounds[token]
+
+        idf = self.token_bm25_idf(token)
+        postings = self.docmap.get(token)
+        if not postings:
+            return 0.0
+        bound = max(self.__posting_score(doc_id, tf, idf) for doc_id, tf in zip(postings.doc_ids, postings.tfs))
+
+        self.term_upper_bounds[token] = bound
+        return bound
+
+    def bm25_scores(self, tokens: list[str], k1=BM25_K1, b=BM25_B,
+                    idf: dict[str, float] | None = None, avg_doc_len: float | None = None) -> dict[int, float]:
+        '''
+        term-at-a-time BM25: walks only the posting lists of the query tokens
+        and accumulates partial scores per document. Documents that share no
+        term with the query never get an entry. `idf` and `avg_doc_len`
+        override this index's own statistics, e.g. with corpus wide ones
+        when this index is one segment of many.
+        '''
+        scores = defaultdict(float)
+
+        for token, query_tf in Counter(tokens).items():
+            postings = self.docmap.get(token)
+            if not postings:
+                continue
+
+            token_idf = query_tf * (idf[token] if idf is not None else self.token_bm25_idf(token))
+            for doc_id, tf in zip(postings.doc_ids, postings.tfs):
+                scores[doc_id] += self.__posting_score(doc_id, tf, token_idf, k1, b, avg_doc_len)
+
+        return scores
+
+    def compute_impacts(self):
+        '''
+        stores the BM25 score of every posting as an integer from 1 to
+        IMPACT_LEVELS, relative to the best score in the index. The k1 and b
+        used are saved with them; build --impacts or migrate --impacts have
+        to run again whenever BM25_K1, BM25_B or the documents change.
+        '''
+        k1, b = BM25_K1, BM25_B
+
+        def term_scores(token, postings):
+            idf = self.token_bm25_idf(token)
+            return (self.__posting_score(doc_id, tf, idf, k1, b) for doc_id, tf in zip(postings.doc_ids, postings.tfs))
+
+        top = max((max(term_scores(token, postings)) for token, postings in self.docmap.items() if postings), default=0.0)
+        scale = top / IMPACT_LEVELS if top > 0 else 1.0
+        docmap = {}
+        for token, postings in self.docmap.items():
+            impacts = array("B", (quantise_impact(score, scale) for score in term_scores(token, postings)))
+            docmap[token] = PostingList(postings.doc_ids, postings.tfs, postings.position_offsets,
+                                        postings.position_blob, impacts)
+        self.docmap = docmap
+        self.impacts = True
+        self.impact_params = (k1, b, scale)
+
+    def impacts_current(self) -> bool:
+        ''' the index has impacts and they were computed with the k1 and b bm25_search scores with '''
+        return self.impact_params is not None and self.impact_params[:2] == (BM25_K1, BM25_B)
+
+    def __require_impacts(self):
+        if self.impact_params is None:
+            raise ValueError("the index has no impact scores, run build --impacts or migrate --impacts")
+        if not self.impacts_current():
+            k1, b, _ = self.impact_params
+            raise ValueError(f"the impact scores were computed for k1={k1} b={b}, not k1={BM25_K1} b={BM25_B}, "
+                             "run build --impacts or migrate --impacts")
+
+    def impact_scores(self, tokens: list[str]) -> dict[int, int]:
+        ''' bm25_scores from the precomputed impacts, integer additions only; times the scale gives BM25 '''
+        scores = defaultdict(int)
+        for token, query_tf in Counter(tokens).items():
+            postings = self.docmap.get(token)
+            if postings:
+                for doc_id, impact in zip(postings.doc_ids, postings.impacts):
+                    scores[doc_id] += query_tf * impact
+        return scores
+
+    def __maxscore_top_k(self, tokens: list[str], k: int, impacts: bool = False) -> list[tuple[int, float]]:
+        '''
+        document-at-a-time MaxScore. Terms are ordered by their upper bound;
+        once the k-th best score beats the summed bounds of the weakest terms
+        those become non-essential: they are never iterated, only probed
+        (by binary search) for documents found through the essential ones.
+        With `impacts` scores, bounds and the threshold are all integers.
+        '''
+        if impacts:
+            scale = self.impact_params[2]
+            posting_score = lambda doc_id, impact, query_tf: query_tf * impact
+        else:
+            posting_score = self.__posting_score
+        terms = []
+        for token, query_tf in Counter(tokens).items():
+            postings = self.docmap.get(token)
+            if postings and impacts:
+                #quantising is monotonic, the best score's level is the best level
+                bound = query_tf * quantise_impact(self.token_upper_bound(token), scale)
+                terms.append((bound, query_tf, postings.doc_ids, postings.impacts))
+            elif postings:
+                bound = query_tf * self.token_upper_bound(token)
+                terms.append((bound, query_tf * self.token_bm25_idf(token), postings.doc_ids, postings.tfs))
+        terms.sort(key=lambda term: term[0])
+        bounds = [bound for bound, _, _, _ in terms]
+        idfs = [idf for _, idf, _, _ in terms]
+        doc_id_lists = [doc_ids for _, _, doc_ids, _ in terms]
+        tf_lists = [tfs for _, _, _, tfs in terms]
+
+        #cumulative[i] is the most terms[0..i] can add to any document
+        cumulative = list(accumulate(bounds))
+        cursors = [0] * len(terms)
+        heap = []
+        threshold = 0.0
+        first_essential = 0
+
+        while first_essential < len(terms):
+            candidate = min((doc_id_lists[i][cursors[i]] for i in range(first_essential, len(terms))
+                             if cursors[i] < len(doc_id_lists[i])), default=None)
+            if candidate is None:
+                break
 
-        for doc_id in self.index:
             score = 0.0
-            for token in tokenized_query:
-                score += self.get_bm25(doc_id, token)
-            scores[doc_id] = score
-
-        sorted_scores = dict(sorted(scores.items(), key=lambda x: x[1], reverse=True))
-        return sorted_scores
+            for i in range(first_essential, len(terms)):
+                doc_ids = doc_id_lists[i]
+                if cursors[i] < len(doc_ids) and doc_ids[cursors[i]] == candidate:
+                    score += posting_score(candidate, tf_lists[i][cursors[i]], idfs[i])
+                    cursors[i] += 1
+
+            for i in range(first_essential - 1, -1, -1):
+                if score + cumulative[i] <= threshold:
+                    break
+                doc_ids = doc_id_lists[i]
+                cursors[i] = gallop(doc_ids, candidate, cursors[i])
+                if cursors[i] < len(doc_ids) and doc_ids[cursors[i]] == candidate:
+                    score += posting_score(candidate, tf_lists[i][cursors[i]], idfs[i])
+
+            if len(heap) < k:
+                heapq.heappush(heap, (score, -candidate))
+            elif score > heap[0][0]:
+                heapq.heapreplace(heap, (score, -candidate))
+
+            if len(heap) == k:
+                threshold = heap[0][0]
+                while first_essential < len(terms) and cumulative[first_essential] <= threshold:
+                    first_essential += 1
+
+        ranked = sorted(((-neg_doc_id, score) for score, neg_doc_id in heap), key=lambda x: (-x[1], x[0]))
+        return [(doc_id, score * scale) for doc_id, score in ranked] if impacts else ranked
+
+    def __require_positions(self):
+        if not self.positional:
+            raise ValueError("phrase and proximity queries need a positional index, rebuild it with --positions")
+
+    def phrase_matches(self, phrase: str) -> dict[int, int]:
+        '''
+        doc_id -> occurrences of the phrase. The posting lists are intersected
+        smallest first and positions are decoded only for documents holding
+        every term: each term's positions, shifted back by its offset in the
+        phrase, must share a start with all the others.
+        '''
+        self.__require_positions()
+        words = tokenise_positions(phrase)
+        terms = []
+        for token, offset in words:
+            postings = self.docmap.get(token)
+            if not postings:
+                return {}
+            terms.append((offset, postings))
+        terms.sort(key=lambda term: len(term[1]))
+
+        matches = {}
+        for doc_id, rows in intersect_postings([postings for _, postings in terms]):
+            starts = None
+            for (offset, postings), row in zip(terms, rows):
+                shifted = {position - offset for position in postings.positions(row)}
+                starts = shifted if starts is None else starts & shifted
+                if not starts:
+                    break
+            if starts:
+                matches[doc_id] = len(starts)
+        return matches
+
+    def phrase_search(self, phrase: str, k: int | None = None) -> list[tuple[int, float]]:
+        ''' documents containing the exact phrase (stop words match any word), ranked by BM25 of its terms '''
+        matches = self.phrase_matches(phrase)
+        terms = [(self.docmap[token], query_tf * self.token_bm25_idf(token))
+                 for token, query_tf in Counter(tokenise(phrase)).items()] if matches else []
+        scores = {doc_id: sum(self.__posting_score(doc_id, postings.tf(doc_id), idf) for postings, idf in terms)
+                  for doc_id in matches}
+        ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        return ranked if k is None else ranked[:k]
+
+    def proximity_search(self, query: str, k: int = 5, weight: float = PROXIMITY_WEIGHT) -> list[tuple[int, float]]:
+        '''
+        BM25 with a term proximity boost. The best k * PROXIMITY_DEPTH BM25
+        matches gain weight * min(idf a, idf b) / d^2 for every pair of
+        neighbouring query terms a, b, where d - 1 is how far the closest
+        pair of occurrences is from the spacing the query has (d = 1 when
+        they appear as in the query).
+        '''
+        self.__require_positions()
+        words = tokenise_positions(query)
+        pairs = [(a, b, b_offset - a_offset) for (a, a_offset), (b, b_offset) in zip(words, words[1:]) if a != b]
+        rescored = []
+        for doc_id, score in self.bm25_search(query, k * PROXIMITY_DEPTH):
+            positions = {}
+            for a, b, gap in pairs:
+                for token in (a, b):
+                    if token not in positions:
+                        postings = self.docmap.get(token)
+                        positions[token] = postings.positions_of(doc_id) if postings else []
+                if positions[a] and positions[b]:
+                    d = min_distance(positions[a], positions[b], gap) + 1
+                    score += weight * min(self.token_bm25_idf(a), self.token_bm25_idf(b)) / d ** 2
+            rescored.append((doc_id, score))
+        return heapq.nsmallest(k, rescored, key=lambda x: (-x[1], x[0]))
+
+    def bm25_search(self, query, k: int | None = None, maxscore: bool = False,
+                    impacts: bool = False, fuzzy: bool = False) -> list[tuple[int, float]]:
+        '''
+        returns (doc_id, score) pairs, best first. With `k` only the top k
+        are kept, using a bounded heap instead of sorting every match;
+        `maxscore` additionally skips documents that can't make the top k.
+        `impacts` sums the precomputed integer scores instead, BM25 to
+        within the quantisation step. `fuzzy` swaps query terms missing
+        from the index for their closest indexed term.
+        '''
+        tokenized_query = tokenise(query)
+        if fuzzy:
+            tokenized_query = [term for token in tokenized_query if (term := self.fuzzy_term(token)) is not None]
 
-    def build(self, movie_data_path: Path):
+        if k is not None and k <= 0:
+            return []
+        if impacts:
+            self.__require_impacts()
+        if maxscore and k is not None:
+            return self.__maxscore_top_k(tokenized_query, k, impacts)
+
+        scores = self.impact_scores(tokenized_query) if impacts else self.bm25_scores(tokenized_query)
+        if k is None:
+            ranked = sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        else:
+            ranked = heapq.nsmallest(k, scores.items(), key=lambda x: (-x[1], x[0]))
+        if impacts:
+            scale = self.impact_params[2]
+            return [(doc_id, impact * scale) for doc_id, impact in ranked]
+        return ranked
+
+    def build(self, movie_data_path: Path, workers: int = 0):
+        ''' streams the documents of a .json or .jsonl file into the index, see document_source '''
+        movies = iter_documents(movie_data_path)
+        if workers > 1:
+            self.build_parallel(movies, workers)
+        else:
+            self.build_from_movies(movies)
 
-        json = load_json(movie_data_path)
-        movies = json["movies"]
+    def add_movies(self, movies: Iterable[dict], progress: bool = True):
+        ''' indexes movies without recomputing the corpus statistics, see build_from_movies '''
+        #tqdm is slow to import, only index builds use it
+        from tqdm import tqdm
 
-        for movie in ( bar := tqdm(movies)):
+        for movie in ( bar := tqdm(movies, disable=not progress)):
             bar.set_description_str("Building Index")
             text = f"{movie["title"]} {movie["description"]}"
             self.__add_document(movie['id'], text)
             self.index[movie['id']] = movie
 
+    def build_from_movies(self, movies: Iterable[dict]):
+
+        self.add_movies(movies)
+        self.__finish_build()
+
+    @staticmethod
+    def index_shard(movies: list[dict], positional: bool = False) -> "InvertedIndex":
+        ''' process pool worker: indexes one shard into a segment with sorted posting lists '''
+        segment = InvertedIndex(positional)
+        segment.add_movies(movies, progress=False)
+        segment.__sort_postings()
+        return segment
+
+    def merge_segments(self, segments: list["InvertedIndex"], deleted: list[set[int]] | None = None):
+        '''
+        merges independently built segments into this index. Each term's
+        posting lists are k-way merged by doc id, so segments may cover any
+        (disjoint) set of documents. deleted[i] holds doc ids of segments[i]
+        that are left out of the merge. Positions are kept if this index and
+        every segment have them.
+        '''
+        self.__sort_postings()
+        self.positional = self.positional and all(segment.positional for segment in segments)
+        deleted = deleted or [set() for _ in segments]
+        by_term = defaultdict(list)
+        for term, postings in self.docmap.items():
+            by_term[term].append(live_postings(postings, set()))
+        for segment, dead in zip(segments, deleted):
+            for doc_id in segment.index:
+                if doc_id not in dead:
+                    self.index[doc_id] = segment.index[doc_id]
+                    self.doc_length[doc_id] = segment.doc_length[doc_id]
+            for term, postings in segment.docmap.items():
+                by_term[term].append(live_postings(postings, dead))
+
+        for term, posting_lists in by_term.items():
+            merged = PostingList.empty(self.positional)
+            #doc ids are unique across segments, so the merge never compares positions
+            for doc_id, tf, positions in heapq.merge(*posting_lists):
+                merged.append(doc_id, tf, positions)
+            if merged:
+                self.docmap[term] = merged
+            else:
+                self.docmap.pop(term, None)
+
+        self.__finish_build()
+
+    def build_parallel(self, movies: Iterable[dict], workers: int, shards_per_worker: int = 4,
+                       shard_size: int | None = None):
+        '''
+        splits the corpus into shards, indexes them in a process pool and
+        merges the segments. A few shards per worker keeps the pool busy
+        when shards take uneven time. movies may be a stream (see
+        document_source): shards are cut as documents arrive and at most
+        workers * shards_per_worker of them wait in the pool at a time.
+        '''
+        if shard_size is None and isinstance(movies, Sized):
+            shard_size = math.ceil(len(movies) / (workers * shards_per_worker))
+        shard_size = max(1, shard_size or STREAM_SHARD_SIZE)
+
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        from tqdm import tqdm
+
+        segments = []
+        pending = deque()
+        #spawn: forking a process that already runs threads (tqdm's monitor) can deadlock
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool, \
+                tqdm(desc="Building Index", unit=" shards") as bar:
+            for shard in batched(movies, shard_size):
+                if len(pending) >= workers * shards_per_worker:
+                    segments.append(pending.popleft().result())
+                    bar.update()
+                pending.append(pool.submit(InvertedIndex.index_shard, list(shard), self.positional))
+            while pending:
+                segments.append(pending.popleft().result())
+                bar.update()
+
+        self.merge_segments(segments)
+
     def save(self):
-        
-        #make cache dir if not exists
-        if not os.path.exists("cache"):
-            os.mkdir("cache")
-
-        with open(self.index_path, "wb") as f:
-            pickle.dump(self.index,f)
-        with open(self.docma_path, "wb") as f:
-            pickle.dump(self.docmap,f)
-        with open(self.term_frequencies_path, "wb") as f:
-            pickle.dump(self.term_frequencies,f)
-        with open(self.doclen_path, "wb") as f:
-            pickle.dump(self.doc_length,f)
+        write_index(self.index_file_path, self.index, self.docmap, self.doc_length,
+                    self.term_upper_bounds, self.avg_doc_len, self.impact_params)
 
     def load(self):
+        if not self.index_file_path.exists():
+            if self.index_path.exists():
+                raise FileNotFoundError(f"{self.index_file_path} not found, run migrate to convert the old pickle cache")
+            raise FileNotFoundError(f"{self.index_file_path} not found, run build first")
+
+        self.mapped = MappedIndex(self.index_file_path)
+        self.index = self.mapped.documents
+        self.docmap = self.mapped.postings
+        self.doc_length = self.mapped.doc_lengths
+        self.positional = self.mapped.has_positions
+        self.impact_params = self.mapped.impact_params
+        self.impacts = self.impact_params is not None
+
+        self.__refresh_stats()
+        self.term_upper_bounds = self.mapped.upper_bounds
+
+    def migrate(self):
+        ''' converts the pickle cache of older versions into the binary index file '''
         if not(self.index_path.exists() \
               and self.docma_path.exists() \
               and self.doclen_path.exists() \
               and self.term_frequencies_path.exists()):
-            raise FileExistsError("path to cache file wrong check!")
+            raise FileNotFoundError("no pickle cache to migrate")
         
         with open(self.index_path, "rb") as file:
             self.index = pickle.load(file)
 
         with open(self.docma_path, "rb") as file:
-            self.docmap = pickle.load(file)
+            docmap = pickle.load(file)
 
         with open(self.doclen_path, "rb") as file:
             self.doc_length = pickle.load(file)
 
         with open(self.term_frequencies_path, "rb") as file:
-            self.term_frequencies = pickle.load(file)
-    
-
-def get_stop_words(file: Path) -> list[str]:
-    ''' you know what it does'''
-    if not file.exists():
-        raise FileNotFoundError(f"file {file} doesn't exists")
-    
-    with open(file, "r", encoding="utf-8") as f:
-        stop_words = []
-        for line in f:
-            stop_words.append(line.strip())
-        return stop_words
+            term_frequencies = pickle.load(file)
 
+        for token, doc_ids in docmap.items():
+            doc_ids = sorted(doc_ids)
+            tfs = array("I", (term_frequencies[doc_id][token] for doc_id in doc_ids))
+            self.docmap[token] = PostingList(array("I", doc_ids), tfs)
 
-stop_words = get_stop_words(Path("data/stop_words.txt"))
+        self.__finish_build()
+        self.save()
+    
 
 def load_json(file: Path)->dict:
     """loads the json file, returns and error if not exist."""
@@ -282,7 +668,7 @@ def load_json(file: Path)->dict:
     if not file.exists():
         raise FileNotFoundError(f"file {file} doesn't exists")
 
-    with open("data/movies.json", "r", encoding="utf-8") as f:
+    with open(file, "r", encoding="utf-8") as f:
         total_json = f.read()
 
     movies_json = json.loads(total_json)
@@ -298,7 +684,7 @@ def search_movies(file: Path, search_query: str) -> list[str]:
     total_json = load_json(file)
     movies =  total_json["movies"]
  
-    search_query_tokens = tokenise(remove_stop_words(search_query, stop_words=stop_words))
+    search_query_tokens = tokenise(remove_stop_words(search_query, stop_words=load_stop_words()))
     matched_movies = []
     for movie in movies:
         movie_titles: str = movie['title']
@@ -0,0 +1,293 @@
+'''
+approximate nearest neighbour indexes over the unit length document
+embeddings, so a query scores a small candidate set instead of every row.
+
+    IVFIndex    spherical k-means centroids, each row filed under its
+                closest centroid; a query scans the `nprobe` best lists
+    HNSWIndex   hierarchical navigable small world graph; a query walks
+                the graph keeping the `ef` best nodes seen so far
+
+Both score with dot products (cosine, since rows are normalised), return
+(indices, scores) best first, and keep only ids / links: the vectors are
+the embedding matrix itself, attached after loading. The index file sits
+next to cache/embeddings.npy and records a fingerprint of the matrix it
+was built from, so a changed corpus triggers a rebuild.
+'''
+import hashlib
+import heapq
+import math
+import os
+from pathlib import Path
+import numpy as np
+from helpers import normalize, top_k_indices
+
+
+def fingerprint(vectors: np.ndarray) -> str:
+    digest = hashlib.sha1(str(vectors.shape).encode("utf-8"))
+    digest.update(np.ascontiguousarray(vectors).tobytes())
+    return digest.hexdigest()
+
+
+class IVFIndex:
+    ''' inverted file index: rows grouped by nearest centroid, lists stored contiguously in one id array '''
+
+    kind = "ivf"
+
+    def __init__(self, n_lists: int | None = None, nprobe: int = 8, iterations: int = 10, seed: int = 0):
+        #None picks sqrt(n) lists at build time
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.vectors: np.ndarray = None
+        self.centroids: np.ndarray = None
+        self.list_offsets: np.ndarray = None
+        self.list_ids: np.ndarray = None
+
+    def params(self) -> dict:
+        ''' build parameters, an index built with other ones is stale '''
+        return {"n_lists": self.n_lists, "iterations": self.iterations, "seed": self.seed}
+
+    @staticmethod
+    def __assign(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 65536) -> np.ndarray:
+        ''' nearest centroid of every row, chunked so the score matrix stays small '''
+        return np.concatenate([np.argmax(vectors[start:start + chunk] @ centroids.T, axis=1)
+                               for start in range(0, len(vectors), chunk)])
+
+    def build(self, vectors: np.ndarray):
+        self.vectors = vectors
+        n = len(vectors)
+        n_lists = min(n, self.n_lists or max(1, round(math.sqrt(n))))
+        rng = np.random.default_rng(self.seed)
+        centroids = vectors[rng.choice(n, n_lists, replace=False)].astype(np.float32)
+
+        for _ in range(self.iterations):
+            assignment = self.__assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, vectors)
+            counts = np.bincount(assignment, minlength=n_lists)
+            #an empty list restarts from a random row
+            empty = counts == 0
+            sums[empty] = vectors[rng.choice(n, int(empty.sum()))]
+            centroids = normalize(sums).astype(np.float32)
+
+        assignment = self.__assign(vectors, centroids)
+        self.centroids = centroids
+        self.list_ids = np.argsort(assignment, kind="stable").astype(np.int64)
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=n_lists))]).astype(np.int64)
+        return self
+
+    def search(self, query: np.ndarray, k: int, nprobe: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        probes = top_k_indices(self.centroids @ query, nprobe or self.nprobe)
+        candidates = np.concatenate([self.list_ids[self.list_offsets[p]:self.list_offsets[p + 1]] for p in probes])
+        scores = self.vectors[candidates] @ query
+        top = top_k_indices(scores, k)
+        return candidates[top], scores[top]
+
+    def arrays(self) -> dict:
+        return {"centroids": self.centroids, "list_offsets": self.list_offsets, "list_ids": self.list_ids}
+
+    def restore(self, arrays: dict, vectors: np.ndarray):
+        self.vectors = vectors
+        self.centroids = arrays["centroids"]
+        self.list_offsets = arrays["list_offsets"]
+        self.list_ids = arrays["list_ids"]
+        return self
+
+
+class HNSWIndex:
+    '''
+    HNSW graph (Malkov & Yashunin). Every node gets a random top layer,
+    upper layers are sparse express lanes used for a greedy descent and
+    layer 0 holds everything with up to 2*m links per node.
+    '''
+
+    kind = "hnsw"
+
+    def __init__(self, m: int = 16, ef_construction: int = 100, ef: int = 50, seed: int = 0):
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.seed = seed
+        self.vectors: np.ndarray = None
+        #layer -> node -> linked nodes
+        self.layers: list[dict[int, list[int]]] = []
+        self.entry_point = -1
+
+    def params(self) -> dict:
+        return {"m": self.m, "ef_construction": self.ef_construction, "seed": self.seed}
+
+    def __search_layer(self, query: np.ndarray, entry_points: list[int], ef: int, layer: int) -> list[tuple[float, int]]:
+        ''' best first search of one layer, returns up to ef (score, node) pairs best first '''
+        graph = self.layers[layer]
+        visited = set(entry_points)
+        scores = (self.vectors[entry_points] @ query).tolist()
+        #candidates is a max heap on score, results a min heap holding the ef best
+        candidates = [(-score, node) for score, node in zip(scores, entry_points)]
+        results = [(score, node) for score, node in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            score, node = heapq.heappop(candidates)
+            if -score < results[0][0] and len(results) >= ef:
+                break
+            neighbours = [n for n in graph[node] if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            for score, n in zip((self.vectors[neighbours] @ query).tolist(), neighbours):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, n))
+                    heapq.heappush(results, (score, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def __select_neighbours(self, found: list[tuple[float, int]], m: int) -> list[int]:
+        '''
+        the paper's heuristic: a candidate is kept only if it is closer to
+        the new node than to any neighbour kept so far, which spreads links
+        across clusters; leftover slots are filled with the closest rest.
+        '''
+        nodes = [node for _, node in found]
+        #similarities between all candidates in one product
+        pairwise = self.vectors[nodes] @ self.vectors[nodes].T
+        kept, skipped = [], []
+        for i, (score, node) in enumerate(found):
+            if len(kept) == m:
+                break
+            if not kept or score > pairwise[i, kept].max():
+                kept.append(i)
+            else:
+                skipped.append(i)
+        return [nodes[i] for i in kept + skipped[:m - len(kept)]]
+
+    def __insert(self, node: int, level: int):
+        query = self.vectors[node]
+        if self.entry_point < 0:
+            self.layers = [{node: []} for _ in range(level + 1)]
+            self.entry_point = node
+            return
+
+        top = len(self.layers) - 1
+        entry_points = [self.entry_point]
+        for layer in range(top, level, -1):
+            entry_points = [self.__search_layer(query, entry_points, 1, layer)[0][1]]
+
+        for layer in range(min(level, top), -1, -1):
+            found = self.__search_layer(query, entry_points, self.ef_construction, layer)
+            graph = self.layers[layer]
+            max_links = 2 * self.m if layer == 0 else self.m
+            graph[node] = self.__select_neighbours(found, self.m)
+            for n in graph[node]:
+                links = graph[n]
+                links.append(node)
+                if len(links) > max_links:
+                    scores = self.vectors[links] @ self.vectors[n]
+                    graph[n] = [links[i] for i in top_k_indices(scores, max_links)]
+            entry_points = [n for _, n in found]
+
+        if level > top:
+            for _ in range(top + 1, level + 1):
+                self.layers.append({node: []})
+            self.entry_point = node
+
+    def build(self, vectors: np.ndarray):
+        self.vectors = vectors
+        self.layers = []
+        self.entry_point = -1
+        rng = np.random.default_rng(self.seed)
+        #level ~ floor(-ln(U) / ln(m)), so each layer holds about 1/m of the one below
+        levels = np.floor(-np.log(1 - rng.random(len(vectors))) / math.log(self.m)).astype(int)
+        for node, level in enumerate(levels.tolist()):
+            self.__insert(node, level)
+        return self
+
+    def search(self, query: np.ndarray, k: int, ef: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        if self.entry_point < 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        entry_points = [self.entry_point]
+        for layer in range(len(self.layers) - 1, 0, -1):
+            entry_points = [self.__search_layer(query, entry_points, 1, layer)[0][1]]
+        found = self.__search_layer(query, entry_points, max(ef or self.ef, k), 0)[:k]
+        return np.array([n for _, n in found], dtype=np.int64), np.array([s for s, _ in found], dtype=np.float32)
+
+    def arrays(self) -> dict:
+        ''' every layer as CSR style (nodes, offsets, links) arrays '''
+        arrays = {"entry_point": np.array([self.entry_point, len(self.layers)], dtype=np.int64)}
+        for layer, graph in enumerate(self.layers):
+            nodes = sorted(graph)
+            arrays[f"nodes_{layer}"] = np.array(nodes, dtype=np.int64)
+            arrays[f"offsets_{layer}"] = np.cumsum([0] + [len(graph[n]) for n in nodes]).astype(np.int64)
+            arrays[f"links_{layer}"] = np.array([l for n in nodes for l in graph[n]], dtype=np.int64)
+        return arrays
+
+    def restore(self, arrays: dict, vectors: np.ndarray):
+        self.vectors = vectors
+        self.entry_point, n_layers = arrays["entry_point"].tolist()
+        self.layers = []
+        for layer in range(n_layers):
+            nodes = arrays[f"nodes_{layer}"].tolist()
+            offsets = arrays[f"offsets_{layer}"].tolist()
+            links = arrays[f"links_{layer}"].tolist()
+            self.layers.append({node: links[offsets[i]:offsets[i + 1]] for i, node in enumerate(nodes)})
+        return self
+
+
+ANN_INDEXES = {"ivf": IVFIndex, "hnsw": HNSWIndex}
+
+
+def ann_path(kind: str, embeddings_path: Path = Path("cache/embeddings.npy")) -> Path:
+    return embeddings_path.with_name(f"ann_{kind}.npz")
+
+
+def save_ann(index, path: Path):
+    os.makedirs(path.parent, exist_ok=True)
+    params = index.params()
+    meta = {f"param_{name}": np.array(-1 if value is None else value) for name, value in params.items()}
+    tmp_path = path.with_name(path.name + ".tmp.npz")
+    np.savez(tmp_path, fingerprint=np.array(fingerprint(index.vectors)), **meta, **index.arrays())
+    os.replace(tmp_path, path)
+
+
+def load_ann(index, path: Path, vectors: np.ndarray, required: dict | None = None):
+    '''
+    restores `index` from path, None if the file is missing, built from
+    other vectors, or built with parameters that differ from `required`.
+    Build parameters not in `required` are taken from the file.
+    '''
+    if not path.exists():
+        return None
+    with np.load(path) as data:
+        if str(data["fingerprint"]) != fingerprint(vectors):
+            return None
+        stored = {name: int(data[f"param_{name}"]) for name in index.params()}
+        stored = {name: None if value == -1 else value for name, value in stored.items()}
+        if any(stored[name] != value for name, value in (required or {}).items()):
+            return None
+        for name, value in stored.items():
+            setattr(index, name, value)
+        return index.restore({name: data[name] for name in data.files}, vectors)
+
+
+def load_or_build_ann(kind: str, vectors: np.ndarray, path: Path | None = None, **params):
+    '''
+    the `kind` index over vectors, read from path when it still matches,
+    otherwise built and saved. params are constructor arguments; only the
+    build parameters given here can force a rebuild, query knobs (nprobe,
+    ef) never do.
+    '''
+    if kind not in ANN_INDEXES:
+        raise ValueError(f"unknown ann index {kind}, expected one of {', '.join(ANN_INDEXES)}")
+    path = path or ann_path(kind)
+    index = ANN_INDEXES[kind](**params)
+    required = {name: value for name, value in params.items() if name in index.params()}
+    loaded = load_ann(index, path, vectors, required)
+    if loaded is not None:
+        return loaded
+    index.build(vectors)
+    save_ann(index, path)
+    return index
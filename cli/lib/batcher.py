@@ -0,0 +1,84 @@
+'''
+micro-batching of concurrent semantic queries. Callers submit single
+queries; a scheduler thread waits up to `max_wait` seconds after the first
+arrival (or until `max_batch` queries are queued), runs them through
+search_batch as one encode and one matrix-matrix product, and hands every
+caller its own slice of the answer.
+'''
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+#search_batch(queries, limit) -> one [(row, score), ...] list per query, like SemanticSearch.search_batch
+SearchBatch = Callable[[List[str], int], List[List[tuple[int, float]]]]
+
+
+class MicroBatcher:
+
+    def __init__(self, search_batch: SearchBatch, max_batch: int = 32, max_wait: float = 0.002):
+        self.search_batch = search_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending: queue.Queue[tuple[str, int, Future] | None] = queue.Queue()
+        self.batches = 0
+        self.queries = 0
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def submit(self, query: str, limit: int = 5) -> Future:
+        future = Future()
+        self.pending.put((query, limit, future))
+        return future
+
+    def search(self, query: str, limit: int = 5) -> List[tuple[int, float]]:
+        return self.submit(query, limit).result()
+
+    def __collect(self) -> list[tuple[str, int, Future]] | None:
+        ''' blocks for the first query, then gathers more until the window closes or the batch is full '''
+        first = self.pending.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.pending.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                #finish this batch, then stop
+                self.pending.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def __run(self):
+        while (batch := self.__collect()) is not None:
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            #one call at the largest limit, each caller gets its own prefix
+            limit = max(limit for _, limit, _ in batch)
+            try:
+                results = self.search_batch([query for query, _, _ in batch], limit)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.queries += len(batch)
+            for (_, limit, future), result in zip(batch, results):
+                future.set_result(result[:limit])
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.queries / self.batches if self.batches else 0.0
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
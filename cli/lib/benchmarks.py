@@ -0,0 +1,412 @@
+import math
+import multiprocessing
+import random
+import re
+import resource
+import string
+import subprocess
+import sys
+import time
+from collections import Counter
+from functools import lru_cache
+from itertools import accumulate, islice
+from pathlib import Path
+from typing import Callable, Iterator, List
+
+import numpy as np
+from nltk.stem import PorterStemmer
+from helpers import STOP_WORDS_PATH, get_stop_words, normalize, tokenise, tokenise_many, top_k_indices
+from keyword_search_utils import InvertedIndex
+from concurrent.futures import ThreadPoolExecutor
+from lib.ann import HNSWIndex, IVFIndex
+from lib.batcher import MicroBatcher
+from lib.quantization import QuantizedEmbeddings
+
+
+def synthetic_vocabulary(size: int, seed: int = 0) -> List[str]:
+    ''' random lowercase "words" so the benchmarks don't need data/movies.json '''
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        length = rng.randint(3, 10)
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(length)))
+    return sorted(words)
+
+
+def iter_synthetic_movies(n_docs: int, vocab_size: int = 5000, doc_len: int = 60, seed: int = 0) -> Iterator[dict]:
+    '''
+    movies shaped like data/movies.json, word frequencies follow a zipf like
+    curve so a few terms have very long posting lists like real text.
+    '''
+    rng = random.Random(seed)
+    vocab = synthetic_vocabulary(vocab_size, seed)
+    cum_weights = list(accumulate(1 / (rank + 1) for rank in range(vocab_size)))
+
+    for doc_id in range(1, n_docs + 1):
+        title = " ".join(rng.choices(vocab, cum_weights=cum_weights, k=3))
+        description = " ".join(rng.choices(vocab, cum_weights=cum_weights, k=rng.randint(doc_len // 2, doc_len * 2)))
+        yield {"id": doc_id, "title": title, "description": description}
+
+
+def synthetic_movies(n_docs: int, vocab_size: int = 5000, doc_len: int = 60, seed: int = 0) -> List[dict]:
+    return list(iter_synthetic_movies(n_docs, vocab_size, doc_len, seed))
+
+
+def time_it(function: Callable, repeat: int = 5) -> float:
+    ''' best wall time of `repeat` runs, in milliseconds '''
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def full_scan_bm25(inv_idx: InvertedIndex, query: str) -> dict[int, float]:
+    ''' the old scoring loop: every document times every query token '''
+    tokens = tokenise(query)
+    return {doc_id: sum(inv_idx.get_bm25(doc_id, token) for token in tokens) for doc_id in inv_idx.index}
+
+
+def bm25_benchmark(sizes: List[int], queries: int = 20, scan_limit: int = 20000, seed: int = 0):
+    ''' query latency of the posting list scorer vs the full scan as the corpus grows '''
+    rng = random.Random(seed)
+    vocab = synthetic_vocabulary(5000, seed)
+    query_set = [" ".join(rng.choices(vocab[:500], k=rng.randint(1, 4))) for _ in range(queries)]
+
+    print(f"{'docs':>10} {'postings ms/q':>15} {'top10 ms/q':>12} {'maxscore ms/q':>15} {'impacts ms/q':>13} "
+          f"{'impacts maxscore ms/q':>22} {'full scan ms/q':>15}")
+    for size in sizes:
+        inv_idx = InvertedIndex(impacts=True)
+        inv_idx.build_from_movies(synthetic_movies(size, seed=seed))
+
+        postings_ms = time_it(lambda: [inv_idx.bm25_search(q) for q in query_set], repeat=3) / queries
+        top_k_ms = time_it(lambda: [inv_idx.bm25_search(q, 10) for q in query_set], repeat=3) / queries
+        maxscore_ms = time_it(lambda: [inv_idx.bm25_search(q, 10, maxscore=True) for q in query_set], repeat=3) / queries
+        impacts_ms = time_it(lambda: [inv_idx.bm25_search(q, 10, impacts=True) for q in query_set], repeat=3) / queries
+        impacts_maxscore_ms = time_it(lambda: [inv_idx.bm25_search(q, 10, maxscore=True, impacts=True) for q in query_set],
+                                      repeat=3) / queries
+        if size <= scan_limit:
+            scan_ms = time_it(lambda: [full_scan_bm25(inv_idx, q) for q in query_set], repeat=1) / queries
+            scan = f"{scan_ms:15.3f}"
+        else:
+            scan = f"{'skipped':>15}"
+        print(f"{size:>10} {postings_ms:15.3f} {top_k_ms:12.3f} {maxscore_ms:15.3f} {impacts_ms:13.3f} "
+              f"{impacts_maxscore_ms:22.3f} {scan}")
+
+
+def embedding_build_benchmark(n_docs: int, batch_sizes: List[int], workers: List[int], seed: int = 0):
+    ''' documents per second of SemanticSearch.encode_texts for each batch size / worker count '''
+    from lib.semantic_search import SemanticSearch
+
+    search = SemanticSearch()
+    texts = [f"{movie['title']} {movie['description']}" for movie in synthetic_movies(n_docs, doc_len=40, seed=seed)]
+
+    print(f"{'batch':>8} {'workers':>8} {'seconds':>10} {'docs/s':>10}")
+    for num_workers in workers:
+        for batch_size in batch_sizes:
+            seconds = time_it(lambda: search.encode_texts(texts, batch_size, num_workers), repeat=1) / 1000
+            print(f"{batch_size:>8} {num_workers:>8} {seconds:10.2f} {n_docs / seconds:10.1f}")
+
+
+def legacy_build(movies) -> dict:
+    ''' the old build: posting lists with a linear membership check plus a Counter per document '''
+    index, docmap, doc_length, term_frequencies = {}, {}, {}, {}
+    for movie in movies:
+        doc_id = movie["id"]
+        tokens = tokenise(f"{movie['title']} {movie['description']}")
+        term_frequencies[doc_id] = Counter()
+        for token in tokens:
+            if token not in docmap:
+                docmap[token] = []
+            if doc_id not in docmap[token]:
+                docmap[token].append(doc_id)
+            term_frequencies[doc_id][token] += 1
+        doc_length[doc_id] = len(tokens)
+        index[doc_id] = movie
+    return index
+
+
+def _measure_build(legacy: bool, n_docs: int, doc_len: int, results):
+    movies = iter_synthetic_movies(n_docs, doc_len=doc_len)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if legacy:
+        legacy_build(movies)
+    else:
+        InvertedIndex().build_from_movies(movies)
+    seconds = time.perf_counter() - start
+    #ru_maxrss is in KiB on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    results.put((seconds, peak / 1024))
+
+
+def build_benchmark(sizes: List[int], doc_len: int = 20, legacy_limit: int = 100000):
+    '''
+    build time and peak resident memory growth of the index build. Every
+    build runs in a fresh process so one build's heap doesn't hide the next.
+    '''
+    context = multiprocessing.get_context("fork")
+    print(f"{'docs':>10} {'build':>8} {'seconds':>10} {'peak MiB':>10}")
+    for size in sizes:
+        for legacy in [False, True]:
+            if legacy and size > legacy_limit:
+                print(f"{size:>10} {'legacy':>8} {'skipped':>10} {'':>10}")
+                continue
+            results = context.Queue()
+            process = context.Process(target=_measure_build, args=(legacy, size, doc_len, results))
+            process.start()
+            seconds, peak = results.get()
+            process.join()
+            name = "legacy" if legacy else "arrays"
+            print(f"{size:>10} {name:>8} {seconds:10.2f} {peak:10.1f}")
+
+
+@lru_cache(maxsize=None)
+def legacy_stop_words() -> list[str]:
+    return get_stop_words(STOP_WORDS_PATH)
+
+
+def legacy_tokenise(s: str) -> list[str]:
+    ''' helpers.tokenise before the Tokenizer: fresh stemmer per token, list scan for stop words '''
+    punctuations = '''!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'''
+    trans_map = s.maketrans({p: "" for p in punctuations})
+    tokens = s.translate(trans_map).lower().strip().split()
+    return [PorterStemmer().stem(token) for token in tokens if token not in legacy_stop_words()]
+
+
+def tokenise_benchmark(n_docs: int = 2000, doc_len: int = 60):
+    ''' microseconds per document for the old and the current tokenisation '''
+    texts = [f"{movie['title']} {movie['description']}" for movie in iter_synthetic_movies(n_docs, doc_len=doc_len)]
+    tokens = sum(len(text.split()) for text in texts)
+
+    legacy_ms = time_it(lambda: [legacy_tokenise(text) for text in texts], repeat=1)
+    current_ms = time_it(lambda: [tokenise(text) for text in texts], repeat=3)
+    batch_ms = time_it(lambda: tokenise_many(texts), repeat=3)
+
+    print(f"{n_docs} documents, {tokens} tokens")
+    print(f"{'version':>14} {'us/doc':>10} {'ns/token':>10}")
+    for name, ms in [("legacy", legacy_ms), ("tokenise", current_ms), ("tokenise_many", batch_ms)]:
+        print(f"{name:>14} {ms * 1000 / n_docs:10.1f} {ms * 1e6 / tokens:10.1f}")
+
+
+def parallel_build_benchmark(n_docs: int, workers: List[int], doc_len: int = 20):
+    ''' wall time of the sharded build for each worker count, 0 is the serial build '''
+    movies = synthetic_movies(n_docs, doc_len=doc_len)
+    print(f"{'workers':>8} {'seconds':>10} {'speedup':>8}")
+    serial = None
+    for num_workers in workers:
+        def build():
+            inv_idx = InvertedIndex()
+            if num_workers > 1:
+                inv_idx.build_parallel(movies, num_workers)
+            else:
+                inv_idx.build_from_movies(movies)
+        seconds = time_it(build, repeat=1) / 1000
+        serial = serial or seconds
+        print(f"{num_workers:>8} {seconds:10.2f} {serial / seconds:8.2f}")
+
+
+def boolean_benchmark(n_docs: int, queries: int = 20, seed: int = 0):
+    '''
+    latency of AND queries, galloping cursors vs intersecting whole sets
+    and the first 5 matches vs all of them. common: two or three of the
+    most frequent words; skewed: one rare word and two frequent ones.
+    '''
+    from boolean_query import boolean_search
+
+    rng = random.Random(seed)
+    vocab = synthetic_vocabulary(5000, seed)
+    inv_idx = InvertedIndex()
+    inv_idx.build_from_movies(synthetic_movies(n_docs, seed=seed))
+    #the head of the zipf curve has posting lists covering a large part of the corpus
+    query_sets = {
+        "common": [" ".join(rng.sample(vocab[:20], k=rng.randint(2, 3))) for _ in range(queries)],
+        "skewed": [" ".join([rng.choice(vocab[1000:2000])] + rng.sample(vocab[:20], k=2)) for _ in range(queries)],
+    }
+
+    def set_intersection(query):
+        return sorted(set.intersection(*(set(inv_idx.get_documents(token)) for token in query.split())))
+
+    print(f"{n_docs} docs")
+    print(f"{'queries':>8} {'matches/q':>10} {'set intersection ms/q':>22} {'galloping ms/q':>15} {'first 5 ms/q':>13}")
+    for name, query_set in query_sets.items():
+        sets_ms = time_it(lambda: [set_intersection(q) for q in query_set]) / queries
+        all_ms = time_it(lambda: [list(boolean_search(inv_idx, q)) for q in query_set]) / queries
+        first_ms = time_it(lambda: [list(islice(boolean_search(inv_idx, q), 5)) for q in query_set]) / queries
+        matches = sum(len(set_intersection(q)) for q in query_set) / queries
+        print(f"{name:>8} {matches:10.0f} {sets_ms:22.3f} {all_ms:15.3f} {first_ms:13.3f}")
+
+
+def autocomplete_benchmark(n_docs: int, titles_typed: int = 200, limit: int = 10, seed: int = 0):
+    '''
+    per keystroke latency of title autocomplete while typing whole titles,
+    the prefix array vs scanning every title on every keystroke
+    '''
+    from autocomplete import KEYSTROKE_BUDGET_MS, TitleAutocomplete, keystroke_latencies, normalise, word_starts
+
+    movies = synthetic_movies(n_docs, doc_len=4, seed=seed)
+    start = time.perf_counter()
+    completer = TitleAutocomplete.build(movies, limit)
+    build_s = time.perf_counter() - start
+
+    normalised = [normalise(title) for title in completer.titles]
+    starts = [word_starts(text) for text in normalised]
+
+    def scan(prefix):
+        ''' every title checked on every keystroke, like fuzzy_open rescoring every file '''
+        key = normalise(prefix)
+        return [completer.titles[number] for number, text in enumerate(normalised)
+                if any(text.startswith(key, i) for i in starts[number])][:limit]
+
+    typed = random.Random(seed).sample(completer.titles, min(titles_typed, len(completer.titles)))
+    print(f"{len(completer.titles)} titles, {len(completer.keys)} keys, {len(completer.tops)} precomputed prefixes, "
+          f"built in {build_s:.2f} s")
+    print(f"{'':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {f'<= {KEYSTROKE_BUDGET_MS} ms':>10}")
+    for name, complete in [("prefix", None), ("scan", scan)]:
+        latencies = []
+        for title in typed[:titles_typed if complete is None else 10]:
+            if complete is None:
+                latencies += [ms for _, ms, _ in keystroke_latencies(completer, title, limit)]
+            else:
+                for end in range(1, len(title) + 1):
+                    latencies.append(time_it(lambda: complete(title[:end]), repeat=1))
+        latencies.sort()
+        within = sum(ms <= KEYSTROKE_BUDGET_MS for ms in latencies) / len(latencies)
+        print(f"{name:>8} {latencies[len(latencies) // 2]:8.3f} {latencies[int(len(latencies) * 0.99)]:8.3f} "
+              f"{latencies[-1]:8.3f} {within:10.1%}")
+
+
+def synthetic_embeddings(n_docs: int, dim: int = 384, clusters: int = 100, seed: int = 0) -> np.ndarray:
+    ''' unit vectors scattered around random topic centres, clustered like real sentence embeddings '''
+    rng = np.random.default_rng(seed)
+    centres = normalize(rng.normal(size=(clusters, dim)))
+    vectors = centres[rng.integers(0, clusters, n_docs)] + rng.normal(scale=1 / math.sqrt(dim), size=(n_docs, dim))
+    return normalize(vectors).astype(np.float32)
+
+
+def perturbed_queries(embeddings: np.ndarray, queries: int, seed: int = 0) -> np.ndarray:
+    ''' corpus rows plus noise, like a user asking for something close to a known movie '''
+    rng = np.random.default_rng(seed)
+    picked = embeddings[rng.choice(len(embeddings), queries)]
+    return normalize(picked + rng.normal(scale=0.5 / math.sqrt(embeddings.shape[1]), size=picked.shape)).astype(np.float32)
+
+
+def recall_at_k(found: list[np.ndarray], exact: np.ndarray) -> float:
+    return float(np.mean([len(set(f.tolist()) & set(e.tolist())) / len(e) for f, e in zip(found, exact)]))
+
+
+def ann_benchmark(embeddings: np.ndarray, k: int = 10, queries: int = 200, nprobes: List[int] = [1, 4, 16],
+                  efs: List[int] = [16, 50, 200], seed: int = 0):
+    '''
+    recall@k and queries per second of the IVF and HNSW indexes against the
+    exact scan.
+    '''
+    query_set = perturbed_queries(embeddings, queries, seed)
+    exact = top_k_indices(query_set @ embeddings.T, k)
+
+    print(f"{len(embeddings)} vectors in {embeddings.shape[1]} dimensions, {queries} queries, recall@{k}")
+    print(f"{'index':>8} {'knob':>12} {'build s':>8} {'recall':>8} {'QPS':>10}")
+    exact_ms = time_it(lambda: [top_k_indices(embeddings @ q, k) for q in query_set], repeat=1)
+    print(f"{'exact':>8} {'':>12} {0:8.2f} {1:8.3f} {queries * 1000 / exact_ms:10.0f}")
+
+    for index, knob, values in [(IVFIndex(), "nprobe", nprobes), (HNSWIndex(), "ef", efs)]:
+        build_s = time_it(lambda: index.build(embeddings), repeat=1) / 1000
+        for value in values:
+            found = []
+            ms = time_it(lambda: found.extend(index.search(q, k, value)[0] for q in query_set), repeat=1)
+            print(f"{index.kind:>8} {f'{knob}={value}':>12} {build_s:8.2f} {recall_at_k(found, exact):8.3f} {queries * 1000 / ms:10.0f}")
+
+
+def quantization_benchmark(embeddings: np.ndarray, k: int = 10, queries: int = 200, reranks: List[int] = [0, 4],
+                           subspaces: int = 48):
+    ''' resident size, recall@k and queries per second of every storage precision '''
+    query_set = perturbed_queries(embeddings, queries)
+    exact = top_k_indices(query_set @ embeddings.T, k)
+
+    print(f"{len(embeddings)} vectors in {embeddings.shape[1]} dimensions, {queries} queries, recall@{k}")
+    print(f"{'precision':>10} {'MiB':>8} {'rerank':>7} {'recall':>8} {'QPS':>8}")
+    for precision in ["float32", "float16", "int8", "pq"]:
+        params = {"subspaces": subspaces} if precision == "pq" else {}
+        quantized = QuantizedEmbeddings.build(precision, embeddings, **params)
+        for rerank in reranks if precision != "float32" else [0]:
+            found = []
+            ms = time_it(lambda: found.extend(quantized.search(q, k, rerank)[0] for q in query_set), repeat=1)
+            print(f"{precision:>10} {quantized.nbytes / 2**20:8.2f} {rerank:>7} {recall_at_k(found, exact):8.3f} {queries * 1000 / ms:8.0f}")
+
+
+class SyntheticSemantic:
+    '''
+    SemanticSearch stand in for machines without the model: queries are
+    embedded by summing fixed random vectors of their words, scoring is the
+    same matrix product over synthetic document embeddings.
+    '''
+
+    def __init__(self, n_docs: int, dim: int = 384, seed: int = 0):
+        self.embeddings = synthetic_embeddings(n_docs, dim, seed=seed)
+        self.projection = normalize(np.random.default_rng(seed).normal(size=(4096, dim))).astype(np.float32)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return normalize(np.stack([self.projection[[hash(word) % 4096 for word in query.split()]].sum(axis=0)
+                                   for query in queries]))
+
+    def search(self, query: str, limit: int = 5) -> List[tuple[int, float]]:
+        scores = self.embeddings @ self.embed_queries([query])[0]
+        return [(int(i), float(scores[i])) for i in top_k_indices(scores, limit)]
+
+    def search_batch(self, queries: List[str], limit: int = 5) -> List[List[tuple[int, float]]]:
+        scores = self.embed_queries(queries) @ self.embeddings.T
+        return [[(int(i), float(row[i])) for i in top] for row, top in zip(scores, top_k_indices(scores, limit))]
+
+
+def batching_benchmark(searcher, clients: List[int], queries: int = 256, max_batch: int = 32, max_wait: float = 0.002):
+    ''' queries per second with `clients` concurrent callers, each query on its own vs micro-batched '''
+    vocab = synthetic_vocabulary(2000)
+    rng = random.Random(0)
+    query_set = [" ".join(rng.choices(vocab, k=rng.randint(2, 6))) for _ in range(queries)]
+
+    print(f"{'clients':>8} {'direct QPS':>12} {'batched QPS':>12} {'mean batch':>11}")
+    for n_clients in clients:
+        with ThreadPoolExecutor(n_clients) as pool:
+            direct_ms = time_it(lambda: list(pool.map(lambda q: searcher.search(q, 10), query_set)), repeat=1)
+            batcher = MicroBatcher(searcher.search_batch, max_batch, max_wait)
+            batched_ms = time_it(lambda: list(pool.map(lambda q: batcher.search(q, 10), query_set)), repeat=1)
+            batcher.close()
+        print(f"{n_clients:>8} {queries * 1000 / direct_ms:12.0f} {queries * 1000 / batched_ms:12.0f} {batcher.mean_batch_size:11.1f}")
+
+
+CLI_DIR = Path(__file__).resolve().parent.parent
+#name -> CLI script and arguments, run from the current directory (it needs data/ and cache/)
+STARTUP_COMMANDS = {
+    "chunk": ["semantic_search_cli.py", "chunk", "the quick brown fox jumps over the lazy dog"],
+    "tf": ["keyword_search_cli.py", "tf", "1", "bear"],
+}
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def parse_importtime(stderr: str) -> list[tuple[str, int]]:
+    ''' (module, cumulative microseconds) of the top level imports in -X importtime output, slowest first '''
+    imports = []
+    for match in IMPORTTIME_LINE.finditer(stderr):
+        _, cumulative, indent, module = match.groups()
+        #nested imports are indented by two spaces per level
+        if len(indent) == 1:
+            imports.append((module, int(cumulative)))
+    return sorted(imports, key=lambda x: -x[1])
+
+
+def startup_benchmark(commands: dict[str, List[str]] = STARTUP_COMMANDS, repeat: int = 5, top: int = 5):
+    ''' wall time of fresh CLI processes (best of `repeat`) and the imports that time went to '''
+    for name, (script, *args) in commands.items():
+        command = [sys.executable, "-X", "importtime", str(CLI_DIR / script), *args]
+        best, stderr = float("inf"), ""
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = subprocess.run(command, capture_output=True, text=True)
+            seconds = time.perf_counter() - start
+            if seconds < best:
+                best, stderr = seconds, result.stderr
+        imports = parse_importtime(stderr)
+        print(f"{name}: {best * 1000:.1f} ms wall, {sum(us for _, us in imports) / 1000:.1f} ms importing")
+        for module, us in imports[:top]:
+            print(f"    {us / 1000:8.1f} ms  {module}")
@@ -0,0 +1,65 @@
+'''
+embedding search over chunks (see chunking): every chunk is encoded on its
+own, so no description is cut off at the model's max_seq_length and encode
+cost per sequence stays bounded. Chunk embeddings live next to, not in
+place of, the whole document ones.
+'''
+from pathlib import Path
+from typing import Iterable
+from chunking import DEFAULT_CHUNK_SIZE, DEFAULT_OVERLAP, DEPTH_PER_RESULT, aggregate_chunks, iter_chunks
+from document_source import iter_documents
+from lib.embedding_store import EmbeddingStore
+from lib.semantic_search import SemanticSearch
+
+CHUNK_EMBEDDINGS_PATH = Path("cache/chunk_embeddings.npy")
+CHUNK_KEYS_PATH = Path("cache/chunk_embedding_keys.json")
+
+
+class ChunkedSemanticSearch:
+
+    def __init__(self, semantic: SemanticSearch | None = None, embeddings_path: Path = CHUNK_EMBEDDINGS_PATH,
+                 keys_path: Path = CHUNK_KEYS_PATH):
+        #a SemanticSearch whose documents are chunk records
+        self.semantic = semantic or SemanticSearch()
+        self.semantic.store = EmbeddingStore(self.semantic.model_name, embeddings_path, keys_path)
+
+    def build(self, documents: Iterable[dict], method: str = "words", size: int = DEFAULT_CHUNK_SIZE,
+              overlap: int = DEFAULT_OVERLAP, batch_size: int = 64, num_workers: int = 0):
+        ''' encodes every chunk, streaming like SemanticSearch.build_embeddings '''
+        return self.semantic.build_embeddings(iter_chunks(documents, method, size, overlap), batch_size, num_workers)
+
+    def load_or_create(self, documents: Iterable[dict], method: str = "words", size: int = DEFAULT_CHUNK_SIZE,
+                       overlap: int = DEFAULT_OVERLAP):
+        ''' only chunks whose text changed are encoded again '''
+        return self.semantic.load_or_create_embeddings(iter_chunks(documents, method, size, overlap))
+
+    def parent_of(self, row: int) -> int:
+        return self.semantic.documents[row]["parent_id"]
+
+    def chunk_hits(self, query: str, limit: int = 5) -> list[tuple[int, float]]:
+        return self.semantic.search(query, limit * DEPTH_PER_RESULT)
+
+    def search(self, query: str, limit: int = 5, method: str = "max") -> list[tuple[int, float]]:
+        ''' (movie id, aggregated cosine) best first '''
+        return aggregate_chunks(self.chunk_hits(query, limit), self.parent_of, limit, method)
+
+
+def build_chunk_embeddings(method: str = "words", size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP,
+                           batch_size: int = 64, num_workers: int = 0):
+    chunked = ChunkedSemanticSearch()
+    embeddings = chunked.build(iter_documents(), method, size, overlap, batch_size, num_workers)
+    print(f"Embedded {embeddings.shape[0]} chunks of {len({c['parent_id'] for c in chunked.semantic.documents})} movies")
+
+
+def chunk_search(query: str, limit: int = 5, aggregation: str = "max", method: str = "words",
+                 size: int = DEFAULT_CHUNK_SIZE, overlap: int = DEFAULT_OVERLAP):
+    chunked = ChunkedSemanticSearch()
+    chunked.load_or_create(iter_documents(), method, size, overlap)
+    hits = chunked.chunk_hits(query, limit)
+    best = {}
+    for row, _ in hits:
+        best.setdefault(chunked.parent_of(row), chunked.semantic.documents[row])
+    for i, (parent_id, score) in enumerate(aggregate_chunks(hits, chunked.parent_of, limit, aggregation)):
+        chunk = best[parent_id]
+        print(f"{i+1}. ({parent_id}) {chunk['title']} (score : {score:.4f})")
+        print(f"   [{chunk['start']}:{chunk['end']}] {chunk['description'][:120]}")
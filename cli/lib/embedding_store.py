@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Iterable, List
+import numpy as np
+
+
+class EmbeddingStore:
+    '''
+    document embeddings on disk, keyed by a hash of the model name and the
+    embedded text. Rows of the .npy file line up with the keys in the .json
+    file, so a corpus change only re-encodes documents whose text is new.
+    '''
+
+    def __init__(self, model_name: str, embeddings_path: Path = Path("cache/embeddings.npy"),
+                 keys_path: Path = Path("cache/embedding_keys.json")):
+        self.model_name = model_name
+        self.embeddings_path = embeddings_path
+        self.keys_path = keys_path
+        self.reused = 0
+        self.encoded = 0
+        self.dropped = 0
+
+    def key(self, text: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def load(self) -> tuple[List[str], np.ndarray | None]:
+        ''' stored keys and matrix, empty if missing or written for another model '''
+        if not (self.embeddings_path.exists() and self.keys_path.exists()):
+            return [], None
+
+        with open(self.keys_path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("model") != self.model_name:
+            return [], None
+
+        embeddings = np.load(self.embeddings_path)
+        #an empty corpus is saved as a (0, 0) matrix, which has no usable width
+        if embeddings.shape[0] != len(stored["keys"]) or embeddings.shape[0] == 0:
+            return [], None
+        return stored["keys"], embeddings
+
+    def save(self, keys: List[str], embeddings: np.ndarray):
+        os.makedirs(self.embeddings_path.parent, exist_ok=True)
+        np.save(self.embeddings_path, embeddings)
+        with open(self.keys_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "keys": keys}, f)
+
+    def save_stream(self, batches: Iterable[tuple[List[str], np.ndarray]]) -> int:
+        '''
+        saves (keys, rows) batches as they are produced, so the whole matrix
+        is never in memory. Rows are appended to a raw file first, the .npy
+        header needs the final row count. Returns the number of rows.
+        '''
+        os.makedirs(self.embeddings_path.parent, exist_ok=True)
+        raw_path = self.embeddings_path.with_name(self.embeddings_path.name + ".rows")
+        keys, dim = [], 0
+        with open(raw_path, "wb") as raw:
+            for batch_keys, rows in batches:
+                if len(batch_keys) == 0:
+                    continue
+                dim = rows.shape[1]
+                raw.write(np.ascontiguousarray(rows, dtype=np.float32).tobytes())
+                keys.extend(batch_keys)
+
+        #same (0, 0) shape save() uses for an empty corpus
+        header = {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)), "fortran_order": False,
+                  "shape": (len(keys), dim)}
+        with open(self.embeddings_path, "wb") as f, open(raw_path, "rb") as raw:
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(raw, f)
+        os.remove(raw_path)
+        with open(self.keys_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "keys": keys}, f)
+        return len(keys)
+
+    def get_or_encode(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        '''
+        embeddings for `texts` in order. Stored rows are reused, only unseen
+        texts are passed to `encode`, and rows no longer in `texts` are
+        dropped from the store.
+        '''
+        keys = [self.key(text) for text in texts]
+        stored_keys, stored = self.load()
+        stored_rows = {key: row for row, key in enumerate(stored_keys)}
+
+        #identical texts share one encode
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in stored_rows and key not in missing:
+                missing[key] = i
+        fresh = encode([texts[i] for i in missing.values()]) if missing else None
+        if stored is None and fresh is None:
+            self.save([], np.empty((0, 0), dtype=np.float32))
+            return np.empty((0, 0), dtype=np.float32)
+
+        dim = stored.shape[1] if stored is not None else fresh.shape[1]
+        embeddings = np.empty((len(texts), dim), dtype=np.float32)
+        fresh_rows = {key: row for row, key in enumerate(missing)}
+        for i, key in enumerate(keys):
+            if key in stored_rows:
+                embeddings[i] = stored[stored_rows[key]]
+            else:
+                embeddings[i] = fresh[fresh_rows[key]]
+
+        self.encoded = len(missing)
+        self.reused = len(texts) - sum(1 for key in keys if key in fresh_rows)
+        self.dropped = len(set(stored_keys) - set(keys))
+
+        if keys != stored_keys:
+            self.save(keys, embeddings)
+        return embeddings
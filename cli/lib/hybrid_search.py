@@ -0,0 +1,102 @@
+'''
+hybrid retrieval: BM25 and embedding search run side by side and their
+rankings are fused, either by reciprocal rank fusion (only ranks matter,
+so the two score scales never have to agree) or by a weighted sum of min
+max normalised scores.
+'''
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from keyword_search_utils import InvertedIndex
+from document_source import iter_documents
+
+RRF_K = 60
+FUSION_METHODS = ["rrf", "weighted"]
+
+
+def top_fused(scores: dict[int, float], limit: int) -> list[tuple[int, float]]:
+    return heapq.nsmallest(limit, scores.items(), key=lambda x: (-x[1], x[0]))
+
+
+def rrf_fuse(rankings: list[list[tuple[int, float]]], limit: int, rrf_k: int = RRF_K) -> list[tuple[int, float]]:
+    ''' sum of 1 / (rrf_k + rank) over the rankings a document appears in, ranks start at 1 '''
+    scores = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1 / (rrf_k + rank)
+    return top_fused(scores, limit)
+
+
+def normalise_scores(ranking: list[tuple[int, float]]) -> dict[int, float]:
+    ''' min max scaling to [0, 1], a ranking of equal scores maps to 1 '''
+    if not ranking:
+        return {}
+    scores = [score for _, score in ranking]
+    low, high = min(scores), max(scores)
+    if high == low:
+        return {doc_id: 1.0 for doc_id, _ in ranking}
+    return {doc_id: (score - low) / (high - low) for doc_id, score in ranking}
+
+
+def weighted_fuse(keyword: list[tuple[int, float]], semantic: list[tuple[int, float]], limit: int,
+                  alpha: float = 0.5) -> list[tuple[int, float]]:
+    ''' alpha * bm25 + (1 - alpha) * cosine after normalising each; a document missing from a list scores 0 there '''
+    keyword, semantic = normalise_scores(keyword), normalise_scores(semantic)
+    scores = {doc_id: alpha * keyword.get(doc_id, 0.0) + (1 - alpha) * semantic.get(doc_id, 0.0)
+              for doc_id in keyword.keys() | semantic.keys()}
+    return top_fused(scores, limit)
+
+
+def fuse(keyword: list[tuple[int, float]], semantic: list[tuple[int, float]], limit: int,
+         method: str = "rrf", alpha: float = 0.5, rrf_k: int = RRF_K) -> list[tuple[int, float]]:
+    if method == "rrf":
+        return rrf_fuse([keyword, semantic], limit, rrf_k)
+    if method == "weighted":
+        return weighted_fuse(keyword, semantic, limit, alpha)
+    raise ValueError(f"unknown fusion method {method}, expected one of {', '.join(FUSION_METHODS)}")
+
+
+class HybridSearch:
+
+    def __init__(self, inv_idx: InvertedIndex, semantic, method: str = "rrf", alpha: float = 0.5,
+                 rrf_k: int = RRF_K, depth: int = 50):
+        self.inv_idx = inv_idx
+        #anything with search(query, limit) -> [(row, score)] and documents, normally SemanticSearch
+        self.semantic = semantic
+        self.method = method
+        self.alpha = alpha
+        self.rrf_k = rrf_k
+        #results taken from each branch before fusing, fusion needs more than the final limit
+        self.depth = depth
+        #one thread per branch; the model and numpy release the GIL so the branches overlap
+        self.executor = ThreadPoolExecutor(2)
+
+    def semantic_hits(self, query: str, limit: int) -> list[tuple[int, float]]:
+        ''' semantic results keyed by movie id instead of row '''
+        documents = self.semantic.documents
+        return [(documents[row]["id"], score) for row, score in self.semantic.search(query, limit)]
+
+    def search(self, query: str, limit: int = 5) -> list[tuple[int, float]]:
+        ''' (doc_id, fused score) best first, the slower branch bounds the latency '''
+        depth = max(limit, self.depth)
+        keyword = self.executor.submit(self.inv_idx.bm25_search, query, depth)
+        semantic = self.executor.submit(self.semantic_hits, query, depth)
+        return fuse(keyword.result(), semantic.result(), limit, self.method, self.alpha, self.rrf_k)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def hybrid_search(query: str, limit: int = 5, method: str = "rrf", alpha: float = 0.5):
+    from lib.semantic_search import SemanticSearch
+
+    inv_idx = InvertedIndex()
+    inv_idx.load()
+    semantic = SemanticSearch()
+    semantic.load_or_create_embeddings(iter_documents())
+
+    hybrid = HybridSearch(inv_idx, semantic, method, alpha)
+    try:
+        for i, (doc_id, score) in enumerate(hybrid.search(query, limit)):
+            print(f"{i+1}. ({doc_id}) {inv_idx.index[doc_id]['title']} - score {score:.4f}")
+    finally:
+        hybrid.close()
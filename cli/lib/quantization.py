@@ -0,0 +1,250 @@
+'''
+compressed copies of the unit length document embeddings. A query is
+scored against the compact codes, then the best `rerank` * k candidates
+are re-scored exactly from the float32 matrix, which can stay on disk
+(np.load with mmap_mode="r") since only the candidate rows are read.
+The saved codes record the codec parameters and the version of the
+matrix they encode: the size and mtime of the embeddings file when there
+is one, so checking the cache never reads the matrix itself.
+
+    float32     the matrix as is, 4 bytes per dimension
+    float16     2 bytes per dimension
+    int8        1 byte per dimension, symmetric per dimension scales
+    pq          product quantisation: the vector is cut into `subspaces`
+                pieces, each stored as one byte naming its nearest of 256
+                k-means centroids; queries score codes through a lookup
+                table (asymmetric distance computation)
+'''
+import os
+from pathlib import Path
+import numpy as np
+from helpers import top_k_indices
+from lib.ann import fingerprint
+from result_cache import file_version
+
+#rows decoded per step, small enough that the float32 copy stays in cache
+CHUNK = 1024
+
+
+class Float32Codec:
+    precision = "float32"
+
+    def fit(self, vectors: np.ndarray):
+        return self
+
+    def params(self) -> dict:
+        ''' build parameters, codes built with other ones are stale '''
+        return {}
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        return codes @ query
+
+    def arrays(self) -> dict:
+        return {}
+
+    def restore(self, arrays: dict):
+        return self
+
+
+class Float16Codec(Float32Codec):
+    precision = "float16"
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return vectors.astype(np.float16)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        #numpy has no float16 BLAS, widening a chunk at a time is much faster
+        return np.concatenate([codes[start:start + CHUNK].astype(np.float32) @ query
+                               for start in range(0, len(codes), CHUNK)])
+
+
+class Int8Codec(Float32Codec):
+    ''' x ~ code * scale with one scale per dimension, so query . x ~ code . (query * scale) '''
+
+    precision = "int8"
+
+    def __init__(self):
+        self.scale: np.ndarray = None
+
+    def fit(self, vectors: np.ndarray):
+        scale = np.abs(vectors).max(axis=0) / 127
+        scale[scale == 0] = 1
+        self.scale = scale.astype(np.float32)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        scaled = (query * self.scale).astype(np.float32)
+        return np.concatenate([codes[start:start + CHUNK].astype(np.float32) @ scaled
+                               for start in range(0, len(codes), CHUNK)])
+
+    def arrays(self) -> dict:
+        return {"scale": self.scale}
+
+    def restore(self, arrays: dict):
+        self.scale = arrays["scale"]
+        return self
+
+
+class PQCodec(Float32Codec):
+    precision = "pq"
+
+    def __init__(self, subspaces: int = 48, iterations: int = 15, seed: int = 0):
+        self.subspaces = subspaces
+        self.iterations = iterations
+        self.seed = seed
+        #(subspaces, 256, dim // subspaces)
+        self.codebooks: np.ndarray = None
+
+    def params(self) -> dict:
+        return {"subspaces": self.subspaces, "iterations": self.iterations, "seed": self.seed}
+
+    def __split(self, vectors: np.ndarray) -> np.ndarray:
+        ''' (n, dim) -> (subspaces, n, dim // subspaces) '''
+        n, dim = vectors.shape
+        if dim % self.subspaces:
+            raise ValueError(f"{dim} dimensions can't be split into {self.subspaces} subspaces")
+        return vectors.reshape(n, self.subspaces, dim // self.subspaces).transpose(1, 0, 2)
+
+    @staticmethod
+    def __nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        ''' nearest centroid by euclidean distance, sub vectors aren't unit length '''
+        distances = (centroids ** 2).sum(axis=1) - 2 * points @ centroids.T
+        return np.argmin(distances, axis=1)
+
+    def fit(self, vectors: np.ndarray):
+        rng = np.random.default_rng(self.seed)
+        parts = self.__split(vectors.astype(np.float32))
+        n_centroids = min(256, len(vectors))
+        codebooks = []
+        for points in parts:
+            centroids = points[rng.choice(len(points), n_centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignment = self.__nearest(points, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, points)
+                counts = np.bincount(assignment, minlength=n_centroids)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            #unused slots repeat the first centroid, codes never point at them
+            codebook = np.repeat(centroids[:1], 256, axis=0)
+            codebook[:n_centroids] = centroids
+            codebooks.append(codebook)
+        self.codebooks = np.stack(codebooks)
+        return self
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        parts = self.__split(vectors.astype(np.float32))
+        return np.stack([self.__nearest(points, codebook) for points, codebook in zip(parts, self.codebooks)],
+                        axis=1).astype(np.uint8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        #table[s, c] = query piece s . centroid c of subspace s
+        table = np.einsum("scd,sd->sc", self.codebooks, self.__split(query[None, :])[:, 0, :])
+        subspace = np.arange(self.subspaces)
+        return np.concatenate([table[subspace, codes[start:start + CHUNK]].sum(axis=1)
+                               for start in range(0, len(codes), CHUNK)])
+
+    def arrays(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+    def restore(self, arrays: dict):
+        self.codebooks = arrays["codebooks"]
+        self.subspaces = self.codebooks.shape[0]
+        return self
+
+
+CODECS = {codec.precision: codec for codec in [Float32Codec, Float16Codec, Int8Codec, PQCodec]}
+
+
+class QuantizedEmbeddings:
+    ''' compact codes of an embedding matrix plus the exact matrix for re-ranking '''
+
+    def __init__(self, codec, codes: np.ndarray, exact: np.ndarray, rerank: int = 4):
+        self.codec = codec
+        self.codes = codes
+        self.exact = exact
+        #candidates re-scored exactly per result, 0 returns the approximate scores
+        self.rerank = rerank
+
+    @classmethod
+    def build(cls, precision: str, vectors: np.ndarray, rerank: int = 4, **params):
+        if precision not in CODECS:
+            raise ValueError(f"unknown precision {precision}, expected one of {', '.join(CODECS)}")
+        codec = CODECS[precision](**params).fit(vectors)
+        return cls(codec, codec.encode(vectors), vectors, rerank)
+
+    @property
+    def nbytes(self) -> int:
+        ''' resident size of the codes and codebooks '''
+        return self.codes.nbytes + sum(array.nbytes for array in self.codec.arrays().values())
+
+    def search(self, query: np.ndarray, k: int, rerank: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        rerank = self.rerank if rerank is None else rerank
+        approximate = self.codec.scores(self.codes, query)
+        if rerank <= 0 or self.codec.precision == "float32":
+            top = top_k_indices(approximate, k)
+            return top, approximate[top]
+
+        candidates = top_k_indices(approximate, k * rerank)
+        #sorted row order keeps the reads of a memory mapped matrix sequential
+        candidates = np.sort(candidates)
+        exact = np.asarray(self.exact[candidates]) @ query
+        top = top_k_indices(exact, k)
+        return candidates[top], exact[top]
+
+    def save(self, path: Path, version: str):
+        os.makedirs(path.parent, exist_ok=True)
+        params = {f"param_{name}": np.array(value) for name, value in self.codec.params().items()}
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp_path, precision=np.array(self.codec.precision), version=np.array(version),
+                 codes=self.codes, **params, **self.codec.arrays())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path, exact: np.ndarray, codec, version: str, rerank: int = 4):
+        '''
+        the saved codes, None if missing, or built with another precision,
+        other codec parameters or from another version of the vectors
+        '''
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            if str(data["precision"]) != codec.precision or "version" not in data.files or str(data["version"]) != version:
+                return None
+            if any(f"param_{name}" not in data.files or data[f"param_{name}"].item() != value
+                   for name, value in codec.params().items()):
+                return None
+            codec.restore({name: data[name] for name in data.files})
+            return cls(codec, data["codes"], exact, rerank)
+
+
+def quantized_path(precision: str, embeddings_path: Path = Path("cache/embeddings.npy")) -> Path:
+    return embeddings_path.with_name(f"embeddings_{precision}.npz")
+
+
+def load_or_build_quantized(precision: str, vectors: np.ndarray, path: Path | None = None, rerank: int = 4,
+                            source: Path | None = None, **params):
+    '''
+    the codes of vectors, read from path when they still match, otherwise
+    built and saved. `source` is the file vectors were read from; its size
+    and mtime stand in for the vectors, without it they are hashed.
+    '''
+    if precision == "float32":
+        #the codes would be a second copy of cache/embeddings.npy
+        return QuantizedEmbeddings.build(precision, vectors, rerank)
+    if precision not in CODECS:
+        raise ValueError(f"unknown precision {precision}, expected one of {', '.join(CODECS)}")
+    path = path or quantized_path(precision)
+    version = f"file:{file_version(source)}" if source is not None else fingerprint(vectors)
+    loaded = QuantizedEmbeddings.load(path, vectors, CODECS[precision](**params), version, rerank)
+    if loaded is not None:
+        return loaded
+    quantized = QuantizedEmbeddings.build(precision, vectors, rerank, **params)
+    quantized.save(path, version)
+    return quantized
@@ -0,0 +1,198 @@
+'''
+persistent cache of query embeddings, so a repeated query skips the model.
+
+One file per model holds a fixed number of slots in an mmap'd arena:
+
+    header   magic, version, dim, capacity, clock hand, hits, misses, writes
+    keys     uint8[capacity, 20]          sha1 of the normalised query, zeros = free
+    vectors  float32[capacity, dim]       unit length query embeddings
+
+The key -> slot hash index is kept in memory. Several processes (the CLI
+and a running search_server) may share the file, so every lookup and
+insert holds an exclusive flock and first re-reads the header: the hand
+and the counts come from the file, and the hash index is rebuilt when
+the writes counter shows another process changed the keys.
+When the arena is full a CLOCK sweep picks the slot to reuse: slots hit
+since the hand last passed get a second chance, so popular queries stay.
+Hit and miss counts live in the header and so cover every process that
+used the file.
+'''
+import fcntl
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, List
+import numpy as np
+
+MAGIC = b"QEMBCACH"
+VERSION = 2
+HEADER = struct.Struct("<8sIIIIQQQ")
+HEADER_SIZE = 64
+KEY_SIZE = 20
+
+#punctuation and spacing around or between words doesn't change what is asked
+NOISE = re.compile(r"[^\w]+")
+
+
+def normalise_text(text: str) -> str:
+    return " ".join(NOISE.sub(" ", text.lower()).split())
+
+
+def query_cache_path(model_name: str, directory: Path = Path("cache")) -> Path:
+    return directory / f"query_embeddings_{re.sub(r'[^\w.-]', '_', model_name)}.bin"
+
+
+def cache_file_stats(path: Path) -> dict | None:
+    ''' entries and lifetime hit counts of a cache file, read without the model '''
+    if not path.exists():
+        return None
+    with open(path, "rb") as f:
+        magic, version, dim, capacity, _, hits, misses, _ = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            return None
+        f.seek(HEADER_SIZE)
+        keys = np.frombuffer(f.read(capacity * KEY_SIZE), dtype=np.uint8).reshape(capacity, KEY_SIZE)
+    total = hits + misses
+    return {"entries": int(keys.any(axis=1).sum()), "capacity": capacity, "hits": hits,
+            "misses": misses, "hit_rate": hits / total if total else 0.0}
+
+
+class QueryEmbeddingCache:
+
+    def __init__(self, model_name: str, dim: int, path: Path | None = None, capacity: int = 10000):
+        self.model_name = model_name
+        self.path = path or query_cache_path(model_name)
+        self.lock = threading.Lock()
+        self.__open(dim, capacity)
+
+    def __create(self, dim: int, capacity: int):
+        os.makedirs(self.path.parent, exist_ok=True)
+        size = HEADER_SIZE + capacity * KEY_SIZE + capacity * dim * 4
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, dim, capacity, 0, 0, 0, 0).ljust(HEADER_SIZE, b"\0"))
+            f.truncate(size)
+        os.replace(tmp_path, self.path)
+
+    def __open(self, dim: int, capacity: int):
+        header = None
+        if self.path.exists() and self.path.stat().st_size >= HEADER_SIZE:
+            with open(self.path, "rb") as f:
+                header = HEADER.unpack(f.read(HEADER.size))
+        #an unreadable file or one of another shape is started over
+        if header is None or header[0] != MAGIC or header[1] != VERSION or header[2] != dim or header[3] != capacity:
+            self.__create(dim, capacity)
+
+        self.file = open(self.path, "r+b")
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        _, _, self.dim, self.capacity, self.hand, self.hits, self.misses, self.writes = HEADER.unpack_from(self.mm, 0)
+        keys_end = HEADER_SIZE + self.capacity * KEY_SIZE
+        self.keys = np.frombuffer(self.mm, dtype=np.uint8, count=self.capacity * KEY_SIZE,
+                                  offset=HEADER_SIZE).reshape(self.capacity, KEY_SIZE)
+        self.vectors = np.frombuffer(self.mm, dtype=np.float32, count=self.capacity * self.dim,
+                                     offset=keys_end).reshape(self.capacity, self.dim)
+        self.__load_slots()
+        #CLOCK reference bits, a fresh process starts with none set
+        self.referenced = np.zeros(self.capacity, dtype=bool)
+
+    def __load_slots(self):
+        self.slots = {self.keys[slot].tobytes(): int(slot) for slot in np.flatnonzero(self.keys.any(axis=1))}
+
+    @contextmanager
+    def __locked(self):
+        ''' holds the thread lock and the file lock, with this process' view synced to the file '''
+        with self.lock:
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+            try:
+                _, _, _, _, self.hand, self.hits, self.misses, writes = HEADER.unpack_from(self.mm, 0)
+                if writes != self.writes:
+                    #another process replaced keys since we last looked
+                    self.__load_slots()
+                    self.writes = writes
+                yield
+                self.__save_header()
+            finally:
+                fcntl.flock(self.file, fcntl.LOCK_UN)
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha1(f"{self.model_name}\0{normalise_text(text)}".encode("utf-8")).digest()
+
+    def __save_header(self):
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, self.dim, self.capacity, self.hand, self.hits, self.misses,
+                         self.writes)
+
+    def __free_slot(self) -> int:
+        ''' CLOCK: advance the hand past referenced slots, clearing their bit '''
+        while True:
+            slot = self.hand
+            self.hand = (self.hand + 1) % self.capacity
+            if not self.referenced[slot]:
+                return slot
+            self.referenced[slot] = False
+
+    def get(self, text: str) -> np.ndarray | None:
+        key = self.key(text)
+        with self.__locked():
+            slot = self.slots.get(key)
+            if slot is None or self.keys[slot].tobytes() != key:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.referenced[slot] = True
+            return self.vectors[slot].copy()
+
+    def put(self, text: str, vector: np.ndarray):
+        key = self.key(text)
+        with self.__locked():
+            slot = self.slots.get(key)
+            if slot is None or self.keys[slot].tobytes() != key:
+                slot = self.__free_slot()
+                self.slots.pop(self.keys[slot].tobytes(), None)
+                self.keys[slot] = np.frombuffer(key, dtype=np.uint8)
+                self.slots[key] = slot
+                self.writes += 1
+            self.vectors[slot] = vector
+
+    def get_or_encode(self, texts: List[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        ''' (len(texts), dim) embeddings, `encode` only sees the texts not cached yet, once each '''
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        missing: dict[str, list[int]] = {}
+        for i, text in enumerate(texts):
+            vector = self.get(text)
+            if vector is None:
+                missing.setdefault(normalise_text(text), []).append(i)
+            else:
+                embeddings[i] = vector
+        if missing:
+            #encode one original spelling per normalised text
+            originals = [texts[rows[0]] for rows in missing.values()]
+            for text, rows, vector in zip(originals, missing.values(), encode(originals)):
+                embeddings[rows] = vector
+                self.put(text, vector)
+        return embeddings
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        with self.__locked():
+            return {"entries": len(self.slots), "capacity": self.capacity, "hits": self.hits,
+                    "misses": self.misses, "hit_rate": self.hit_rate}
+
+    def close(self):
+        with self.lock:
+            if self.mm is None:
+                return
+            self.mm.flush()
+            #numpy views hold buffer exports, drop them before closing the map
+            self.keys = self.vectors = None
+            self.mm.close()
+            self.file.close()
+            self.mm = None
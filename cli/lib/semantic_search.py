@@ -1,50 +1,185 @@
-from sentence_transformers import SentenceTransformer
-from pathlib import Path
-import json
-import os
-from tqdm import tqdm
-from typing import List
+import threading
+from itertools import batched
+from typing import Iterable, List
 import numpy as np
-from helpers import similarity
+from helpers import normalize, top_k_indices
+from lib.embedding_store import EmbeddingStore
+from lib.ann import ann_path, load_or_build_ann
+from lib.quantization import load_or_build_quantized, quantized_path
+from lib.query_cache import QueryEmbeddingCache, cache_file_stats, query_cache_path
+from result_cache import DEFAULT_DISK_PATH, ResultCache, file_version
+from document_source import MOVIES_PATH, iter_documents
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
 
 class SemanticSearch:
     def __init__(self):
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        #sentence_transformers brings in torch, seconds of imports only commands that embed should pay
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = MODEL_NAME
+        self.model = SentenceTransformer(self.model_name)
+        self.store = EmbeddingStore(self.model_name)
         self.documents: List[dict] = None
         self.embeddings: np.ndarray = None
         self.document_map: Dict[int, dict] = {}
+        #optional IVFIndex / HNSWIndex, search() scans every row without one
+        self.ann = None
+        #optional QuantizedEmbeddings, used when there is no ann index
+        self.quantized = None
+        #opened on the first query, server worker threads may race to open it
+        self.query_cache: QueryEmbeddingCache = None
+        self.query_cache_lock = threading.Lock()
 
     def generate_embeddings(self, sentence: str) -> List[float]:
         return self.model.encode([sentence])[0]
 
-    def build_embeddings(self, documents: List[dict]):
-        self.documents = documents
-        self.embeddings = np.zeros((len(documents), self.model.get_sentence_embedding_dimension()))
-        for i, doc in enumerate(tqdm(documents)):
-            self.document_map[i] = doc  
-            string_document = f"{doc['title']} {doc['description']}"
-            self.embeddings[i] = self.model.encode(string_document, convert_to_numpy=True)
-        
-        #save embeddings in cache
-        np.save("cache/embeddings.npy", self.embeddings)
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        ''' unit length query embeddings; queries seen before (up to case and punctuation) skip the model '''
+        if self.query_cache is None:
+            with self.query_cache_lock:
+                if self.query_cache is None:
+                    self.query_cache = QueryEmbeddingCache(self.model_name, self.model.get_sentence_embedding_dimension())
+        return self.query_cache.get_or_encode(
+            queries, lambda batch: normalize(self.model.encode(batch, convert_to_numpy=True)))
+
+    def encode_texts(self, texts: List[str], batch_size: int = 64, num_workers: int = 0, pool=None,
+                     progress: bool = True) -> np.ndarray:
+        '''
+        encodes texts in batches straight into a preallocated float32 matrix.
+        Texts are encoded longest first so every batch pads to about the same
+        length. With num_workers > 1 batches are spread over a pool of CPU
+        encoding processes, started here unless the caller passes one.
+        '''
+        embeddings = np.empty((len(texts), self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+
+        own_pool = pool is None and num_workers > 1
+        if own_pool:
+            pool = self.model.start_multi_process_pool(["cpu"] * num_workers)
+        #hand every worker a full batch per call
+        step = batch_size * num_workers if pool is not None else batch_size
+
+        from tqdm import tqdm
+        try:
+            for start in tqdm(range(0, len(order), step), desc="Encoding", disable=not progress):
+                rows = order[start:start + step]
+                batch = [texts[i] for i in rows]
+                if pool is None:
+                    embeddings[rows] = self.model.encode(batch, batch_size=batch_size, convert_to_numpy=True)
+                else:
+                    embeddings[rows] = self.model.encode(batch, batch_size=batch_size, pool=pool, chunk_size=batch_size)
+        finally:
+            if own_pool:
+                self.model.stop_multi_process_pool(pool)
+
+        return embeddings
+
+    def build_embeddings(self, documents: Iterable[dict], batch_size: int = 64, num_workers: int = 0,
+                         window: int = 4096):
+        '''
+        encodes documents as they stream in (see document_source), `window`
+        at a time, and appends every window to the store on disk. Only one
+        window of texts and vectors is in memory; the finished matrix is
+        memory mapped back.
+        '''
+        from tqdm import tqdm
+
+        self.documents = []
+        pool = self.model.start_multi_process_pool(["cpu"] * num_workers) if num_workers > 1 else None
+
+        def windows():
+            for docs in batched(documents, window):
+                self.documents.extend(docs)
+                texts = [document_text(doc) for doc in docs]
+                #rows are stored unit length so scoring is a plain dot product
+                rows = normalize(self.encode_texts(texts, batch_size, num_workers, pool, progress=False))
+                bar.update(len(docs))
+                yield [self.store.key(text) for text in texts], rows
+
+        try:
+            with tqdm(desc="Encoding", unit=" docs") as bar:
+                count = self.store.save_stream(windows())
+        finally:
+            if pool is not None:
+                self.model.stop_multi_process_pool(pool)
+
+        self.document_map = {i: doc for i, doc in enumerate(self.documents)}
+        #numpy can't map the data of an empty matrix
+        self.embeddings = np.load(self.store.embeddings_path, mmap_mode="r" if count else None)
         return self.embeddings
     
-    def load_or_create_embeddings(self, documents: List[dict]):
-        self.documents = documents
+    def load_or_create_embeddings(self, documents: Iterable[dict], batch_size: int = 64, num_workers: int = 0):
+        '''
+        reuses cached embeddings of unchanged documents and only encodes
+        new or edited ones; removed documents are dropped from the cache.
+        '''
+        self.documents = documents = list(documents)
         self.document_map = {i: doc for i, doc in enumerate(documents)}
-        if os.path.exists("cache/embeddings.npy"):
-            self.embeddings = np.load("cache/embeddings.npy")
-            if self.embeddings.shape[0] == len(documents):
-                return self.embeddings
-        return self.build_embeddings(documents)
+        texts = [document_text(doc) for doc in documents]
+        self.embeddings = self.store.get_or_encode(
+            texts, lambda batch: normalize(self.encode_texts(batch, batch_size, num_workers)))
+        return self.embeddings
+
+    def use_ann(self, kind: str, **params):
+        ''' answers searches from an approximate index kept next to the embeddings, see lib.ann '''
+        if self.embeddings is None:
+            raise ValueError("Embeddings not loaded. Please load or create embeddings first.")
+        self.ann = load_or_build_ann(kind, self.embeddings, ann_path(kind, self.store.embeddings_path), **params)
+        return self.ann
+
+    def use_precision(self, precision: str, rerank: int = 4, **params):
+        '''
+        scores queries against float16 / int8 / pq codes of the embeddings
+        and re-ranks the best rerank * limit exactly. The float32 matrix is
+        swapped for a memory map of the cached file, so only the candidate
+        rows are read back.
+        '''
+        if self.embeddings is None:
+            raise ValueError("Embeddings not loaded. Please load or create embeddings first.")
+        #size and mtime of the embeddings file stand in for the matrix, hashing it would read every row
+        source = self.store.embeddings_path if self.store.embeddings_path.exists() else None
+        self.quantized = load_or_build_quantized(
+            precision, self.embeddings, quantized_path(precision, self.store.embeddings_path), rerank, source, **params)
+        if precision != "float32" and self.store.embeddings_path.exists():
+            self.embeddings = np.load(self.store.embeddings_path, mmap_mode="r")
+            self.quantized.exact = self.embeddings
+        return self.quantized
 
     def calculate_similarities(self, query: str, limit: int = 5):
+        ''' cosine similarity of the query against every document, as one matrix-vector product '''
+        if self.embeddings is None:
+            raise ValueError("Embeddings not loaded. Please load or create embeddings first.")
+        return self.embeddings @ self.embed_queries([query])[0]
+
+    def calculate_similarities_batch(self, queries: List[str]) -> np.ndarray:
+        ''' (n_queries, n_documents) cosine similarities: one encode call and one GEMM for all queries '''
         if self.embeddings is None:
             raise ValueError("Embeddings not loaded. Please load or create embeddings first.")
-        query_embedding = self.generate_embeddings(query)
-        similarities = [similarity(query_embedding, doc_embedding) for doc_embedding in self.embeddings]
-        similarities = np.array(similarities)
-        return similarities
+        return self.embed_queries(queries) @ self.embeddings.T
+
+    def search(self, query: str, limit: int = 5) -> List[tuple[int, float]]:
+        ''' (document index, score) of the `limit` most similar documents, best first '''
+        if self.ann is not None:
+            indices, scores = self.ann.search(self.embed_queries([query])[0], limit)
+            return [(int(idx), float(score)) for idx, score in zip(indices, scores)]
+        if self.quantized is not None:
+            indices, scores = self.quantized.search(self.embed_queries([query])[0], limit)
+            return [(int(idx), float(score)) for idx, score in zip(indices, scores)]
+        similarities = self.calculate_similarities(query, limit)
+        return [(int(idx), float(similarities[idx])) for idx in top_k_indices(similarities, limit)]
+
+    def search_batch(self, queries: List[str], limit: int = 5) -> List[List[tuple[int, float]]]:
+        approximate = self.ann or self.quantized
+        if approximate is not None:
+            return [[(int(idx), float(score)) for idx, score in zip(*approximate.search(q, limit))]
+                    for q in self.embed_queries(queries)]
+        similarities = self.calculate_similarities_batch(queries)
+        top = top_k_indices(similarities, limit)
+        return [[(int(idx), float(row[idx])) for idx in indices] for row, indices in zip(similarities, top)]
+
+def document_text(doc: dict) -> str:
+    return f"{doc['title']} {doc['description']}"
 
 def verify_model():
     search = SemanticSearch()
@@ -59,26 +194,27 @@ def embed(sentence: str) -> List[float]:
     print(f"Dimensions: {embedding.shape[0]}")
     return embedding
 
-def load_json(file: Path)->dict:
-    """loads the json file, returns and error if not exist."""
-    
-    if not file.exists():
-        raise FileNotFoundError(f"file {file} doesn't exists")
-
-    with open(file, "r", encoding="utf-8") as f:
-        total_json = f.read()
-
-    movies_json = json.loads(total_json)
-    return movies_json
+def build_embeddings(batch_size: int = 64, num_workers: int = 0):
+    search = SemanticSearch()
+    embeddings = search.build_embeddings(iter_documents(), batch_size, num_workers)
+    print(f"Embedded {embeddings.shape[0]} documents in {embeddings.shape[1]} dimensions")
 
 def verify_embeddings():
     search = SemanticSearch()
-    json_data = load_json(Path("data/movies.json"))
-    documents = json_data['movies']
+    documents = list(iter_documents())
     embeddings = search.load_or_create_embeddings(documents)
     print(f"Number of docs:   {len(documents)}")
+    print(f"Reused: {search.store.reused}, encoded: {search.store.encoded}, dropped: {search.store.dropped}")
     print(f"Embeddings shape: {embeddings.shape[0]} vectors in {embeddings.shape[1]} dimensions")
 
+def query_cache_stats():
+    stats = cache_file_stats(query_cache_path(MODEL_NAME))
+    if stats is None:
+        print("No query embedding cache yet")
+        return
+    print(f"Entries: {stats['entries']} / {stats['capacity']}")
+    print(f"Hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hit_rate']:.1%}")
+
 def embed_query_text(query: str):
     search = SemanticSearch()
     embedding = search.generate_embeddings(query)
@@ -87,16 +223,39 @@ def embed_query_text(query: str):
     print(f"Shape: {embedding.shape}")
     return embedding
 
-def search(query: str, limit: int = 5):
-    json_data = load_json(Path("data/movies.json"))
-    documents = json_data['movies']
+def build_ann(kind: str, **params):
+    search = SemanticSearch()
+    search.load_or_create_embeddings(iter_documents())
+    search.use_ann(kind, **params)
+    print(f"{kind} index over {search.embeddings.shape[0]} embeddings saved to {ann_path(kind, search.store.embeddings_path)}")
+
+def semantic_results(query: str, limit: int, ann: str | None, precision: str, rerank: int, **ann_params) -> list:
+    documents = list(iter_documents())
     search = SemanticSearch()
     search.load_or_create_embeddings(documents)
-    similarities = search.calculate_similarities(query, limit)
-    top_indices = np.argsort(similarities)[::-1][:limit]
-    for i, idx in enumerate(top_indices):
-        print(f"{i+1}. {search.documents[idx]['title']} (score : {similarities[idx]})")
-        print(search.documents[idx]['description'])
+    if ann is not None:
+        search.use_ann(ann, **ann_params)
+    elif precision != "float32":
+        search.use_precision(precision, rerank)
+    return [[search.documents[idx]['title'], search.documents[idx]['description'], score]
+            for idx, score in search.search(query, limit)]
+
+def search(query: str, limit: int = 5, ann: str | None = None, precision: str = "float32", rerank: int = 4,
+           cache: bool = False, **ann_params):
+    ''' with cache, a repeated query is answered from cache/results.sqlite without loading the model '''
+    sources = [MOVIES_PATH, EmbeddingStore(MODEL_NAME).embeddings_path]
+    params = dict(limit=limit, model=MODEL_NAME, ann=ann, precision=precision, rerank=rerank, **ann_params)
+    result_cache = ResultCache(disk_path=DEFAULT_DISK_PATH) if cache else None
+    results = result_cache.get("semantic", query, file_version(*sources), **params) if cache else None
+    if results is None:
+        results = semantic_results(query, limit, ann, precision, rerank, **ann_params)
+        if cache:
+            #computing may have refreshed the embeddings file, key on the version it left behind
+            result_cache.put("semantic", query, file_version(*sources), results, **params)
+
+    for i, (title, description, score) in enumerate(results):
+        print(f"{i+1}. {title} (score : {score})")
+        print(description)
         print("\n")
 
 
@@ -0,0 +1,129 @@
+'''
+cache of search results in front of the keyword and semantic paths.
+
+Keys are the normalised query plus every parameter that changes the
+answer (limit, k1, b, model, ...) and the version of the files the answer
+was computed from, so rebuilding the index or the embeddings invalidates
+old entries without any explicit flush. The memory tier is an LRU, which
+suits traffic skewed towards a few popular titles; entries may also expire
+after a TTL, and an optional sqlite file keeps results across processes.
+'''
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable
+
+DEFAULT_DISK_PATH = Path("cache/results.sqlite")
+
+
+def normalise_query(query: str) -> str:
+    ''' case and whitespace don't change results (the model is uncased, BM25 lowercases) '''
+    return " ".join(query.lower().split())
+
+
+def file_version(*paths: Path) -> str:
+    ''' cheap version of the files an answer depends on: size and mtime, "missing" for absent files '''
+    parts = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            parts.append(f"{stat.st_size}-{stat.st_mtime_ns}")
+        except FileNotFoundError:
+            parts.append("missing")
+    return "/".join(parts)
+
+
+class ResultCache:
+
+    def __init__(self, max_entries: int = 1024, ttl: float | None = None, disk_path: Path | None = None,
+                 clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        #seconds an entry stays valid, None keeps it until evicted or invalidated
+        self.ttl = ttl
+        self.clock = clock
+        #key -> (created, value), least recently used first
+        self.entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        #namespace -> version seen last, a new one purges the namespace from disk
+        self.versions: dict[str, str] = {}
+        self.db = None
+        if disk_path is not None:
+            os.makedirs(disk_path.parent, exist_ok=True)
+            self.db = sqlite3.connect(disk_path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS results "
+                            "(key TEXT PRIMARY KEY, namespace TEXT, version TEXT, created REAL, value TEXT)")
+
+    @staticmethod
+    def key(namespace: str, query: str, version: str, **params) -> str:
+        return json.dumps([namespace, normalise_query(query), version, sorted(params.items())])
+
+    def __expired(self, created: float) -> bool:
+        return self.ttl is not None and self.clock() - created > self.ttl
+
+    def __remember(self, key: str, created: float, value: Any):
+        self.entries[key] = (created, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __see_version(self, namespace: str, version: str):
+        if self.db is not None and self.versions.get(namespace) != version:
+            self.versions[namespace] = version
+            with self.db:
+                self.db.execute("DELETE FROM results WHERE namespace = ? AND version != ?", (namespace, version))
+
+    def get(self, namespace: str, query: str, version: str, **params) -> Any | None:
+        key = self.key(namespace, query, version, **params)
+        with self.lock:
+            self.__see_version(namespace, version)
+            entry = self.entries.get(key)
+            if entry is not None and not self.__expired(entry[0]):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+
+            if self.db is not None:
+                row = self.db.execute("SELECT created, value FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self.__expired(row[0]):
+                    value = json.loads(row[1])
+                    self.__remember(key, row[0], value)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, namespace: str, query: str, version: str, value: Any, **params):
+        key = self.key(namespace, query, version, **params)
+        created = self.clock()
+        with self.lock:
+            self.__see_version(namespace, version)
+            self.__remember(key, created, value)
+            if self.db is not None:
+                with self.db:
+                    self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                                    (key, namespace, version, created, json.dumps(value)))
+
+    def get_or_compute(self, namespace: str, query: str, version: str, compute: Callable[[], Any], **params) -> Any:
+        value = self.get(namespace, query, version, **params)
+        if value is None:
+            value = compute()
+            self.put(namespace, query, version, value, **params)
+        return value
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
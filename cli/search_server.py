@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+'''
+long lived search server: the model, embeddings and keyword index are
+loaded once and queries arrive as small JSON requests over HTTP, on a TCP
+port or a unix socket.
+
+    POST /search   {"mode": "keyword" | "semantic" | "hybrid", "query": str, "limit": int}
+                   -> {"results": [{"id", "title", "score"}, ...]}
+                   keyword also takes "maxscore", "impacts", "proximity" and "fuzzy"
+                   (true / false), hybrid takes "method" ("rrf" | "weighted") and "alpha";
+                   any other key is refused rather than ignored
+    GET  /health   -> {"status": "ok", "modes": [...]}
+
+The asyncio front end only parses requests; scoring runs in executors.
+Keyword queries go to a process pool whose workers each mmap the same
+index file (the pages are shared), semantic queries to a thread pool since
+the model and numpy release the GIL while they work. A hybrid query
+awaits both at once, so it takes as long as the slower branch. Semantic
+queries arriving together can be micro-batched into one encode and one
+matrix product (lib.batcher). With a
+ResultCache, repeated queries are answered without reaching the pools.
+'''
+import argparse
+import asyncio
+import http.client
+import json
+import multiprocessing
+import socket
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+from pathlib import Path
+from keyword_search_utils import BM25_B, BM25_K1, InvertedIndex
+from document_source import iter_documents
+from result_cache import ResultCache, file_version
+from lib.batcher import MicroBatcher
+from lib.hybrid_search import fuse
+
+DEFAULT_ADDRESS = "http://127.0.0.1:8765"
+#options a request may carry per mode, the same as the CLI flags of that search
+MODE_OPTIONS = {"keyword": ["maxscore", "impacts", "proximity", "fuzzy"], "hybrid": ["method", "alpha"]}
+
+#keyword index of a pool worker, opened once by _init_worker
+_worker_index: InvertedIndex | None = None
+
+
+def _init_worker(index_file_path):
+    global _worker_index
+    _worker_index = InvertedIndex()
+    _worker_index.index_file_path = index_file_path
+    _worker_index.load()
+
+
+def _keyword_hits(inv_idx: InvertedIndex, query: str, limit: int, maxscore: bool = False, impacts: bool = False,
+                  proximity: bool = False, fuzzy: bool = False) -> list[tuple[int, float]]:
+    ''' what bm25search prints for the same flags '''
+    if proximity:
+        return inv_idx.proximity_search(query, limit)
+    return inv_idx.bm25_search(query, limit, maxscore=maxscore, impacts=impacts, fuzzy=fuzzy)
+
+
+def _keyword_task(query: str, limit: int, options: dict) -> list[tuple[int, float]]:
+    return _keyword_hits(_worker_index, query, limit, **options)
+
+
+def parse_address(address: str) -> tuple[str, str | tuple[str, int]]:
+    ''' "http://host:port" -> ("tcp", (host, port)), "unix:/path" or "unix:///path" -> ("unix", path) '''
+    parts = urlsplit(address)
+    if parts.scheme == "unix":
+        return "unix", parts.path
+    if parts.scheme == "http" and parts.hostname and parts.port:
+        return "tcp", (parts.hostname, parts.port)
+    raise ValueError(f"bad server address {address}, expected http://host:port or unix:/path")
+
+
+class SearchServer:
+
+    def __init__(self, inv_idx: InvertedIndex, semantic=None, workers: int = 0, threads: int = 4, hybrid_depth: int = 50,
+                 cache: ResultCache | None = None, batch_window: float = 0.0, max_batch: int = 32):
+        self.inv_idx = inv_idx
+        #anything with search(query, limit) -> [(row, score)] and documents, normally SemanticSearch
+        self.semantic = semantic
+        self.threads = ThreadPoolExecutor(threads)
+        self.processes = None
+        if workers > 0 and inv_idx.mapped is not None:
+            self.processes = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_init_worker, initargs=(inv_idx.index_file_path,))
+        self.server: asyncio.Server | None = None
+        #semantic queries are batched when a window is set
+        self.batcher = None
+        if semantic is not None and batch_window > 0:
+            self.batcher = MicroBatcher(semantic.search_batch, max_batch, batch_window)
+        #results taken from each branch of a hybrid query before fusing
+        self.hybrid_depth = hybrid_depth
+        self.modes = {"keyword": self.keyword_search}
+        if semantic is not None:
+            self.modes["semantic"] = self.semantic_search
+            self.modes["hybrid"] = self.hybrid_search
+
+        self.cache = cache
+        #cache key parts per mode. Versions are taken once: the server keeps
+        #answering from what it loaded even if the files are rebuilt meanwhile
+        keyword = (file_version(inv_idx.index_file_path), {"k1": BM25_K1, "b": BM25_B})
+        store = getattr(semantic, "store", None)
+        semantic_key = (file_version(store.embeddings_path) if store else "", {"model": getattr(semantic, "model_name", "")})
+        self.cache_keys = {"keyword": keyword, "semantic": semantic_key,
+                           "hybrid": (f"{keyword[0]}|{semantic_key[0]}", {**keyword[1], **semantic_key[1]})}
+
+    async def __keyword_hits(self, query: str, limit: int, **options) -> list[tuple[int, float]]:
+        loop = asyncio.get_running_loop()
+        if self.processes is not None:
+            return await loop.run_in_executor(self.processes, _keyword_task, query, limit, options)
+        return await loop.run_in_executor(self.threads, partial(_keyword_hits, self.inv_idx, query, limit, **options))
+
+    async def __semantic_hits(self, query: str, limit: int) -> list[tuple[int, float]]:
+        if self.batcher is not None:
+            hits = await asyncio.wrap_future(self.batcher.submit(query, limit))
+        else:
+            loop = asyncio.get_running_loop()
+            hits = await loop.run_in_executor(self.threads, self.semantic.search, query, limit)
+        return [(self.semantic.documents[row]["id"], score) for row, score in hits]
+
+    def __results(self, hits: list[tuple[int, float]]) -> list[dict]:
+        return [{"id": doc_id, "title": self.inv_idx.index[doc_id]["title"], "score": score} for doc_id, score in hits]
+
+    async def keyword_search(self, query: str, limit: int, maxscore: bool = False, impacts: bool = False,
+                             proximity: bool = False, fuzzy: bool = False) -> list[dict]:
+        return self.__results(await self.__keyword_hits(query, limit, maxscore=bool(maxscore), impacts=bool(impacts),
+                                                        proximity=bool(proximity), fuzzy=bool(fuzzy)))
+
+    async def semantic_search(self, query: str, limit: int) -> list[dict]:
+        return self.__results(await self.__semantic_hits(query, limit))
+
+    async def hybrid_search(self, query: str, limit: int, method: str = "rrf", alpha: float = 0.5) -> list[dict]:
+        depth = max(limit, self.hybrid_depth)
+        keyword, semantic = await asyncio.gather(self.__keyword_hits(query, depth), self.__semantic_hits(query, depth))
+        return self.__results(fuse(keyword, semantic, limit, method, float(alpha)))
+
+    async def search(self, request: dict) -> list[dict]:
+        mode = request.get("mode", "keyword")
+        if mode not in self.modes:
+            raise LookupError(f"unknown or unloaded mode {mode}, the server has {', '.join(self.modes)}")
+        options = {name: request[name] for name in MODE_OPTIONS.get(mode, []) if name in request}
+        unknown = request.keys() - options.keys() - {"mode", "query", "limit"}
+        if unknown:
+            raise ValueError(f"{mode} search doesn't take {', '.join(sorted(unknown))}")
+        query, limit = str(request["query"]), int(request.get("limit", 5))
+        if self.cache is None:
+            return await self.modes[mode](query, limit, **options)
+
+        version, params = self.cache_keys[mode]
+        results = self.cache.get(mode, query, version, limit=limit, **params, **options)
+        if results is None:
+            results = await self.modes[mode](query, limit, **options)
+            self.cache.put(mode, query, version, results, limit=limit, **params, **options)
+        return results
+
+    async def __route(self, method: str, path: str, body: bytes) -> tuple[str, dict]:
+        if method == "GET" and path == "/health":
+            health = {"status": "ok", "modes": list(self.modes)}
+            query_cache = getattr(self.semantic, "query_cache", None)
+            if query_cache is not None:
+                health["query_cache"] = query_cache.stats()
+            if self.batcher is not None:
+                health["mean_batch_size"] = self.batcher.mean_batch_size
+            return "200 OK", health
+        if method != "POST" or path != "/search":
+            return "404 Not Found", {"error": f"no route {method} {path}"}
+        try:
+            return "200 OK", {"results": await self.search(json.loads(body))}
+        except (ValueError, KeyError, LookupError) as e:
+            return "400 Bad Request", {"error": str(e)}
+        except Exception as e:
+            return "500 Internal Server Error", {"error": f"{type(e).__name__}: {e}"}
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        ''' minimal HTTP/1.1 with keep alive: request line, headers, Content-Length body '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()).strip():
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self.__route(method, path, body)
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, address: str = DEFAULT_ADDRESS) -> asyncio.Server:
+        kind, target = parse_address(address)
+        if kind == "unix":
+            self.server = await asyncio.start_unix_server(self.__handle_connection, path=target)
+        else:
+            self.server = await asyncio.start_server(self.__handle_connection, *target)
+        return self.server
+
+    async def serve_forever(self, address: str = DEFAULT_ADDRESS):
+        server = await self.start(address)
+        print(f"Serving {', '.join(self.modes)} search on {address}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.threads.shutdown()
+        if self.batcher is not None:
+            self.batcher.close()
+        if self.processes is not None:
+            self.processes.shutdown()
+        if self.cache is not None:
+            self.cache.close()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def query_server(address: str, mode: str, query: str, limit: int = 5, timeout: float = 30.0, **options) -> list[dict]:
+    ''' client side of POST /search, raises RuntimeError with the server's message on a bad request '''
+    kind, target = parse_address(address)
+    if kind == "unix":
+        connection = UnixHTTPConnection(target, timeout)
+    else:
+        connection = http.client.HTTPConnection(*target, timeout=timeout)
+    try:
+        connection.request("POST", "/search", json.dumps({"mode": mode, "query": query, "limit": limit, **options}),
+                           {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        payload = json.loads(response.read())
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(payload.get("error", response.reason))
+    return payload["results"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="search server")
+    parser.add_argument("--address", type=str, default=DEFAULT_ADDRESS, help="http://host:port or unix:/path/to.sock")
+    parser.add_argument("--workers", type=int, default=2, help="keyword scoring processes (0 = threads only)")
+    parser.add_argument("--threads", type=int, default=4, help="semantic scoring threads")
+    parser.add_argument("--no-semantic", action="store_true", help="don't load the model, keyword search only")
+    parser.add_argument("--batch-window", type=float, default=0.002, help="seconds semantic queries wait to be batched (0 = off)")
+    parser.add_argument("--max-batch", type=int, default=32, help="most semantic queries per batch")
+    parser.add_argument("--cache-size", type=int, default=4096, help="results kept in memory (0 = no cache)")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="seconds a cached result stays valid")
+    parser.add_argument("--cache-disk", type=str, default=None, help="sqlite file for a persistent cache tier")
+    args = parser.parse_args()
+
+    inv_idx = InvertedIndex()
+    inv_idx.load()
+
+    semantic = None
+    if not args.no_semantic:
+        from lib.semantic_search import SemanticSearch
+        semantic = SemanticSearch()
+        semantic.load_or_create_embeddings(iter_documents())
+
+    cache = None
+    if args.cache_size > 0:
+        cache = ResultCache(args.cache_size, args.cache_ttl, Path(args.cache_disk) if args.cache_disk else None)
+    server = SearchServer(inv_idx, semantic, args.workers, args.threads, cache=cache,
+                          batch_window=args.batch_window, max_batch=args.max_batch)
+    try:
+        asyncio.run(server.serve_forever(args.address))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+import heapq
+import json
+import math
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable
+
+from helpers import tokenise
+from keyword_search_utils import InvertedIndex, bm25_idf
+
+
+class SegmentedIndex:
+    '''
+    keyword index made of immutable InvertedIndex segments, Lucene style.
+    Added movies go into a new small segment; deletes (and updates, which
+    shadow the older copy) are tombstones per segment. A tiered merge
+    policy folds similar sized segments together and purges their
+    tombstones, in a background thread if asked to.
+
+    The manifest (segment names, tombstones) is the only mutable file and
+    is swapped in atomically, so readers always see a consistent set. In
+    memory a reader takes a snapshot of the segment list and tombstones
+    and pins its segments; a merge retires the segments it replaced and
+    they are closed and deleted once the last reader lets go of them.
+    '''
+
+    def __init__(self, directory: Path = Path("cache/segments"), merge_factor: int = 4):
+        self.directory = directory
+        self.manifest_path = directory / "manifest.json"
+        self.merge_factor = merge_factor
+        self.segments: list[tuple[str, InvertedIndex]] = []
+        #segment name -> deleted doc ids, replaced (never mutated) on change
+        self.tombstones: dict[str, frozenset[int]] = {}
+        self.next_segment = 0
+        #segment name -> readers holding it, and segments merged away but still pinned
+        self.pins: Counter[str] = Counter()
+        self.retired: dict[str, InvertedIndex] = {}
+        self.lock = threading.RLock()
+        self.merge_thread: threading.Thread | None = None
+
+    def __segment_path(self, name: str) -> Path:
+        return self.directory / f"{name}.bin"
+
+    def __open_segment(self, name: str) -> InvertedIndex:
+        segment = InvertedIndex()
+        segment.index_file_path = self.__segment_path(name)
+        segment.load()
+        return segment
+
+    def __save_manifest(self):
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = {
+            "next_segment": self.next_segment,
+            "segments": [name for name, _ in self.segments],
+            "tombstones": {name: sorted(ids) for name, ids in self.tombstones.items() if ids},
+        }
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def load(self):
+        ''' opens the segments listed in the manifest, an empty index if there is none yet '''
+        if not self.manifest_path.exists():
+            return
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        with self.lock:
+            self.next_segment = manifest["next_segment"]
+            self.segments = [(name, self.__open_segment(name)) for name in manifest["segments"]]
+            self.tombstones = {name: frozenset(manifest["tombstones"].get(name, [])) for name, _ in self.segments}
+
+    def __write_segment(self, build) -> tuple[str, InvertedIndex]:
+        with self.lock:
+            name = f"seg_{self.next_segment:06d}"
+            self.next_segment += 1
+        segment = InvertedIndex()
+        segment.index_file_path = self.__segment_path(name)
+        build(segment)
+        segment.save()
+        return name, self.__open_segment(name)
+
+    def __tombstone(self, doc_ids: set[int], segments: list[tuple[str, InvertedIndex]]):
+        ''' marks doc_ids deleted in every given segment that holds them, caller holds the lock '''
+        tombstones = dict(self.tombstones)
+        for name, segment in segments:
+            hits = {doc_id for doc_id in doc_ids if doc_id in segment.index}
+            if hits:
+                tombstones[name] = tombstones[name] | hits
+        self.tombstones = tombstones
+
+    @contextmanager
+    def __snapshot(self, names: list[str] | None = None):
+        ''' (segments, tombstones) as of now, the segments stay open until the block ends '''
+        with self.lock:
+            segments = [(name, segment) for name, segment in self.segments if names is None or name in names]
+            tombstones = self.tombstones
+            self.pins.update(name for name, _ in segments)
+        try:
+            yield segments, tombstones
+        finally:
+            with self.lock:
+                for name, _ in segments:
+                    self.pins[name] -= 1
+                    if not self.pins[name]:
+                        del self.pins[name]
+                self.__release_retired()
+
+    def __release_retired(self):
+        ''' closes and deletes the retired segments no reader holds any more, caller holds the lock '''
+        for name in [name for name in self.retired if name not in self.pins]:
+            self.retired.pop(name).mapped.close()
+            os.remove(self.__segment_path(name))
+
+    def add_movies(self, movies: Iterable[dict], merge: bool = True, background: bool = False):
+        ''' indexes movies into a new segment, movies with an existing id replace the old copy '''
+        movies = list(movies)
+        if not movies:
+            return
+        name, segment = self.__write_segment(lambda s: s.build_from_movies(movies))
+
+        with self.lock:
+            self.__tombstone({movie["id"] for movie in movies}, self.segments)
+            self.segments.append((name, segment))
+            self.tombstones = {**self.tombstones, name: frozenset()}
+            self.__save_manifest()
+
+        if merge:
+            self.maybe_merge(background)
+
+    def delete(self, doc_ids: Iterable[int]):
+        with self.lock:
+            self.__tombstone(set(doc_ids), self.segments)
+            self.__save_manifest()
+
+    def live_doc_count(self) -> int:
+        with self.lock:
+            return sum(len(segment.index) - len(self.tombstones[name]) for name, segment in self.segments)
+
+    def get_document(self, doc_id: int) -> dict | None:
+        with self.__snapshot() as (segments, tombstones):
+            for name, segment in reversed(segments):
+                if doc_id in segment.index and doc_id not in tombstones[name]:
+                    return segment.index[doc_id]
+        return None
+
+    def bm25_search(self, query: str, k: int | None = None) -> list[tuple[int, float]]:
+        '''
+        BM25 over all segments with corpus wide statistics. Like Lucene,
+        deleted documents still count towards df and the average length
+        until a merge purges them.
+        '''
+        with self.__snapshot() as (segments, tombstones):
+            return self.__bm25_search(segments, tombstones, query, k)
+
+    def __bm25_search(self, segments: list[tuple[str, InvertedIndex]], tombstones: dict[str, frozenset[int]],
+                      query: str, k: int | None) -> list[tuple[int, float]]:
+        tokens = tokenise(query)
+        n_docs = sum(len(segment.index) for _, segment in segments)
+        if n_docs == 0:
+            return []
+        avg_doc_len = sum(segment.avg_doc_len * len(segment.index) for _, segment in segments) / n_docs
+        idf = {token: bm25_idf(n_docs, sum(len(segment.docmap.get(token, [])) for _, segment in segments))
+               for token in Counter(tokens)}
+
+        scores = {}
+        for name, segment in segments:
+            dead = tombstones[name]
+            for doc_id, score in segment.bm25_scores(tokens, idf=idf, avg_doc_len=avg_doc_len).items():
+                if doc_id not in dead:
+                    scores[doc_id] = score
+
+        if k is None:
+            return sorted(scores.items(), key=lambda x: (-x[1], x[0]))
+        return heapq.nsmallest(k, scores.items(), key=lambda x: (-x[1], x[0]))
+
+    def __pick_merge(self) -> list[str]:
+        '''
+        tiered policy: segments are bucketed by log(size, merge_factor); the
+        first tier holding merge_factor segments gets merged. Segments that
+        are mostly tombstones count as a tier of their own.
+        '''
+        tiers: dict[int, list[str]] = {}
+        for name, segment in self.segments:
+            live = len(segment.index) - len(self.tombstones[name])
+            if len(segment.index) and live * 2 < len(segment.index):
+                return [name]
+            tier = int(math.log(max(live, 1), self.merge_factor))
+            tiers.setdefault(tier, []).append(name)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][:self.merge_factor]
+        return []
+
+    def merge(self, names: list[str]):
+        '''
+        merges the named segments into one, dropping tombstoned documents.
+        Reads of the old segments run without the lock; deletes that land
+        meanwhile are carried over to the merged segment.
+        '''
+        with self.__snapshot(names) as (merging, snapshot):
+            new_name, merged = self.__write_segment(lambda s: s.merge_segments(
+                [segment for _, segment in merging], [snapshot[name] for name, _ in merging]))
+
+            with self.lock:
+                late_deletes = set()
+                for name, _ in merging:
+                    late_deletes |= self.tombstones[name] - snapshot[name]
+                position = min(i for i, (name, _) in enumerate(self.segments) if name in names)
+                segments = [(name, segment) for name, segment in self.segments if name not in names]
+                tombstones = {name: ids for name, ids in self.tombstones.items() if name not in names}
+                #adds tombstone older copies, so every doc id is live in at most one segment
+                #and segment order doesn't matter for correctness
+                if len(merged.index):
+                    segments.insert(position, (new_name, merged))
+                    tombstones[new_name] = frozenset(doc_id for doc_id in late_deletes if doc_id in merged.index)
+                self.segments, self.tombstones = segments, tombstones
+                self.__save_manifest()
+                #closed and deleted once this merge and every reader are done with them
+                self.retired.update(merging)
+
+        if not len(merged.index):
+            merged.mapped.close()
+            os.remove(self.__segment_path(new_name))
+
+    def maybe_merge(self, background: bool = False):
+        ''' runs the merge policy until it has nothing to merge '''
+        if background:
+            with self.lock:
+                if self.merge_thread is not None and self.merge_thread.is_alive():
+                    return
+                self.merge_thread = threading.Thread(target=self.maybe_merge, daemon=True)
+                self.merge_thread.start()
+            return
+
+        while True:
+            with self.lock:
+                names = self.__pick_merge()
+            if not names:
+                return
+            self.merge(names)
+
+    def force_merge(self):
+        ''' merges everything into a single segment without tombstones '''
+        self.wait_for_merges()
+        with self.lock:
+            names = [name for name, _ in self.segments]
+        if len(names) > 1 or any(self.tombstones[name] for name in names):
+            self.merge(names)
+
+    def wait_for_merges(self):
+        thread = self.merge_thread
+        if thread is not None:
+            thread.join()
@@ -1,11 +1,16 @@
 #!/usr/bin/env python3
 
 import argparse
-from lib.semantic_search import SemanticSearch
-from lib.semantic_search import embed, verify_embeddings, embed_query_text, search
-from handlers import chunk_handler, semantic_chunk_handler
+from lib.hybrid_search import hybrid_search, FUSION_METHODS
+from handlers import chunk_handler, semantic_chunk_handler, server_search_handler
+from chunking import AGGREGATIONS, CHUNK_METHODS, DEFAULT_CHUNK_SIZE, DEFAULT_OVERLAP
+
+#lib.semantic_search (numpy, the model, ann and quantisation code) is imported
+#by the commands that use it, the text only ones like chunk start instantly
 
 def verify_model():
+    from lib.semantic_search import SemanticSearch
+
     search = SemanticSearch()
     print(f"Model Loaded {search.model}")
     print(f"Max sequence length: {search.model.max_seq_length}")
@@ -18,6 +23,17 @@ def main():
     embedquery_parser = subparsers.add_parser("embedquery", help="embed query")
     embedquery_parser.add_argument("query", type=str, help="query to embed")
     varify_embeddings = subparsers.add_parser("verify_embeddings", help="verify embeddings")
+    query_cache_parser = subparsers.add_parser("query_cache_stats", help="size and hit rate of the query embedding cache")
+
+    build_embeddings_parser = subparsers.add_parser("build_embeddings", help="rebuild the document embeddings")
+    build_embeddings_parser.add_argument("--batch-size", type=int, default=64, help="documents per encode batch")
+    build_embeddings_parser.add_argument("--workers", type=int, default=0, help="CPU encoding processes (0 = encode in this process)")
+
+    build_ann_parser = subparsers.add_parser("build_ann", help="build the approximate nearest neighbour index")
+    build_ann_parser.add_argument("kind", type=str, choices=["ivf", "hnsw"], help="index type")
+    build_ann_parser.add_argument("--lists", type=int, default=None, help="ivf: number of k-means lists (default sqrt(n))")
+    build_ann_parser.add_argument("--m", type=int, default=16, help="hnsw: links per node")
+    build_ann_parser.add_argument("--ef-construction", type=int, default=100, help="hnsw: candidate list size while building")
 
     chunk_parser = subparsers.add_parser("chunk", help="chunk text")
     chunk_parser.add_argument("text", type=str, help="text to chunk")
@@ -29,10 +45,38 @@ def main():
     semantic_chunk_parser.add_argument("--max-chunk-size", type=int, default=4, help="max size")
     semantic_chunk_parser.add_argument("--overlap", type=int, default=0, help="overlap")
 
+    build_chunks_parser = subparsers.add_parser("build_chunk_embeddings", help="embed overlapping chunks of each description")
+    build_chunks_parser.add_argument("--method", type=str, choices=CHUNK_METHODS, default="words", help="chunk by words or by sentences")
+    build_chunks_parser.add_argument("--size", type=int, default=DEFAULT_CHUNK_SIZE, help="words (or sentences) per chunk")
+    build_chunks_parser.add_argument("--overlap", type=int, default=DEFAULT_OVERLAP, help="words (or sentences) shared by neighbouring chunks")
+    build_chunks_parser.add_argument("--batch-size", type=int, default=64, help="chunks per encode batch")
+    build_chunks_parser.add_argument("--workers", type=int, default=0, help="CPU encoding processes (0 = encode in this process)")
+
+    chunk_search_parser = subparsers.add_parser("chunk_search", help="search chunk embeddings, scores folded back into movies")
+    chunk_search_parser.add_argument("query", type=str, help="query to search")
+    chunk_search_parser.add_argument("--limit", type=int, default=5, help="limit")
+    chunk_search_parser.add_argument("--aggregate", type=str, choices=AGGREGATIONS, default="max", help="a movie's best chunk score or the sum over its chunks")
+    chunk_search_parser.add_argument("--method", type=str, choices=CHUNK_METHODS, default="words", help="chunking the embeddings were built with")
+    chunk_search_parser.add_argument("--size", type=int, default=DEFAULT_CHUNK_SIZE, help="chunk size the embeddings were built with")
+    chunk_search_parser.add_argument("--overlap", type=int, default=DEFAULT_OVERLAP, help="overlap the embeddings were built with")
 
     search_parser = subparsers.add_parser("search", help="search")
     search_parser.add_argument("query", type=str, help="query to search")
     search_parser.add_argument("--limit", type=int, default=5, help="limit")
+    search_parser.add_argument("--ann", type=str, choices=["ivf", "hnsw"], default=None, help="search an approximate index instead of every embedding")
+    search_parser.add_argument("--nprobe", type=int, default=8, help="ivf: lists scanned per query")
+    search_parser.add_argument("--ef", type=int, default=50, help="hnsw: candidate list size per query")
+    search_parser.add_argument("--precision", type=str, choices=["float32", "float16", "int8", "pq"], default="float32", help="storage precision scanned per query")
+    search_parser.add_argument("--rerank", type=int, default=4, help="candidates per result re-scored in float32 (0 = off)")
+    search_parser.add_argument("--server", type=str, default=None, help="ask a running search_server.py (http://host:port or unix:/path)")
+    search_parser.add_argument("--cache", action="store_true", help="reuse results of earlier identical queries (cache/results.sqlite)")
+
+    hybrid_parser = subparsers.add_parser("hybrid_search", help="BM25 and semantic search fused into one ranking")
+    hybrid_parser.add_argument("query", type=str, help="query to search")
+    hybrid_parser.add_argument("--limit", type=int, default=5, help="limit")
+    hybrid_parser.add_argument("--method", type=str, choices=FUSION_METHODS, default="rrf", help="reciprocal rank fusion or weighted normalised scores")
+    hybrid_parser.add_argument("--alpha", type=float, default=0.5, help="weighted: share of the BM25 score")
+    hybrid_parser.add_argument("--server", type=str, default=None, help="ask a running search_server.py (http://host:port or unix:/path)")
 
     embed_parser = subparsers.add_parser("embed_text", help="embed text")
     embed_parser.add_argument("text", type=str, help="text to embed")
@@ -43,13 +87,53 @@ def main():
         case "verify":
             verify_model()
         case "verify_embeddings":
+            from lib.semantic_search import verify_embeddings
             verify_embeddings()
+        case "query_cache_stats":
+            from lib.semantic_search import query_cache_stats
+            query_cache_stats()
+        case "build_embeddings":
+            from lib.semantic_search import build_embeddings
+            build_embeddings(args.batch_size, args.workers)
         case "embed_text":
+            from lib.semantic_search import embed
             embed(args.text)
         case "embedquery":
+            from lib.semantic_search import embed_query_text
             embed_query_text(args.query)
+        case "build_ann":
+            from lib.semantic_search import build_ann
+            if args.kind == "ivf":
+                build_ann("ivf", n_lists=args.lists)
+            else:
+                build_ann("hnsw", m=args.m, ef_construction=args.ef_construction)
         case "search":
-            search(args.query, args.limit)
+            if args.server:
+                #the server searches the embeddings it loaded, with its own result cache
+                local = [f"--{name}" for name in ["ann", "precision", "rerank", "cache"]
+                         if getattr(args, name) != search_parser.get_default(name)]
+                if local:
+                    parser.error(f"{', '.join(local)} can't be combined with --server, it searches what the server loaded")
+                server_search_handler(args.server, "semantic", args.query, args.limit)
+                return
+            from lib.semantic_search import search
+            if args.ann == "ivf":
+                search(args.query, args.limit, "ivf", cache=args.cache, nprobe=args.nprobe)
+            elif args.ann == "hnsw":
+                search(args.query, args.limit, "hnsw", cache=args.cache, ef=args.ef)
+            else:
+                search(args.query, args.limit, precision=args.precision, rerank=args.rerank, cache=args.cache)
+        case "hybrid_search":
+            if args.server:
+                server_search_handler(args.server, "hybrid", args.query, args.limit, method=args.method, alpha=args.alpha)
+            else:
+                hybrid_search(args.query, args.limit, args.method, args.alpha)
+        case "build_chunk_embeddings":
+            from lib.chunked_search import build_chunk_embeddings
+            build_chunk_embeddings(args.method, args.size, args.overlap, args.batch_size, args.workers)
+        case "chunk_search":
+            from lib.chunked_search import chunk_search
+            chunk_search(args.query, args.limit, args.aggregate, args.method, args.size, args.overlap)
         case "chunk":
             chunk_handler(args.text, args.chunk_size, args.overlap)
         case "semantic_chunk":
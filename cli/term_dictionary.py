@@ -0,0 +1,170 @@
+'''
+prefix and typo tolerant lookups in the term dictionary of the keyword
+index.
+
+prefix: the terms are sorted (MappedIndex stores them that way), so the
+terms starting with a prefix are one contiguous range, two bisects away.
+
+fuzzy: a SymSpell style deletion index. Every term is filed under each
+string made by deleting up to max_distance characters from its first
+PREFIX_LENGTH characters; two words within d edits always share such a
+delete. A lookup generates the deletes of the query word, binary searches
+each of them and verifies the few terms found with a bounded edit
+distance, so it reads a few dozen entries whatever the vocabulary size.
+
+The deletes are stored as sorted crc32 keys with the term id of each
+entry (a collision only adds a candidate that fails verification), in a
+file next to the index together with the version of the index file they
+were built from:
+
+    header    magic, max distance, prefix length, entry count, version length
+    version   utf-8 file_version of the index file, 8-byte padded
+    keys      uint32[n_entries]   crc32 of a delete, sorted
+    term_ids  uint32[n_entries]   position of the term in the sorted terms, per key
+'''
+import os
+import struct
+import zlib
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from typing import Sequence
+
+MAGIC = b"RAGDELS1"
+HEADER = struct.Struct("<8sIIQI")
+MAX_DISTANCE = 2
+#SymSpell's prefix length: longer terms are only filed under deletes of their start
+PREFIX_LENGTH = 7
+#sorts after every character a term can contain
+LAST_CHAR = "\U0010ffff"
+
+
+def auto_distance(word: str) -> int:
+    ''' edits allowed for a word of this length: none up to 2 characters, 1 up to 5, then 2 '''
+    if len(word) <= 2:
+        return 0
+    if len(word) <= 5:
+        return 1
+    return 2
+
+
+def deletes(word: str, max_distance: int) -> set[str]:
+    ''' word and every string made by deleting up to max_distance of its characters '''
+    found = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        found |= frontier
+    return found
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    ''' Levenshtein distance of a and b, limit + 1 as soon as it has to be larger than limit '''
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    row = list(range(len(b) + 1))
+    for i, a_char in enumerate(a, start=1):
+        next_row = [i]
+        for j, b_char in enumerate(b, start=1):
+            next_row.append(min(next_row[j - 1] + 1, row[j] + 1, row[j - 1] + (a_char != b_char)))
+        if min(next_row) > limit:
+            return limit + 1
+        row = next_row
+    return min(row[-1], limit + 1)
+
+
+def _key(delete: str) -> int:
+    return zlib.crc32(delete.encode("utf-8"))
+
+
+class DeleteIndex:
+
+    def __init__(self, keys: Sequence[int], term_ids: Sequence[int], max_distance: int = MAX_DISTANCE,
+                 prefix_length: int = PREFIX_LENGTH):
+        self.keys = keys
+        self.term_ids = term_ids
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+
+    @classmethod
+    def build(cls, terms: Sequence[str], max_distance: int = MAX_DISTANCE,
+              prefix_length: int = PREFIX_LENGTH) -> "DeleteIndex":
+        #key and term id packed in one int, one sort orders both
+        entries = sorted(_key(delete) << 32 | term_id for term_id, term in enumerate(terms)
+                         for delete in deletes(term[:prefix_length], max_distance))
+        keys = array("I", (entry >> 32 for entry in entries))
+        term_ids = array("I", (entry & 0xFFFFFFFF for entry in entries))
+        return cls(keys, term_ids, max_distance, prefix_length)
+
+    def save(self, path: Path, version: str):
+        version_bytes = version.encode("utf-8")
+        os.makedirs(path.parent, exist_ok=True)
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, self.max_distance, self.prefix_length, len(self.keys), len(version_bytes)))
+            f.write(version_bytes + b"\0" * (-len(version_bytes) % 8))
+            f.write(array("I", self.keys).tobytes())
+            f.write(array("I", self.term_ids).tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path, version: str) -> "DeleteIndex | None":
+        ''' the saved deletes, None if there are none or they belong to another version of the index '''
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            magic, max_distance, prefix_length, n_entries, version_length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or f.read(version_length).decode("utf-8") != version:
+                return None
+            f.read(-version_length % 8)
+            keys, term_ids = array("I"), array("I")
+            keys.frombytes(f.read(4 * n_entries))
+            term_ids.frombytes(f.read(4 * n_entries))
+        return cls(keys, term_ids, max_distance, prefix_length)
+
+    def candidates(self, word: str, max_distance: int) -> set[int]:
+        ''' ids of the terms sharing a delete with word, a superset of those within max_distance '''
+        if max_distance > self.max_distance:
+            raise ValueError(f"the deletion index covers {self.max_distance} edits, not {max_distance}")
+        term_ids = set()
+        for delete in deletes(word[:self.prefix_length], max_distance):
+            key = _key(delete)
+            i = bisect_left(self.keys, key)
+            while i < len(self.keys) and self.keys[i] == key:
+                term_ids.add(self.term_ids[i])
+                i += 1
+        return term_ids
+
+
+class TermDictionary:
+
+    def __init__(self, terms: Sequence[str], deletes: DeleteIndex | None = None):
+        #sorted, e.g. MappedIndex.terms or sorted(docmap)
+        self.terms = terms
+        self.deletes = deletes
+
+    def prefix_range(self, prefix: str) -> tuple[int, int]:
+        ''' [start, end) of the term ids starting with prefix '''
+        start = bisect_left(self.terms, prefix)
+        return start, bisect_left(self.terms, prefix + LAST_CHAR, start)
+
+    def prefix(self, prefix: str, limit: int | None = None) -> list[str]:
+        ''' terms starting with prefix in sorted order '''
+        start, end = self.prefix_range(prefix)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [self.terms[i] for i in range(start, end)]
+
+    def fuzzy(self, word: str, max_distance: int | None = None) -> list[tuple[str, int]]:
+        ''' (term, edit distance) of the terms within max_distance of word (auto_distance by default), closest first '''
+        if self.deletes is None:
+            self.deletes = DeleteIndex.build(self.terms)
+        if max_distance is None:
+            max_distance = min(auto_distance(word), self.deletes.max_distance)
+        matches = []
+        for term_id in self.deletes.candidates(word, max_distance):
+            term = self.terms[term_id]
+            distance = edit_distance(word, term, max_distance)
+            if distance <= max_distance:
+                matches.append((term, distance))
+        return sorted(matches, key=lambda match: (match[1], match[0]))
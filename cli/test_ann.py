@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from helpers import normalize, top_k_indices
+from lib.ann import HNSWIndex, IVFIndex, ann_path, load_or_build_ann
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    centres = normalize(rng.normal(size=(20, 32)))
+    return normalize(centres[rng.integers(0, 20, 1000)] + 0.2 * rng.normal(size=(1000, 32))).astype(np.float32)
+
+
+def recall(index, vectors, k=10, **knobs):
+    queries = vectors[:50]
+    exact = top_k_indices(queries @ vectors.T, k)
+    return np.mean([len(set(index.search(q, k, **knobs)[0].tolist()) & set(e.tolist())) / k
+                    for q, e in zip(queries, exact)])
+
+
+def test_ivf_scanning_every_list_is_exact(vectors):
+    index = IVFIndex(n_lists=16).build(vectors)
+    assert index.list_offsets[-1] == len(vectors)
+    assert sorted(index.list_ids.tolist()) == list(range(len(vectors)))
+    assert recall(index, vectors, nprobe=16) == 1.0
+    assert recall(index, vectors, nprobe=1) < recall(index, vectors, nprobe=4) + 1e-9
+
+
+def test_hnsw_recall(vectors):
+    index = HNSWIndex(m=8, ef_construction=50).build(vectors)
+    assert recall(index, vectors, ef=64) >= 0.95
+    ids, scores = index.search(vectors[3], 5)
+    assert ids[0] == 3
+    assert list(scores) == sorted(scores, reverse=True)
+
+
+@pytest.mark.parametrize("kind,params", [("ivf", {"n_lists": 8}), ("hnsw", {"m": 8, "ef_construction": 32})])
+def test_saved_index_is_reused_until_the_embeddings_change(vectors, tmp_path, kind, params):
+    path = ann_path(kind, tmp_path / "embeddings.npy")
+    built = load_or_build_ann(kind, vectors, path, **params)
+    mtime = path.stat().st_mtime_ns
+
+    loaded = load_or_build_ann(kind, vectors, path)
+    assert path.stat().st_mtime_ns == mtime
+    assert loaded.params() == built.params()
+    for q in vectors[:5]:
+        np.testing.assert_array_equal(loaded.search(q, 10)[0], built.search(q, 10)[0])
+
+    load_or_build_ann(kind, vectors[:500], path, **params)
+    assert path.stat().st_mtime_ns != mtime
@@ -0,0 +1,65 @@
+import json
+import random
+from autocomplete import SCAN_LIMIT, TitleAutocomplete, keystroke_latencies, load_autocomplete, normalise, word_starts
+
+MOVIES = [
+    {"id": 1, "title": "The Matrix", "popularity": 90},
+    {"id": 2, "title": "The Matrix Reloaded", "popularity": 60},
+    {"id": 3, "title": "Mater's Tall Tales"},
+    {"id": 4, "title": "the matrix!", "popularity": 10},
+    {"id": 5, "title": "Theory of Everything", "popularity": 70},
+]
+
+
+def brute_force(completer: TitleAutocomplete, prefix: str, limit: int) -> list[str]:
+    key = normalise(prefix)
+    return [title for title in completer.titles
+            if any(normalise(title).startswith(key, i) for i in word_starts(normalise(title)))][:limit]
+
+
+def test_normalise_keeps_a_trailing_space():
+    assert normalise("  The  Matrix! ") == "the matrix "
+    assert normalise("Mater's") == "maters"
+    assert normalise("   ") == ""
+
+
+def test_completions_rank_by_popularity():
+    completer = TitleAutocomplete.build(MOVIES)
+    assert completer.complete("the") == ["The Matrix", "Theory of Everything", "The Matrix Reloaded"]
+    assert completer.complete("the ") == ["The Matrix", "The Matrix Reloaded"]
+    #every word start is a key, the spelling of the most popular duplicate is shown
+    assert completer.complete("mat", 2) == ["The Matrix", "The Matrix Reloaded"]
+    assert completer.complete("tall") == ["Mater's Tall Tales"]
+    assert completer.complete("x") == []
+
+
+def test_precomputed_prefixes_match_a_scan():
+    rng = random.Random(0)
+    movies = [{"id": i, "title": " ".join(rng.choice(["ab", "abc", "b", "ba", "cab"]) + rng.choice("abc") for _ in range(3)),
+               "popularity": rng.random()} for i in range(2000)]
+    completer = TitleAutocomplete.build(movies, top_n=5)
+    assert completer.tops
+    for prefix in ["", "a", "ab", "abc", "b", "ba ", "cab", "cabb abc"]:
+        assert completer.complete(prefix) == brute_force(completer, prefix, 5), prefix
+    assert max(len(prefix) for prefix in completer.tops) < max(len(key) for key in completer.keys)
+    assert all(len(numbers) == 5 for numbers in completer.tops.values())
+    assert SCAN_LIMIT < len(completer.keys)
+
+
+def test_cached_until_the_movies_change(tmp_path):
+    movies_path = tmp_path / "movies.json"
+    movies_path.write_text(json.dumps({"movies": MOVIES}))
+    path = tmp_path / "autocomplete.json"
+    assert load_autocomplete(movies_path, path).complete("theo") == ["Theory of Everything"]
+    assert path.exists()
+
+    movies_path.write_text(json.dumps({"movies": MOVIES + [{"id": 6, "title": "Theodora", "popularity": 99}]}))
+    assert load_autocomplete(movies_path, path).complete("theo") == ["Theodora", "Theory of Everything"]
+
+
+def test_one_latency_per_keystroke():
+    completer = TitleAutocomplete.build(MOVIES)
+    latencies = keystroke_latencies(completer, "the m", limit=1)
+    assert [prefix for prefix, _, _ in latencies] == ["t", "th", "the", "the ", "the m"]
+    assert latencies[-1][2] == ["The Matrix"]
+    assert all(ms >= 0 for _, ms, _ in latencies)
@@ -0,0 +1,45 @@
+import threading
+import pytest
+from lib.batcher import MicroBatcher
+
+
+class RecordingSearch:
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def __call__(self, queries, limit):
+        with self.lock:
+            self.batches.append(list(queries))
+        return [[(len(query), 1.0), (i, 0.5), (-1, 0.1)][:limit] for i, query in enumerate(queries)]
+
+
+def test_concurrent_queries_share_batches():
+    search = RecordingSearch()
+    batcher = MicroBatcher(search, max_batch=8, max_wait=0.05)
+    queries = [f"query {'x' * i}" for i in range(16)]
+    futures = [batcher.submit(query, 2) for query in queries]
+    results = [future.result(timeout=5) for future in futures]
+    batcher.close()
+
+    assert len(search.batches) == 2
+    assert all(len(batch) == 8 for batch in search.batches)
+    for query, result in zip(queries, results):
+        assert result[0] == (len(query), 1.0)
+        assert len(result) == 2
+
+
+def test_each_caller_gets_its_own_limit_and_errors():
+    search = RecordingSearch()
+    batcher = MicroBatcher(search, max_wait=0.05)
+    short, long = batcher.submit("a", 1), batcher.submit("b", 3)
+    assert len(short.result(timeout=5)) == 1
+    assert len(long.result(timeout=5)) == 3
+    batcher.close()
+
+    def broken(queries, limit):
+        raise RuntimeError("model crashed")
+    batcher = MicroBatcher(broken)
+    with pytest.raises(RuntimeError):
+        batcher.search("a")
+    batcher.close()
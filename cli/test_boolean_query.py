@@ -0,0 +1,66 @@
+import random
+import pytest
+from itertools import islice
+from boolean_query import And, Not, Or, Term, boolean_search, gallop, parse_query
+from keyword_search_utils import InvertedIndex
+from test_keyword_search_utils import MOVIES
+
+
+@pytest.fixture
+def inv_idx():
+    idx = InvertedIndex()
+    idx.build_from_movies(MOVIES)
+    return idx
+
+
+def matches(idx, token: str) -> set[int]:
+    return set(idx.docmap.get(token, []))
+
+
+def test_gallop_finds_the_first_not_smaller():
+    doc_ids = sorted(random.Random(0).sample(range(10000), 500))
+    for lo in [0, 7, 250]:
+        for target in [-1, 0, doc_ids[lo], doc_ids[300] + 1, 5000, 20000]:
+            expected = next((i for i in range(lo, len(doc_ids)) if doc_ids[i] >= target), len(doc_ids))
+            assert gallop(doc_ids, target, lo) == expected
+
+
+def test_parse_precedence():
+    assert repr(parse_query("bears OR space honey")) == repr(Or([Term("bear"), And([Term("space"), Term("honey")])]))
+    assert repr(parse_query("-(honey OR heist) NOT bear")) == repr(And([Not(Or([Term("honey"), Term("heist")])), Not(Term("bear"))]))
+    assert repr(parse_query("spider-man")) == repr(Term("spiderman"))
+    assert parse_query("") is None
+    for broken in ["bear AND", "(bear", "bear)", "OR bear"]:
+        with pytest.raises(ValueError):
+            parse_query(broken)
+
+
+def test_boolean_search_matches_set_algebra(inv_idx):
+    bear, honey, space = matches(inv_idx, "bear"), matches(inv_idx, "honey"), matches(inv_idx, "space")
+    every = set(inv_idx.index)
+    cases = {
+        "bear honey": bear & honey,
+        "bears AND honey": bear & honey,
+        "honey OR space": honey | space,
+        "bear -honey": bear - honey,
+        "NOT bear": every - bear,
+        "-(honey OR space)": every - honey - space,
+        "(honey OR space) bear NOT heist": (honey | space) & bear - matches(inv_idx, "heist"),
+        "missingword OR honey": honey,
+    }
+    for query, expected in cases.items():
+        found = list(boolean_search(inv_idx, query))
+        assert found == sorted(expected), query
+
+
+def test_results_are_lazy(inv_idx):
+    assert list(islice(boolean_search(inv_idx, "NOT hacker"), 2)) == [1, 2]
+
+
+def test_mapped_index(inv_idx, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    inv_idx.save()
+    loaded = InvertedIndex()
+    loaded.load()
+    for query in ["bear honey", "NOT bear", "space OR hacker -moon"]:
+        assert list(boolean_search(loaded, query)) == list(boolean_search(inv_idx, query))
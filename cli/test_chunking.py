@@ -0,0 +1,83 @@
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+from chunking import ChunkIndex, aggregate_chunks, iter_chunks, sentence_spans, windows, word_spans
+from test_keyword_search_utils import MOVIES
+
+LONG = {"id": 7, "title": "Long Story", "description": "bears " * 30 + "and then a heist at the very end"}
+
+
+def test_windows_cover_everything_with_overlap():
+    assert list(windows(10, 4, 1)) == [(0, 4), (3, 7), (6, 10)]
+    assert list(windows(3, 4, 1)) == [(0, 3)]
+    assert list(windows(0, 4, 0)) == []
+    with pytest.raises(ValueError):
+        list(windows(10, 4, 4))
+
+
+def test_spans_are_offsets_into_the_text():
+    text = "one two  three four five"
+    assert [text[s:e] for s, e in word_spans(text, 2, 0)] == ["one two", "three four", "five"]
+    text = "A bear. A heist! Done? "
+    assert [text[s:e] for s, e in sentence_spans(text, 2, 1)] == ["A bear. A heist!", "A heist! Done?"]
+
+
+def test_chunk_records_point_back_to_their_parent():
+    chunks = list(iter_chunks(MOVIES + [LONG], size=8, overlap=2))
+    assert [c["id"] for c in chunks] == list(range(len(chunks)))
+    long_chunks = [c for c in chunks if c["parent_id"] == 7]
+    assert len(long_chunks) > 1
+    for chunk in long_chunks:
+        assert LONG["description"][chunk["start"]:chunk["end"]] == chunk["description"]
+        assert chunk["title"] == "Long Story"
+
+
+def test_aggregate_max_and_sum():
+    parents = {0: 1, 1: 1, 2: 2}
+    hits = [(0, 3.0), (2, 2.5), (1, 2.0)]
+    assert aggregate_chunks(hits, parents.get, 5, "max") == [(1, 3.0), (2, 2.5)]
+    assert aggregate_chunks(hits, parents.get, 1, "sum") == [(1, 5.0)]
+    with pytest.raises(ValueError):
+        aggregate_chunks(hits, parents.get, 5, "mean")
+
+
+def test_chunk_index_finds_text_past_the_first_chunk(tmp_path):
+    chunk_index = ChunkIndex(tmp_path / "chunks.bin")
+    chunk_index.build(MOVIES + [LONG], size=8, overlap=2)
+    loaded = ChunkIndex(tmp_path / "chunks.bin")
+    loaded.load()
+    assert loaded.search("heist", 5)[0][0] in {2, 7}
+    assert {parent for parent, _ in loaded.search("heist end", 5)} == {2, 7}
+    hits = loaded.chunk_hits("heist end", 5)
+    assert loaded.best_chunks(hits)[7]["description"].endswith("very end")
+
+
+class FakeSemantic:
+    model_name = "test-model"
+
+    def load_or_create_embeddings(self, documents):
+        self.documents = list(documents)
+
+    def search(self, query, limit):
+        #the last chunks score best, like a query about the end of the long description
+        return [(row, 1.0 - i / 100) for i, row in enumerate(reversed(range(len(self.documents))))][:limit]
+
+
+def test_chunked_semantic_search_answers_with_movies(tmp_path):
+    from lib.chunked_search import ChunkedSemanticSearch
+
+    chunked = ChunkedSemanticSearch(FakeSemantic(), tmp_path / "chunks.npy", tmp_path / "keys.json")
+    assert chunked.semantic.store.embeddings_path == tmp_path / "chunks.npy"
+    chunked.load_or_create(MOVIES + [LONG], size=8, overlap=2)
+    assert chunked.search("the end", 2) == [(7, 1.0), (4, pytest.approx(1.0 - 6 / 100))]
+
+
+@pytest.mark.parametrize("command", [["chunk", "--chunk-size", "4"], ["semantic_chunk", "--max-chunk-size", "4"]])
+def test_cli_reports_a_bad_overlap(command):
+    cli_dir = Path(__file__).parent
+    result = subprocess.run([sys.executable, "semantic_search_cli.py", command[0], "one. two. three.", *command[1:],
+                             "--overlap", "200"], cwd=cli_dir, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert "overlap must be at least 0 and smaller than the chunk size" in result.stdout
+    assert "Traceback" not in result.stderr
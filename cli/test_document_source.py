@@ -0,0 +1,56 @@
+import json
+import pytest
+from document_source import iter_documents, iter_json_array, iter_jsonl
+from keyword_search_utils import InvertedIndex
+from test_keyword_search_utils import MOVIES
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_json_array_streams_every_element(tmp_path, chunk_size):
+    path = tmp_path / "movies.json"
+    #other keys before and after the array, numbers that straddle chunk boundaries
+    data = {"version": 12345, "meta": {"movies": "not this one"}, "movies": MOVIES + [{"id": 67890, "title": "é"}],
+            "tail": [1, 2]}
+    path.write_text(json.dumps(data, indent=2, ensure_ascii=False), encoding="utf-8")
+    assert list(iter_json_array(path, chunk_size=chunk_size)) == data["movies"]
+
+
+def test_bare_and_empty_arrays(tmp_path):
+    path = tmp_path / "movies.json"
+    path.write_text(json.dumps(MOVIES))
+    assert list(iter_json_array(path)) == MOVIES
+    path.write_text('{"movies": [ ]}')
+    assert list(iter_json_array(path)) == []
+
+
+def test_bad_json_raises(tmp_path):
+    path = tmp_path / "movies.json"
+    path.write_text('{"movies": [{"id": 1}, {"id": ')
+    with pytest.raises(ValueError):
+        list(iter_json_array(path, chunk_size=4))
+    path.write_text('{"films": []}')
+    with pytest.raises(ValueError):
+        list(iter_json_array(path))
+
+
+def test_jsonl(tmp_path):
+    path = tmp_path / "movies.jsonl"
+    path.write_text("\n".join(json.dumps(movie) for movie in MOVIES) + "\n\n")
+    assert list(iter_jsonl(path)) == MOVIES
+    assert list(iter_documents(path)) == MOVIES
+
+
+def test_builds_from_a_stream_match(tmp_path):
+    path = tmp_path / "movies.jsonl"
+    path.write_text("\n".join(json.dumps(movie) for movie in MOVIES))
+    want = InvertedIndex()
+    want.build_from_movies(MOVIES)
+
+    streamed = InvertedIndex()
+    streamed.build(path)
+    assert streamed.doc_length == want.doc_length
+    assert streamed.bm25_search("space bear") == want.bm25_search("space bear")
+
+    parallel = InvertedIndex()
+    parallel.build_parallel(iter_documents(path), workers=2, shard_size=1)
+    assert parallel.bm25_search("honey bear", 3) == want.bm25_search("honey bear", 3)
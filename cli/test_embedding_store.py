@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from lib.embedding_store import EmbeddingStore
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.seen = []
+
+    def __call__(self, texts):
+        self.seen.extend(texts)
+        return np.array([[len(text), text.count("a"), 1.0] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EmbeddingStore("test-model", tmp_path / "embeddings.npy", tmp_path / "keys.json")
+
+
+def test_only_new_or_changed_texts_are_encoded(store):
+    encoder = CountingEncoder()
+    first = store.get_or_encode(["a bear", "the matrix", "honey"], encoder)
+    assert encoder.seen == ["a bear", "the matrix", "honey"]
+
+    encoder.seen.clear()
+    second = store.get_or_encode(["honey", "a bear", "a banana heist"], encoder)
+    assert encoder.seen == ["a banana heist"]
+    assert (store.reused, store.encoded, store.dropped) == (2, 1, 1)
+    np.testing.assert_array_equal(second[0], first[2])
+    np.testing.assert_array_equal(second[1], first[0])
+
+    keys, stored = store.load()
+    assert len(keys) == 3
+    np.testing.assert_array_equal(stored, second)
+
+
+def test_model_change_invalidates(store):
+    store.get_or_encode(["a bear"], CountingEncoder())
+
+    encoder = CountingEncoder()
+    other = EmbeddingStore("other-model", store.embeddings_path, store.keys_path)
+    other.get_or_encode(["a bear"], encoder)
+    assert encoder.seen == ["a bear"]
+
+
+def test_empty_corpus_then_documents(store):
+    assert store.get_or_encode([], CountingEncoder()).shape[0] == 0
+    embeddings = store.get_or_encode(["a bear", "honey"], CountingEncoder())
+    assert embeddings.shape == (2, 3)
+
+
+def test_save_stream_writes_a_loadable_matrix(store):
+    encoder = CountingEncoder()
+    texts = ["a bear", "the matrix", "honey"]
+    batches = (([store.key(t) for t in batch], encoder(batch)) for batch in [texts[:2], [], texts[2:]])
+    assert store.save_stream(batches) == 3
+    keys, embeddings = store.load()
+    assert keys == [store.key(t) for t in texts]
+    np.testing.assert_array_equal(embeddings, encoder(texts))
+    #a later incremental load reuses every streamed row
+    encoder.seen.clear()
+    store.get_or_encode(texts, encoder)
+    assert encoder.seen == []
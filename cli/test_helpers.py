@@ -1,3 +1,7 @@
+import subprocess
+import sys
+from pathlib import Path
+import numpy as np
 import pytest
 import helpers as mod
 from helpers import *
@@ -111,6 +115,36 @@ def test_stem():
     test_cases = [Case(**things) for things in test_cases]
     RUN(mod.stem, test_cases=test_cases)
 
+def test_tokenizer():
+    tokenizer = mod.Tokenizer(["the", "a"])
+    assert tokenizer.tokenise("The bears, a Honey heist!") == ["bear", "honey", "heist"]
+    assert tokenizer.tokenise_many(["running bears", ""]) == [["run", "bear"], []]
+    assert mod.tokenise_many(["The Matrix", "boots"]) == [mod.tokenise("The Matrix"), mod.tokenise("boots")]
+
+def test_normalize():
+    vectors = np.array([[3.0, 4.0], [0.0, 0.0], [1.0, 0.0]])
+    got = mod.normalize(vectors)
+    np.testing.assert_allclose(got, [[0.6, 0.8], [0.0, 0.0], [1.0, 0.0]])
+    assert got[0] @ got[2] == pytest.approx(mod.similarity(vectors[0], vectors[2]))
+
+def test_top_k_indices():
+    scores = np.array([0.1, 0.9, 0.3, 0.7, 0.5])
+    np.testing.assert_array_equal(mod.top_k_indices(scores, 3), [1, 3, 4])
+    np.testing.assert_array_equal(mod.top_k_indices(scores, 10), [1, 3, 4, 2, 0])
+    assert mod.top_k_indices(scores, 0).shape == (0,)
+
+    batch = np.array([[0.1, 0.9, 0.3], [0.8, 0.2, 0.4]])
+    np.testing.assert_array_equal(mod.top_k_indices(batch, 2), [[1, 2], [0, 2]])
+
+def test_cli_imports_are_lazy():
+    #run from a directory without data/ so an eager stop words read would fail too
+    code = ("import sys, handlers, semantic_search_cli, keyword_search_cli; "
+            "print(sorted({'numpy', 'nltk', 'tqdm', 'sentence_transformers', 'asyncio'} & sys.modules.keys()))")
+    cli_dir = Path(__file__).parent
+    result = subprocess.run([sys.executable, "-c", code], cwd=cli_dir, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
 if __name__=="__main__":
     test_simplify()
     test_tokenize()
@@ -0,0 +1,47 @@
+import time
+import pytest
+from keyword_search_utils import InvertedIndex
+from lib.hybrid_search import HybridSearch, fuse, normalise_scores, rrf_fuse
+from test_keyword_search_utils import MOVIES
+
+
+class SlowSemantic:
+    documents = MOVIES
+
+    def search(self, query, limit):
+        time.sleep(0.2)
+        return [(2, 0.9), (0, 0.8), (3, 0.1)][:limit]
+
+
+def test_rrf_rewards_documents_both_lists_agree_on():
+    keyword = [(1, 9.0), (2, 5.0), (4, 1.0)]
+    semantic = [(3, 0.9), (2, 0.8), (4, 0.1)]
+    fused = rrf_fuse([keyword, semantic], 4, rrf_k=60)
+    assert [doc_id for doc_id, _ in fused] == [2, 4, 1, 3]
+    assert fused[0][1] == pytest.approx(2 / 62)
+
+
+def test_weighted_fusion():
+    assert normalise_scores([(1, 3.0), (2, 1.0), (3, 2.0)]) == {1: 1.0, 2: 0.0, 3: 0.5}
+    keyword = [(1, 10.0), (2, 0.0)]
+    semantic = [(2, 0.9), (3, 0.1)]
+    assert fuse(keyword, semantic, 3, "weighted", alpha=1.0)[0][0] == 1
+    assert fuse(keyword, semantic, 3, "weighted", alpha=0.0)[0][0] == 2
+    with pytest.raises(ValueError):
+        fuse(keyword, semantic, 3, "average")
+
+
+def test_branches_run_concurrently():
+    inv_idx = InvertedIndex()
+    inv_idx.build_from_movies(MOVIES)
+    hybrid = HybridSearch(inv_idx, SlowSemantic())
+    original = inv_idx.bm25_search
+    inv_idx.bm25_search = lambda query, k: time.sleep(0.2) or original(query, k)
+
+    start = time.perf_counter()
+    results = hybrid.search("honey bear", 3)
+    assert time.perf_counter() - start < 0.35
+    hybrid.close()
+    #movie 3 (row 2) tops the semantic list, the bear movies top BM25
+    assert {doc_id for doc_id, _ in results} <= {1, 2, 3, 4}
+    assert results[0][0] in {1, 3}
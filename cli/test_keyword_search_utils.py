@@ -0,0 +1,205 @@
+import pickle
+from collections import Counter
+import pytest
+from keyword_search_utils import InvertedIndex
+from index_format import decode_positions, encode_positions
+
+MOVIES = [
+    {"id": 1, "title": "Boots the Bear", "description": "a bear who loves boots and honey"},
+    {"id": 2, "title": "Honey Heist", "description": "two bears plan a honey heist"},
+    {"id": 3, "title": "The Matrix", "description": "a hacker learns the world is a simulation"},
+    {"id": 4, "title": "Space Bears", "description": "bears in space, bears on the moon, bear bear bear"},
+]
+
+
+@pytest.fixture
+def inv_idx():
+    idx = InvertedIndex()
+    idx.build_from_movies(MOVIES)
+    return idx
+
+
+def full_scan(idx: InvertedIndex, tokens: list[str]) -> dict[int, float]:
+    return {doc_id: sum(idx.get_bm25(doc_id, token) for token in tokens) for doc_id in idx.index}
+
+
+def test_bm25_scores_match_full_scan(inv_idx):
+    for query in [["bear"], ["honey", "bear"], ["simul"], ["bear", "bear"]]:
+        got = inv_idx.bm25_scores(query)
+        want = {doc_id: score for doc_id, score in full_scan(inv_idx, query).items() if score > 0}
+        assert got.keys() == want.keys()
+        for doc_id in want:
+            assert got[doc_id] == pytest.approx(want[doc_id])
+
+
+def test_bm25_search_only_returns_matches(inv_idx):
+    results = inv_idx.bm25_search("matrix")
+    assert [doc_id for doc_id, _ in results] == [3]
+
+
+@pytest.mark.parametrize("k", [1, 2, 3, 10])
+@pytest.mark.parametrize("query", ["bear", "honey bear", "bear heist moon", "hacker honey boots"])
+def test_top_k_matches_full_sort(inv_idx, query, k):
+    everything = inv_idx.bm25_search(query)
+    for maxscore in [False, True]:
+        got = inv_idx.bm25_search(query, k, maxscore=maxscore)
+        assert [doc_id for doc_id, _ in got] == [doc_id for doc_id, _ in everything[:k]]
+        assert [score for _, score in got] == pytest.approx([score for _, score in everything[:k]])
+
+
+def test_upper_bounds_cover_every_posting(inv_idx):
+    for token, postings in inv_idx.docmap.items():
+        idf = inv_idx.token_bm25_idf(token)
+        for doc_id in postings:
+            assert idf * inv_idx.get_bm25_tf(doc_id, token) <= inv_idx.term_upper_bounds[token] + 1e-9
+
+
+def test_saved_index_answers_like_the_built_one(inv_idx, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    inv_idx.save()
+
+    loaded = InvertedIndex()
+    loaded.load()
+    assert len(loaded.index) == len(MOVIES)
+    assert loaded.index[2] == MOVIES[1]
+    assert 5 not in loaded.index
+    with pytest.raises(KeyError):
+        loaded.doc_length[-1]
+    assert loaded.avg_doc_len == pytest.approx(inv_idx.avg_doc_len)
+    assert sorted(loaded.docmap) == sorted(inv_idx.docmap)
+    assert loaded.get_tf(4, "bear") == inv_idx.get_tf(4, "bear") == 6
+    for query in ["bear", "honey bear", "hacker honey boots"]:
+        assert loaded.bm25_search(query, 3, maxscore=True) == pytest.approx(inv_idx.bm25_search(query, 3))
+
+
+def test_migrate_from_pickles(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "cache").mkdir()
+    old = {
+        "index.pkl": {movie["id"]: movie for movie in MOVIES[:2]},
+        "docmap.pkl": {"bear": [1], "honey": [2, 1]},
+        "doclen.pkl": {1: 3, 2: 2},
+        "term_frequencies.pkl": {1: Counter(bear=2, honey=1), 2: Counter(honey=2)},
+    }
+    for name, value in old.items():
+        with open(tmp_path / "cache" / name, "wb") as f:
+            pickle.dump(value, f)
+
+    with pytest.raises(FileNotFoundError):
+        InvertedIndex().load()
+
+    InvertedIndex().migrate()
+    loaded = InvertedIndex()
+    loaded.load()
+    assert list(loaded.docmap["honey"]) == [1, 2]
+    assert loaded.get_tf(2, "honey") == 2
+    assert loaded.avg_doc_len == 2.5
+
+
+def test_out_of_order_ids_give_sorted_postings():
+    idx = InvertedIndex()
+    idx.build_from_movies(reversed(MOVIES))
+    assert list(idx.docmap["bear"]) == [1, 2, 4]
+    assert list(idx.docmap["bear"].tfs) == [2, 1, 6]
+
+
+def test_merged_segments_match_serial_build(inv_idx):
+    #interleaved shards force a real k-way merge
+    segments = [InvertedIndex.index_shard(MOVIES[0::2]), InvertedIndex.index_shard(MOVIES[1::2])]
+    merged = InvertedIndex()
+    merged.merge_segments(segments)
+    assert {t: list(p) for t, p in merged.docmap.items()} == {t: list(p) for t, p in inv_idx.docmap.items()}
+    assert merged.bm25_search("honey bear") == inv_idx.bm25_search("honey bear")
+
+
+def test_parallel_build(inv_idx):
+    parallel = InvertedIndex()
+    parallel.build_parallel(MOVIES, workers=2, shards_per_worker=2)
+    assert parallel.doc_length == inv_idx.doc_length
+    assert parallel.bm25_search("space bear", 2) == inv_idx.bm25_search("space bear", 2)
+
+
+def test_idf_is_cached(inv_idx):
+    inv_idx.token_bm25_idf("bear")
+    assert "bear" in inv_idx.idf_cache
+
+
+@pytest.fixture
+def positional_idx():
+    idx = InvertedIndex(positional=True)
+    idx.build_from_movies(MOVIES)
+    return idx
+
+
+def test_position_varints_round_trip():
+    positions = [0, 1, 5, 127, 128, 300, 70000]
+    data = encode_positions(positions)
+    assert decode_positions(data) == positions
+    #gaps under 128 take one byte
+    assert len(encode_positions([1, 2, 3])) == 3
+
+
+def test_phrase_matches_need_adjacent_terms(positional_idx):
+    assert positional_idx.phrase_matches("honey heist") == {2: 2}
+    assert positional_idx.phrase_matches("heist honey") == {}
+    #"the" is a stop word, it still holds its position
+    assert positional_idx.phrase_matches("hacker learns the world") == {3: 1}
+    assert positional_idx.phrase_matches("hacker learns world") == {}
+    assert [doc_id for doc_id, _ in positional_idx.phrase_search("bear bear")] == [4]
+
+
+def test_proximity_boosts_adjacent_terms(positional_idx):
+    plain = dict(positional_idx.bm25_search("space bears"))
+    boosted = dict(positional_idx.proximity_search("space bears", 4))
+    assert boosted.keys() == plain.keys()
+    assert boosted[4] > plain[4]
+
+
+def test_positions_survive_save_and_merge(positional_idx, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    positional_idx.save()
+    loaded = InvertedIndex()
+    loaded.load()
+    assert loaded.positional
+    assert loaded.phrase_matches("honey heist") == positional_idx.phrase_matches("honey heist")
+
+    segments = [InvertedIndex.index_shard(MOVIES[0::2], True), InvertedIndex.index_shard(MOVIES[1::2], True)]
+    merged = InvertedIndex(positional=True)
+    merged.merge_segments(segments)
+    assert merged.phrase_search("bears in space") == positional_idx.phrase_search("bears in space")
+
+
+def test_phrase_search_needs_positions(inv_idx):
+    with pytest.raises(ValueError):
+        inv_idx.phrase_search("honey heist")
+
+
+def test_impact_scores_follow_bm25(tmp_path, monkeypatch):
+    idx = InvertedIndex(impacts=True)
+    idx.build_from_movies(MOVIES)
+    k1, b, scale = idx.impact_params
+    for query in ["bear", "honey bear", "hacker honey boots", "space bears moon"]:
+        exact = dict(idx.bm25_search(query))
+        approx = idx.bm25_search(query, impacts=True)
+        assert idx.bm25_search(query, 2, maxscore=True, impacts=True) == approx[:2]
+        #each term is off by at most half a quantisation step
+        for doc_id, score in approx:
+            assert score == pytest.approx(exact[doc_id], abs=len(query.split()) * scale / 2)
+
+    monkeypatch.chdir(tmp_path)
+    idx.save()
+    loaded = InvertedIndex()
+    loaded.load()
+    assert loaded.impact_params == idx.impact_params
+    assert loaded.bm25_search("honey bear", 3, impacts=True) == idx.bm25_search("honey bear", 3, impacts=True)
+    #impacts computed for another k1 / b are refused, not recomputed behind the caller's back
+    monkeypatch.setattr("keyword_search_utils.BM25_B", 0.5)
+    with pytest.raises(ValueError, match="b=0.5"):
+        loaded.bm25_search("bear", impacts=True)
+    loaded.compute_impacts()
+    assert loaded.impact_params[:2] == (k1, 0.5)
+
+
+def test_impacts_need_building(inv_idx):
+    with pytest.raises(ValueError):
+        inv_idx.bm25_search("bear", impacts=True)
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from helpers import normalize, top_k_indices
+from lib.quantization import QuantizedEmbeddings, load_or_build_quantized, quantized_path
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    return normalize(rng.normal(size=(2000, 32))).astype(np.float32)
+
+
+@pytest.mark.parametrize("precision,params,bytes_per_row", [
+    ("float32", {}, 128), ("float16", {}, 64), ("int8", {}, 32), ("pq", {"subspaces": 8}, 8)])
+def test_codes_shrink_and_rerank_recovers_the_exact_order(vectors, precision, params, bytes_per_row):
+    quantized = QuantizedEmbeddings.build(precision, vectors, rerank=8, **params)
+    assert quantized.codes.nbytes == bytes_per_row * len(vectors)
+
+    for query in vectors[:20]:
+        approximate = quantized.codec.scores(quantized.codes, query)
+        assert np.abs(approximate - vectors @ query).max() < 0.5
+        ids, scores = quantized.search(query, 5)
+        exact = top_k_indices(vectors @ query, 5)
+        assert ids[0] == exact[0]
+        np.testing.assert_allclose(scores, (vectors @ query)[ids], rtol=1e-5)
+
+
+def test_int8_scores_are_close(vectors):
+    quantized = QuantizedEmbeddings.build("int8", vectors)
+    approximate = quantized.codec.scores(quantized.codes, vectors[0])
+    np.testing.assert_allclose(approximate, vectors @ vectors[0], atol=0.02)
+
+
+def test_saved_codes_are_reused(vectors, tmp_path):
+    path = quantized_path("int8", tmp_path / "embeddings.npy")
+    built = load_or_build_quantized("int8", vectors, path)
+    mtime = path.stat().st_mtime_ns
+    loaded = load_or_build_quantized("int8", vectors, path)
+    assert path.stat().st_mtime_ns == mtime
+    np.testing.assert_array_equal(loaded.codes, built.codes)
+
+    load_or_build_quantized("int8", vectors[:100], path)
+    assert path.stat().st_mtime_ns != mtime
+
+
+def test_codec_parameters_and_source_file_decide_staleness(vectors, tmp_path, monkeypatch):
+    source = tmp_path / "embeddings.npy"
+    np.save(source, vectors)
+    path = quantized_path("pq", source)
+    load_or_build_quantized("pq", vectors, path, source=source, subspaces=8)
+    mtime = path.stat().st_mtime_ns
+
+    #with a source file the check never hashes the matrix
+    monkeypatch.setattr("lib.quantization.fingerprint", lambda vectors: pytest.fail("hashed the vectors"))
+    assert load_or_build_quantized("pq", vectors, path, source=source, subspaces=8).codec.subspaces == 8
+    assert path.stat().st_mtime_ns == mtime
+
+    rebuilt = load_or_build_quantized("pq", vectors, path, source=source, subspaces=4)
+    assert rebuilt.codes.shape == (len(vectors), 4)
+    mtime = path.stat().st_mtime_ns
+    load_or_build_quantized("pq", vectors, path, source=source, subspaces=4, iterations=3)
+    assert path.stat().st_mtime_ns != mtime
+
+    mtime = path.stat().st_mtime_ns
+    np.save(source, vectors[:100])
+    load_or_build_quantized("pq", vectors[:100], path, source=source, subspaces=4, iterations=3)
+    assert path.stat().st_mtime_ns != mtime
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from lib.query_cache import QueryEmbeddingCache, cache_file_stats, normalise_text
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.seen = []
+
+    def __call__(self, texts):
+        self.seen.extend(texts)
+        return np.array([[len(text), 1.0, 0.0] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "queries.bin"
+
+
+def test_near_repeats_skip_the_encoder(path):
+    assert normalise_text("  Funny BEAR movies?! ") == "funny bear movies"
+    cache = QueryEmbeddingCache("model", 3, path, capacity=8)
+    encoder = CountingEncoder()
+    first = cache.get_or_encode(["funny bear movies", "space"], encoder)
+    again = cache.get_or_encode(["Funny bear movies!", "space", "SPACE "], encoder)
+    assert encoder.seen == ["funny bear movies", "space"]
+    np.testing.assert_array_equal(again, first[[0, 1, 1]])
+    assert (cache.hits, cache.misses) == (3, 2)
+
+
+def test_cache_persists_across_opens(path):
+    cache = QueryEmbeddingCache("model", 3, path, capacity=8)
+    cache.get_or_encode(["bear"], CountingEncoder())
+    cache.close()
+
+    encoder = CountingEncoder()
+    reopened = QueryEmbeddingCache("model", 3, path, capacity=8)
+    reopened.get_or_encode(["bear"], encoder)
+    assert encoder.seen == []
+    assert cache_file_stats(path)["entries"] == 1
+    assert reopened.stats()["hits"] == 1
+
+    #another model never sees these vectors
+    other = QueryEmbeddingCache("other", 3, path, capacity=8)
+    assert other.get("bear") is None
+
+
+def test_clock_keeps_recently_used_queries(path):
+    cache = QueryEmbeddingCache("model", 3, path, capacity=3)
+    for text in ["a", "b", "c"]:
+        cache.put(text, np.ones(3))
+    cache.get("a")
+    cache.put("d", np.ones(3))
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert len(cache.slots) == 3
+
+
+def test_handles_on_one_file_stay_consistent(path):
+    #e.g. a CLI search writing to the cache a running server has open
+    first = QueryEmbeddingCache("model", 3, path, capacity=2)
+    second = QueryEmbeddingCache("model", 3, path, capacity=2)
+    first.put("a", np.full(3, 1.0))
+    first.put("b", np.full(3, 2.0))
+    second.put("c", np.full(3, 3.0))
+    second.put("d", np.full(3, 4.0))
+    #first never saw c or d and must neither return a stale vector nor fail evicting them
+    assert first.get("a") is None
+    np.testing.assert_array_equal(first.get("d"), np.full(3, 4.0))
+    first.put("e", np.full(3, 5.0))
+    np.testing.assert_array_equal(second.get("e"), np.full(3, 5.0))
+    assert second.stats()["hits"] == first.stats()["hits"] == 2
+    assert first.stats()["misses"] == 1
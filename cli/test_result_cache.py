@@ -0,0 +1,58 @@
+import pytest
+from result_cache import ResultCache, file_version
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_key_normalises_the_query_and_includes_parameters():
+    cache = ResultCache()
+    cache.put("keyword", "Honey  Bear", "v1", [[1, 2.0]], limit=5)
+    assert cache.get("keyword", "honey bear ", "v1", limit=5) == [[1, 2.0]]
+    assert cache.get("keyword", "honey bear", "v1", limit=10) is None
+    assert cache.get("semantic", "honey bear", "v1", limit=5) is None
+    assert cache.get("keyword", "honey bear", "v2", limit=5) is None
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_lru_and_ttl():
+    clock = Clock()
+    cache = ResultCache(max_entries=2, ttl=60, clock=clock)
+    cache.put("keyword", "a", "v", 1)
+    cache.put("keyword", "b", "v", 2)
+    assert cache.get("keyword", "a", "v") == 1
+    cache.put("keyword", "c", "v", 3)
+    #b was the least recently used
+    assert cache.get("keyword", "b", "v") is None
+    assert cache.get("keyword", "a", "v") == 1
+
+    clock.now += 61
+    assert cache.get("keyword", "a", "v") is None
+    assert cache.get_or_compute("keyword", "a", "v", lambda: 4) == 4
+
+
+def test_disk_tier_survives_and_drops_old_versions(tmp_path):
+    path = tmp_path / "results.sqlite"
+    cache = ResultCache(disk_path=path)
+    cache.put("keyword", "bear", "v1", [[1, 2.5]], limit=5)
+    cache.close()
+
+    cache = ResultCache(disk_path=path)
+    assert cache.get("keyword", "bear", "v1", limit=5) == [[1, 2.5]]
+    cache.put("keyword", "moon", "v2", [[4, 1.0]], limit=5)
+    assert cache.db.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 1
+    cache.close()
+
+
+def test_file_version_changes_with_the_file(tmp_path):
+    path = tmp_path / "index.bin"
+    assert file_version(path) == "missing"
+    path.write_bytes(b"one")
+    first = file_version(path)
+    path.write_bytes(b"other")
+    assert file_version(path) != first
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import pytest
+from keyword_search_utils import InvertedIndex
+from result_cache import ResultCache
+from search_server import SearchServer, parse_address, query_server
+from test_keyword_search_utils import MOVIES
+
+
+class FakeSemantic:
+    documents = MOVIES
+
+    def __init__(self):
+        self.calls = 0
+
+    def search(self, query, limit):
+        self.calls += 1
+        return [(3, 0.9), (0, 0.5)][:limit]
+
+
+async def stop_serving(server: asyncio.Server):
+    server.close()
+    await server.wait_closed()
+
+
+@pytest.fixture
+def served(tmp_path):
+    inv_idx = InvertedIndex()
+    inv_idx.index_file_path = tmp_path / "index.bin"
+    inv_idx.build_from_movies(MOVIES)
+    inv_idx.save()
+    loaded = InvertedIndex()
+    loaded.index_file_path = inv_idx.index_file_path
+    loaded.load()
+
+    server = SearchServer(loaded, FakeSemantic(), workers=1, cache=ResultCache())
+    loop = asyncio.new_event_loop()
+    address = f"unix:{tmp_path / 'search.sock'}"
+    loop.run_until_complete(server.start(address))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield address, server
+    #let open connections finish closing before the loop goes away
+    asyncio.run_coroutine_threadsafe(stop_serving(server.server), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    server.close()
+    loop.close()
+
+
+def test_parse_address():
+    assert parse_address("http://127.0.0.1:8765") == ("tcp", ("127.0.0.1", 8765))
+    assert parse_address("unix:/tmp/rag.sock") == ("unix", "/tmp/rag.sock")
+    with pytest.raises(ValueError):
+        parse_address("127.0.0.1")
+
+
+def test_keyword_and_semantic_queries(served):
+    address, server = served
+    want = InvertedIndex()
+    want.build_from_movies(MOVIES)
+    got = query_server(address, "keyword", "honey bear", 2)
+    assert [(hit["id"], hit["score"]) for hit in got] == pytest.approx(want.bm25_search("honey bear", 2))
+    assert got[0]["title"] == want.index[got[0]["id"]]["title"]
+
+    assert [hit["id"] for hit in query_server(address, "semantic", "space", 2)] == [4, 1]
+    hybrid = query_server(address, "hybrid", "space bears", 3, method="weighted", alpha=0.5)
+    assert hybrid[0]["id"] == 4
+    with pytest.raises(RuntimeError):
+        query_server(address, "telepathic", "space")
+
+
+def test_repeated_queries_come_from_the_cache(served):
+    address, server = served
+    first = query_server(address, "semantic", "Space", 2)
+    assert query_server(address, "semantic", "space ", 2) == first
+    assert server.semantic.calls == 1
+    query_server(address, "semantic", "space", 1)
+    assert server.semantic.calls == 2
+
+
+def test_keyword_options_reach_the_server(served):
+    address, server = served
+    want = InvertedIndex()
+    want.build_from_movies(MOVIES)
+    got = query_server(address, "keyword", "honney bearr", 3, fuzzy=True, maxscore=True)
+    assert [(hit["id"], hit["score"]) for hit in got] == pytest.approx(want.bm25_search("honney bearr", 3, fuzzy=True))
+    assert got
+    assert query_server(address, "keyword", "honney bearr", 3) == []
+    #options the mode can't honour are refused instead of ignored
+    with pytest.raises(RuntimeError, match="rerank"):
+        query_server(address, "semantic", "space", 2, rerank=8)
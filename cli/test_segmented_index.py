@@ -0,0 +1,97 @@
+import pytest
+from keyword_search_utils import InvertedIndex
+from segmented_index import SegmentedIndex
+from test_keyword_search_utils import MOVIES
+
+MORE_MOVIES = [
+    {"id": 5, "title": "Bear Necessities", "description": "a jungle bear sings"},
+    {"id": 6, "title": "Moon Heist", "description": "thieves plan a heist on the moon"},
+]
+
+
+def rebuilt(movies):
+    idx = InvertedIndex()
+    idx.build_from_movies(movies)
+    return idx
+
+
+def assert_same_results(seg_idx, idx, query):
+    got, want = seg_idx.bm25_search(query), idx.bm25_search(query)
+    assert [doc_id for doc_id, _ in got] == [doc_id for doc_id, _ in want]
+    assert [score for _, score in got] == pytest.approx([score for _, score in want])
+
+
+@pytest.fixture
+def seg_idx(tmp_path):
+    idx = SegmentedIndex(tmp_path / "segments", merge_factor=3)
+    idx.add_movies(MOVIES[:2])
+    idx.add_movies(MOVIES[2:])
+    return idx
+
+
+def test_search_spans_segments(seg_idx):
+    assert len(seg_idx.segments) == 2
+    assert_same_results(seg_idx, rebuilt(MOVIES), "honey bear moon")
+
+
+def test_delete_and_update(seg_idx):
+    seg_idx.delete([2])
+    assert 2 not in [doc_id for doc_id, _ in seg_idx.bm25_search("heist")]
+
+    seg_idx.add_movies([{"id": 1, "title": "Boots Returns", "description": "a heist"}])
+    assert seg_idx.get_document(1)["title"] == "Boots Returns"
+    assert seg_idx.live_doc_count() == 3
+
+
+def test_merge_policy_purges_tombstones(seg_idx, tmp_path):
+    seg_idx.delete([2])
+    seg_idx.add_movies(MORE_MOVIES)
+    #three segments of similar size make a tier
+    assert len(seg_idx.segments) == 1
+    assert not any(seg_idx.tombstones.values())
+
+    live = [movie for movie in MOVIES + MORE_MOVIES if movie["id"] != 2]
+    assert_same_results(seg_idx, rebuilt(live), "bear heist moon")
+
+    reopened = SegmentedIndex(tmp_path / "segments")
+    reopened.load()
+    assert_same_results(reopened, rebuilt(live), "bear heist moon")
+    assert len(list((tmp_path / "segments").glob("*.bin"))) == 1
+
+
+def test_background_merge(seg_idx):
+    seg_idx.add_movies(MORE_MOVIES, background=True)
+    seg_idx.wait_for_merges()
+    assert len(seg_idx.segments) == 1
+    assert_same_results(seg_idx, rebuilt(MOVIES + MORE_MOVIES), "bear")
+
+
+def test_merge_during_a_search(seg_idx, tmp_path, monkeypatch):
+    first_name, first = seg_idx.segments[0]
+    scores = first.bm25_scores
+
+    def merge_then_score(*args, **kwargs):
+        #a merge and a delete land while the search holds the old segments
+        seg_idx.delete([3])
+        seg_idx.force_merge()
+        assert (tmp_path / "segments" / f"{first_name}.bin").exists()
+        return scores(*args, **kwargs)
+
+    monkeypatch.setattr(first, "bm25_scores", merge_then_score)
+    #the search finishes on the segments and tombstones it started with
+    assert_same_results(seg_idx, rebuilt(MOVIES), "honey bear moon")
+    assert len(seg_idx.segments) == 1
+    assert [path.stem for path in (tmp_path / "segments").glob("*.bin")] == [seg_idx.segments[0][0]]
+    assert_same_results(seg_idx, rebuilt([movie for movie in MOVIES if movie["id"] != 3]), "honey bear moon")
+
+
+def test_searches_during_background_merges(seg_idx):
+    for i in range(6):
+        seg_idx.add_movies([{"id": 100 + i, "title": f"Bear {i}", "description": "bear"}], background=True)
+        seg_idx.delete([100 + i])
+        for _ in range(5):
+            seg_idx.bm25_search("bear")
+            seg_idx.get_document(1)
+    #deleted documents count towards the statistics until they are purged
+    seg_idx.force_merge()
+    assert_same_results(seg_idx, rebuilt(MOVIES), "bear")
@@ -0,0 +1,74 @@
+import random
+import pytest
+from keyword_search_utils import InvertedIndex
+from term_dictionary import DeleteIndex, TermDictionary, auto_distance, edit_distance
+from test_keyword_search_utils import MOVIES
+
+TERMS = sorted({"bear", "beard", "bears", "heist", "honey", "hone", "matrix", "simulation", "simulator", "space"})
+
+
+class CountingList(list):
+    ''' counts item reads, to check lookups don't scan the vocabulary '''
+    reads = 0
+
+    def __getitem__(self, i):
+        CountingList.reads += 1
+        return super().__getitem__(i)
+
+
+def test_edit_distance_stops_at_the_limit():
+    assert edit_distance("matrix", "matirx", 2) == 2
+    assert edit_distance("honey", "hone", 1) == 1
+    assert edit_distance("honey", "space", 2) == 3
+    assert auto_distance("ab") == 0 and auto_distance("honey") == 1 and auto_distance("simulation") == 2
+
+
+def test_prefix_is_a_range_of_the_sorted_terms():
+    terms = TermDictionary(TERMS)
+    assert terms.prefix("bear") == ["bear", "beard", "bears"]
+    assert terms.prefix("simul", limit=1) == ["simulation"]
+    assert terms.prefix("x") == []
+
+
+def test_fuzzy_matches_a_brute_force_scan():
+    rng = random.Random(0)
+    vocab = sorted({"".join(rng.choice("abcde") for _ in range(rng.randint(1, 10))) for _ in range(3000)})
+    terms = TermDictionary(vocab, DeleteIndex.build(vocab))
+    for word in rng.sample(vocab, 30) + ["abcdeabcdeab", "e"]:
+        word = word[:2] + "x" + word[3:]
+        for distance in (1, 2):
+            expected = sorted((term, d) for term in vocab if (d := edit_distance(word, term, distance)) <= distance)
+            assert sorted(terms.fuzzy(word, distance)) == expected
+
+
+def test_fuzzy_reads_few_entries():
+    rng = random.Random(1)
+    vocab = sorted({"".join(rng.choice("abcdefghij") for _ in range(8)) for _ in range(20000)})
+    deletes = DeleteIndex.build(vocab)
+    deletes.keys = CountingList(deletes.keys)
+    terms = TermDictionary(vocab, deletes)
+    CountingList.reads = 0
+    assert (vocab[100], 1) in terms.fuzzy(vocab[100][:3] + vocab[100][4:], 1)
+    assert CountingList.reads < 500
+
+
+def test_saved_deletes_belong_to_one_version(tmp_path):
+    deletes = DeleteIndex.build(TERMS)
+    deletes.save(tmp_path / "index.deletes", "v1")
+    assert DeleteIndex.load(tmp_path / "index.deletes", "v2") is None
+    loaded = DeleteIndex.load(tmp_path / "index.deletes", "v1")
+    assert TermDictionary(TERMS, loaded).fuzzy("matirx") == [("matrix", 2)]
+
+
+def test_fuzzy_bm25_search(tmp_path, monkeypatch):
+    idx = InvertedIndex()
+    idx.build_from_movies(MOVIES)
+    assert idx.bm25_search("honney heisst") == []
+    assert idx.bm25_search("honney heisst", fuzzy=True) == idx.bm25_search("honey heist")
+
+    monkeypatch.chdir(tmp_path)
+    idx.save()
+    loaded = InvertedIndex()
+    loaded.load()
+    assert loaded.bm25_search("matrx hackr", fuzzy=True) == idx.bm25_search("matrix hacker")
+    assert (tmp_path / "cache" / "index.deletes").exists()